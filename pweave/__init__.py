@@ -4,20 +4,30 @@
 
 
 from . import readers
+from . import formatters
+from . import processors
 from .pweb import *
-from .formatters import *
 from .readers import *
-from .processors import *
 from .config import *
 
 
 __version__ = '0.30.2dev'
 
+def __getattr__(name):
+    # Formatters and processors are imported when they are first used
+    if name in formatters.__all__:
+        return getattr(formatters, name)
+    if name in processors.__all__:
+        return getattr(processors, name)
+    raise AttributeError("module %r has no attribute %r" % (__name__, name))
+
 def weave(file, doctype=None, informat=None, kernel="python3", plot=True,
           docmode=False, cache=False,
           figdir='figures', cachedir='cache',
           figformat=None, listformats=False,
-          output=None, mimetype=None,):
+          output=None, mimetype=None, kernel_pool=None, stream=False,
+          profile=False, parse_cache=False, reuse_outputs=False, checkpoint=False,
+          serializer="pickle", from_chunk=None, pipeline=0, parallel=0):
     """
     Processes a Pweave document and writes output to a file
 
@@ -27,14 +37,39 @@ def weave(file, doctype=None, informat=None, kernel="python3", plot=True,
     :param kernel: ``string`` Jupyter kernel used to run code: default is python3
     :param plot: ``bool`` use matplotlib
     :param docmode: ``bool`` use documentation mode, chunk code and results will be loaded from cache and inline code will be hidden
-    :param cache: ``bool`` Cache results to disk for documentation mode
+    :param cache: ``bool`` Cache results of each chunk to disk, unchanged chunks are not executed again
     :param figdir: ``string`` directory path for figures
-    :param cachedir: ``string`` directory path for cached results used in documentation mode
+    :param cachedir: ``string`` directory path for cached results
     :param figformat: ``string`` format for saved figures (e.g. '.png'), if None then the default for each format is used
     :param listformats: ``bool`` List available formats and exit
     :param output: ``string`` output file
     :param mimetype: ``string`` Source document's text mimetype. This is used to set cell
                                 type in Jupyter notebooks.
+    :param kernel_pool: :py:class:`PwebKernelPool` to take a running kernel from instead
+                        of starting a new kernel
+    :param stream: ``bool`` write each chunk to the output file as soon as it has been executed
+                   instead of keeping all results in memory
+    :param profile: ``bool`` print the time spent in each stage and chunk and write
+                    the timings as Chrome trace events to a ``.trace.json`` file
+                    next to the output
+    :param parse_cache: ``bool`` store the parsed document in the cache directory and
+                        don't parse it again if it hasn't changed
+    :param reuse_outputs: ``bool`` use outputs stored in an executed notebook instead of
+                          running cells that haven't changed since it was run
+    :param checkpoint: ``bool`` store a checkpoint of the kernel namespace after each chunk,
+                       chunks with the checkpoint option are checkpointed in any case. Results
+                       are cached on disk and later runs restore the namespace from the latest
+                       valid checkpoint instead of running all cached chunks again.
+    :param serializer: ``string`` module used to store checkpoints: pickle, cloudpickle or dill
+    :param from_chunk: ``string`` name or number of a chunk to resume from, chunks above it
+                       are not run and the namespace is restored from the latest checkpoint
+    :param pipeline: ``int`` send the code of this many chunks to the kernel ahead of the
+                     running chunk, so the kernel doesn't wait for Pweave between chunks.
+                     Has no effect with the embedded Python kernel.
+    :param parallel: ``int`` number of extra Python kernels for running chunks that don't
+                     depend on the chunks above them at the same time. Dependencies are
+                     found from the names chunks define and use, see the ``depends`` chunk
+                     option.
     """
 
     if listformats:
@@ -46,17 +81,91 @@ def weave(file, doctype=None, informat=None, kernel="python3", plot=True,
 
     assert file != "" is not None, "No input specified"
 
+    profiler = None
+    if profile:
+        from .profiling import PwebProfiler
+        profiler = PwebProfiler()
+
     doc = Pweb(file, informat=informat, doctype=doctype,
                kernel=kernel, output=output, figdir=figdir,
-               mimetype=mimetype
-               )
+               mimetype=mimetype, kernel_pool=kernel_pool,
+               profiler=profiler, parse_cache=_parse_cache(parse_cache),
+               reuse_outputs=reuse_outputs)
     doc.documentationmode = docmode
+    doc.from_chunk = from_chunk
+
+    params = {"usematplotlib": plot,
+              "cachedir": cachedir,
+              "storeresults": cache,
+              "checkpoints": checkpoint,
+              "serializer": serializer,
+              "pipeline": pipeline,
+              "parallel": parallel}
+
+    with rc_context(params):
+        doc.weave(stream=stream)
+
+    if profiler is not None:
+        trace = os.path.splitext(doc.sink)[0] + ".trace.json"
+        profiler.write_trace(trace)
+        sys.stdout.write("\n" + profiler.table())
+        sys.stdout.write("Wrote trace events to %s\n" % trace)
+
+def _parse_cache(parse_cache):
+    if not parse_cache:
+        return None
+    from .parsecache import PwebParseCache
+    return PwebParseCache()
+
+def weave_batch(files, jobs=None, **kwargs):
+    """
+    Weaves several documents in parallel processes and prints a summary
+    of failures and timings. Errors in one document don't stop the others.
+
+    :param files: ``list`` of input files
+    :param jobs: ``int`` number of parallel processes, defaults to number of CPUs
+    :param kwargs: options passed to :py:func:`weave` for each document
+    :return: ``list`` of :py:class:`pweave.batch.PwebBatchResult`
+    """
+    from . import batch
+
+    results = batch.weave_batch(files, jobs, **kwargs)
+    batch.print_summary(results)
+    return results
+
+def watch(file, doctype=None, informat=None, kernel="python3", plot=True,
+          cache=False, figdir='figures', cachedir='cache', output=None,
+          mimetype=None, interval=0.5, debounce=0.5, parse_cache=False, snapshots=0,
+          pipeline=0):
+    """
+    Weaves a Pweave document and weaves it again when it or files read using the
+    ``source`` chunk option change. The kernel is kept running and only the chunks
+    starting from the first changed chunk are executed again. Stop with Ctrl-C.
+
+    :param interval: ``float`` seconds between checking files for changes
+    :param debounce: ``float`` seconds to wait for files to stop changing before weaving
+    :param snapshots: ``int`` keep this many forks of the Python kernel after chunks and
+                      continue from them when an earlier chunk changes, Linux only
+    :param pipeline: ``int`` send the code of this many chunks to the kernel ahead of the
+                     running chunk
+
+    See :py:func:`weave` for the other parameters.
+    """
+    from .watch import PwebWatcher
+
+    doc = Pweb(file, informat=informat, doctype=doctype,
+               kernel=kernel, output=output, figdir=figdir,
+               mimetype=mimetype, parse_cache=_parse_cache(parse_cache)
+               )
 
-    rcParams["usematplotlib"] = plot
-    rcParams["cachedir"] = cachedir
-    rcParams["storeresults"] = cache
+    params = {"usematplotlib": plot,
+              "cachedir": cachedir,
+              "storeresults": cache,
+              "snapshots": snapshots,
+              "pipeline": pipeline}
 
-    doc.weave()
+    with rc_context(params):
+        PwebWatcher(doc, interval, debounce).watch()
 
 def tangle(file, informat = None):
     """Tangles a noweb file i.e. extracts code from code chunks to a .py file
@@ -92,7 +201,6 @@ def publish(file, doc_format="html", theme="skeleton", latex_engine="pdflatex",
 
     doc.theme = theme
 
-    doc.read()
     doc.run()
     doc.format()
 
@@ -139,3 +247,9 @@ def convert(file, informat="noweb", outformat="script", pandoc_args=None,
 def listformats():
     """List output formats"""
     PwebFormats.listformats()
+
+
+# The lazily imported formatters and processors are not in the module namespace
+# until they are used, list them for "from pweave import *"
+__all__ = sorted(set(name for name in globals() if not name.startswith("_")) |
+                 set(formatters.__all__) | set(processors.__all__))
@@ -0,0 +1,137 @@
+"""
+Weave several documents in parallel processes
+"""
+
+import sys
+import io
+import time
+import traceback
+import contextlib
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+
+
+class PwebBatchResult(object):
+    """Result of weaving one document in a batch
+
+    :param file: ``string`` source document
+    :param error: ``string`` traceback if weaving failed, None if it succeeded
+    :param elapsed: ``float`` wall time in seconds
+    :param log: ``string`` output printed while weaving
+    """
+
+    def __init__(self, file, error=None, elapsed=0.0, log=""):
+        self.file = file
+        self.error = error
+        self.elapsed = elapsed
+        self.log = log
+
+    @property
+    def ok(self):
+        return self.error is None
+
+
+_kernel_pool = None
+
+
+def _worker_pool():
+    """Kernel pool shared by the documents woven in a worker process"""
+    global _kernel_pool
+    if _kernel_pool is None:
+        import atexit
+        from .processors.pool import PwebKernelPool
+
+        _kernel_pool = PwebKernelPool()
+        atexit.register(_kernel_pool.close)
+    return _kernel_pool
+
+
+def _weave_one(file, kwargs):
+    """Weave a document in a worker process"""
+    import pweave
+
+    log = io.StringIO()
+    error = None
+    start = time.time()
+    try:
+        with contextlib.redirect_stdout(log):
+            pweave.weave(file, kernel_pool=_worker_pool(), **kwargs)
+    except Exception:
+        error = traceback.format_exc()
+    return PwebBatchResult(file, error, time.time() - start, log.getvalue())
+
+
+def _weave_isolated(file, kwargs):
+    """Weave a document in a process of its own so that a crash
+    only affects this document"""
+    context = multiprocessing.get_context("spawn")
+    try:
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+            return executor.submit(_weave_one, file, kwargs).result()
+    except BrokenProcessPool:
+        return PwebBatchResult(file, "Worker process died while weaving %s\n" % file)
+
+
+def weave_batch(files, jobs=None, **kwargs):
+    """Weave documents in parallel processes. A failing document doesn't
+    stop the other documents from being woven.
+
+    :param files: ``list`` of input files
+    :param jobs: ``int`` number of parallel processes, defaults to number of CPUs
+    :param kwargs: options passed to :py:func:`pweave.weave` for each document
+    :return: ``list`` of :py:class:`PwebBatchResult` in the order of files
+    """
+    if jobs is None:
+        jobs = multiprocessing.cpu_count()
+    jobs = max(1, min(jobs, len(files)))
+    results = {}
+
+    # Download documents from URLs concurrently, the workers read them from the cache
+    from .fetch import prefetch
+    prefetch(files)
+    crashed = []
+
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=jobs, mp_context=context) as executor:
+        futures = dict((executor.submit(_weave_one, f, kwargs), i)
+                       for i, f in enumerate(files))
+        for future in as_completed(futures):
+            try:
+                result = future.result()
+            except BrokenProcessPool:
+                # One of the workers died, we can't tell which document caused it
+                crashed.append(futures[future])
+                continue
+            _print_progress(result)
+            results[futures[future]] = result
+
+    # Weave documents that were in progress when a worker died separately
+    if crashed:
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            isolated = executor.map(lambda i: _weave_isolated(files[i], kwargs), crashed)
+            for i, result in zip(crashed, isolated):
+                _print_progress(result)
+                results[i] = result
+
+    return [results[i] for i in range(len(files))]
+
+
+def _print_progress(result):
+    status = "Weaved" if result.ok else "FAILED"
+    sys.stdout.write("%s %s in %.1f s\n" % (status, result.file, result.elapsed))
+
+
+def print_summary(results):
+    """Print failures and timings of a batch"""
+    failed = [r for r in results if not r.ok]
+    total = sum(r.elapsed for r in results)
+
+    sys.stdout.write("\n%-8s %10s  %s\n" % ("Status", "Time (s)", "File"))
+    for r in sorted(results, key=lambda r: -r.elapsed):
+        sys.stdout.write("%-8s %10.2f  %s\n" % ("ok" if r.ok else "FAILED", r.elapsed, r.file))
+    sys.stdout.write("\nWeaved %i of %i documents, %.1f s of processing time\n" %
+                     (len(results) - len(failed), len(results), total))
+
+    for r in failed:
+        sys.stdout.write("\nError weaving %s:\n%s" % (r.file, r.error))
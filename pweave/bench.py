@@ -0,0 +1,356 @@
+"""
+Benchmarks for parsing, code execution and formatting.
+
+Run with ``python -m pweave.bench``, the results are written as JSON and
+can be compared to an earlier run with ``--compare``::
+
+    python -m pweave.bench -o before.json
+    python -m pweave.bench -o after.json --compare before.json
+"""
+
+import os
+import sys
+import gc
+import json
+import time
+import platform
+import tempfile
+import tracemalloc
+from optparse import OptionParser
+
+from .readers import PwebReaders
+from .formatters import PwebFormats
+from .config import rcParams
+
+#: File extensions of the generated documents for each reader
+extensions = {"noweb": ".texw", "markdown": ".pmd", "script": ".py", "notebook": ".ipynb"}
+
+#: Metrics where a larger value is better, for all other metrics smaller is better
+higher_is_better = {"chunks_per_second", "lines_per_second"}
+
+
+def chunk_code(i, outputs, figure_size):
+    """Code for the i:th generated code chunk"""
+    lines = ["x%i = %i" % (i, i)]
+    lines += ["print('output %i.%i')" % (i, j) for j in range(outputs)]
+    if figure_size > 0:
+        lines.append("display(Image(data=_figure(%i), format='png'))" % figure_size)
+    return "\n".join(lines)
+
+
+_setup_code = """from IPython.display import display, Image
+
+def _figure(size):
+    return b"\\x89PNG\\r\\n\\x1a\\n" + bytes(size)"""
+
+
+def data_listing(lines):
+    """Code chunk with a long data listing"""
+    rows = ["    (%i, %i.5, 'row %i')," % (i, i, i) for i in range(lines)]
+    return "\n".join(["data = ["] + rows + ["]"])
+
+
+def make_document(informat, chunks=100, outputs=1, figure_size=0, data_lines=0):
+    """Generate a document for a reader.
+
+    :param informat: ``string`` reader name from :py:class:`PwebReaders`
+    :param chunks: ``int`` number of code chunks
+    :param outputs: ``int`` number of printed lines in each chunk
+    :param figure_size: ``int`` size of a figure shown by each chunk in bytes,
+                        no figures if 0
+    :param data_lines: ``int`` lines in an additional chunk with a data listing
+    :return: ``string`` the document
+    """
+    code = [_setup_code] + [chunk_code(i, outputs, figure_size) for i in range(1, chunks + 1)]
+    if data_lines > 0:
+        code.append(data_listing(data_lines))
+    docs = ["Paragraph %i with some text about the results.\n" % i for i in range(len(code))]
+
+    if informat == "noweb":
+        return "".join("%s\n<<>>=\n%s\n@\n" % (d, c) for d, c in zip(docs, code))
+    if informat == "markdown":
+        return "".join("%s\n```python\n%s\n```\n" % (d, c) for d, c in zip(docs, code))
+    if informat == "script":
+        return "".join("#' %s\n%s\n\n" % (d, c) for d, c in zip(docs, code))
+    if informat == "notebook":
+        cells = []
+        for d, c in zip(docs, code):
+            cells.append({"cell_type": "markdown", "metadata": {}, "source": d})
+            cells.append({"cell_type": "code", "collapsed": False, "input": c,
+                          "language": "python", "metadata": {}, "outputs": []})
+        nb = {"metadata": {"name": "bench"}, "nbformat": 3, "nbformat_minor": 0,
+              "worksheets": [{"cells": cells, "metadata": {}}]}
+        return json.dumps(nb, indent=1)
+    raise ValueError("Unknown input format %s" % informat)
+
+
+def write_document(directory, informat, **kwargs):
+    """Write a generated document to directory and return the file name"""
+    name = os.path.join(directory, "bench_%s%s" % (informat, extensions[informat]))
+    with open(name, "w") as f:
+        f.write(make_document(informat, **kwargs))
+    return name
+
+
+def measure(func, repeat=3):
+    """Run func `repeat` times and return the best wall time and the peak
+    memory allocated by Python during an extra run"""
+    best = None
+    for i in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    gc.collect()
+    tracemalloc.start()
+    try:
+        func()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return best, peak
+
+
+def _result(benchmark, name, chunks, seconds, peak, **extra):
+    result = {"benchmark": benchmark,
+              "name": name,
+              "chunks": chunks,
+              "seconds": seconds,
+              "chunks_per_second": chunks / seconds if seconds > 0 else None,
+              "peak_memory": peak}
+    result.update(extra)
+    return result
+
+
+def bench_parse(directory, chunks, outputs, figure_size, repeat=3, data_lines=0):
+    """Parse documents with each reader"""
+    results = []
+    for informat in sorted(PwebReaders.formats):
+        name = write_document(directory, informat, chunks=chunks, outputs=outputs,
+                              figure_size=figure_size, data_lines=data_lines)
+        with open(name) as f:
+            lines = sum(1 for line in f)
+        Reader = PwebReaders.get_reader(informat)
+
+        def parse():
+            reader = Reader(file=name)
+            reader.parse()
+            return reader.getparsed()
+
+        # Document chunks and the setup chunk
+        n = len(parse())
+        seconds, peak = measure(parse, repeat)
+        results.append(_result("parse", informat, n, seconds, peak, lines=lines,
+                               lines_per_second=lines / seconds if seconds > 0 else None))
+    return results
+
+
+def run_document(name, kernel="python3"):
+    """Execute a document and return the executed chunks"""
+    from .pweb import Pweb
+
+    doc = Pweb(name, doctype="pandoc", kernel=kernel)
+    doc.run()
+    return doc.executed
+
+
+def bench_run(directory, chunks, outputs, figure_size, kernel="python3"):
+    """Execute a document and measure the overhead of each chunk. The chunks
+    only do trivial work, so the time is spent in Pweave and the kernel
+    round trips"""
+    from .pweb import Pweb
+
+    name = write_document(directory, "markdown", chunks=chunks, outputs=outputs,
+                          figure_size=figure_size)
+    # Kernel startup is measured separately from running the chunks,
+    # the first run imports the kernel modules and is not counted
+    empty = write_document(directory, "noweb", chunks=0, outputs=0)
+    run_document(empty, kernel)
+    startup, startup_peak = measure(lambda: run_document(empty, kernel), 1)
+    seconds, peak = measure(lambda: run_document(name, kernel), 1)
+
+    run = max(seconds - startup, 0.0)
+    return [_result("run", kernel, chunks, run, peak,
+                    kernel_startup=startup,
+                    seconds_per_chunk=run / chunks if chunks > 0 else None)]
+
+
+def bench_format(directory, chunks, outputs, figure_size, repeat=3, kernel="python3"):
+    """Format an executed document with each formatter"""
+    name = write_document(directory, "markdown", chunks=chunks, outputs=outputs,
+                          figure_size=figure_size)
+    executed = run_document(name, kernel)
+    n = len(executed)
+
+    results = []
+    for doctype in sorted(PwebFormats.formats):
+        Formatter = PwebFormats.getFormatter(doctype)
+
+        def format():
+            formatter = Formatter(executed, kernel=kernel, language="python",
+                                  mimetype="text/markdown", source=name, theme="skeleton",
+                                  figdir="figures", wd=directory)
+            formatter.format()
+            return formatter.getformatted()
+
+        try:
+            seconds, peak = measure(format, repeat)
+        except Exception as e:
+            # e.g. pandoc is not installed
+            results.append({"benchmark": "format", "name": doctype,
+                            "error": "%s: %s" % (type(e).__name__, e)})
+            continue
+        results.append(_result("format", doctype, n, seconds, peak))
+    return results
+
+
+def run_benchmarks(chunks=100, outputs=1, figure_size=0, repeat=3,
+                   benchmarks=("parse", "run", "format"), kernel="python3", data_lines=0):
+    """Run benchmarks and return the results as a dictionary
+
+    :param chunks: ``int`` number of code chunks in the generated documents
+    :param outputs: ``int`` number of printed lines in each chunk
+    :param figure_size: ``int`` size of a figure shown by each chunk in bytes
+    :param repeat: ``int`` number of repetitions, the best time is reported
+    :param benchmarks: ``list`` benchmarks to run: parse, run and format
+    :param kernel: ``string`` Jupyter kernel used to run code
+    :param data_lines: ``int`` lines in an additional chunk with a data listing,
+                       only used for the parse benchmark
+    """
+    from . import __version__
+
+    params = {"chunks": chunks, "outputs": outputs, "figure_size": figure_size,
+              "repeat": repeat, "kernel": kernel, "data_lines": data_lines,
+              "usematplotlib": rcParams["usematplotlib"]}
+    results = []
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory(prefix="pweave-bench-") as directory:
+        try:
+            # Processors save figures relative to the working directory
+            os.chdir(directory)
+            if "parse" in benchmarks:
+                results += bench_parse(directory, chunks, outputs, figure_size, repeat,
+                                       data_lines)
+            if "run" in benchmarks:
+                results += bench_run(directory, chunks, outputs, figure_size, kernel)
+            if "format" in benchmarks:
+                results += bench_format(directory, chunks, outputs, figure_size, repeat, kernel)
+        finally:
+            os.chdir(cwd)
+
+    return {"version": __version__,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "params": params,
+            "results": results}
+
+
+def compare(old, new, threshold=0.1):
+    """Compare two benchmark results.
+
+    :param old: ``dict`` results of the baseline run
+    :param new: ``dict`` results of the new run
+    :param threshold: ``float`` relative change that counts as a regression
+    :return: ``list`` of (benchmark, name, metric, old, new, change, regression) tuples
+    """
+    baseline = dict(((r["benchmark"], r["name"]), r) for r in old["results"])
+    rows = []
+    for result in new["results"]:
+        key = (result["benchmark"], result["name"])
+        if key not in baseline:
+            continue
+        for metric in ("chunks_per_second", "lines_per_second", "peak_memory"):
+            a = baseline[key].get(metric)
+            b = result.get(metric)
+            if not a or b is None:
+                continue
+            change = (b - a) / a
+            if metric in higher_is_better:
+                regression = change < -threshold
+            else:
+                regression = change > threshold
+            rows.append(key + (metric, a, b, change, regression))
+    return rows
+
+
+def format_results(results):
+    """Format results as a text table"""
+    lines = ["%-8s %-14s %8s %12s %14s" % ("Stage", "Name", "Chunks", "Chunks/s", "Peak memory")]
+    for r in results["results"]:
+        if "error" in r:
+            lines.append("%-8s %-14s %s" % (r["benchmark"], r["name"], r["error"]))
+            continue
+        lines.append("%-8s %-14s %8i %12.1f %12.1f MB" %
+                     (r["benchmark"], r["name"], r["chunks"], r["chunks_per_second"] or 0,
+                      r["peak_memory"] / 1e6))
+        if r["benchmark"] == "parse":
+            lines.append("%-8s %-14s %i lines, %.0f lines/s" %
+                         ("", "", r["lines"], r["lines_per_second"] or 0))
+        if r["benchmark"] == "run":
+            lines.append("%-8s %-14s kernel startup %.3f s, %.2f ms per chunk" %
+                         ("", "", r["kernel_startup"], r["seconds_per_chunk"] * 1e3))
+    return "\n".join(lines) + "\n"
+
+
+def format_comparison(rows):
+    lines = ["%-8s %-14s %-18s %12s %12s %8s" % ("Stage", "Name", "Metric", "Old", "New", "Change")]
+    for benchmark, name, metric, a, b, change, regression in rows:
+        lines.append("%-8s %-14s %-18s %12.1f %12.1f %+7.1f%%%s" %
+                     (benchmark, name, metric, a, b, change * 100,
+                      "  REGRESSION" if regression else ""))
+    return "\n".join(lines) + "\n"
+
+
+def main(argv=None):
+    parser = OptionParser(usage="python -m pweave.bench [options]",
+                          description="Benchmark parsing, code execution and formatting")
+    parser.add_option("-n", "--chunks", dest="chunks", type="int", default=100,
+                      help="Number of code chunks in generated documents: Default 100")
+    parser.add_option("-O", "--outputs", dest="outputs", type="int", default=1,
+                      help="Number of printed lines in each chunk: Default 1")
+    parser.add_option("-s", "--figure-size", dest="figure_size", type="int", default=0,
+                      help="Size of a figure shown by each chunk in bytes: Default 0, no figures")
+    parser.add_option("-l", "--data-lines", dest="data_lines", type="int", default=0,
+                      help="Lines in an additional data listing chunk in parsed documents: " +
+                           "Default 0")
+    parser.add_option("-r", "--repeat", dest="repeat", type="int", default=3,
+                      help="Number of repetitions, the best time is reported: Default 3")
+    parser.add_option("-b", "--benchmarks", dest="benchmarks", default="parse,run,format",
+                      help="Comma separated list of benchmarks to run: Default parse,run,format")
+    parser.add_option("-k", "--kernel", dest="kernel", default="python3",
+                      help="Jupyter kernel used to run code: Default python3")
+    parser.add_option("-m", "--matplotlib", dest="plot", default=True, action="store_false",
+                      help="Disable matplotlib")
+    parser.add_option("-o", "--output", dest="output", default=None,
+                      help="Write results to a JSON file")
+    parser.add_option("-c", "--compare", dest="compare", default=None,
+                      help="Compare results to an earlier JSON file, exits with status 1 " +
+                           "if there are regressions")
+    parser.add_option("-t", "--threshold", dest="threshold", type="float", default=0.1,
+                      help="Relative change that counts as a regression: Default 0.1")
+    (options, args) = parser.parse_args(argv)
+
+    rcParams["usematplotlib"] = options.plot
+    results = run_benchmarks(options.chunks, options.outputs, options.figure_size,
+                             options.repeat, options.benchmarks.split(","), options.kernel,
+                             options.data_lines)
+    sys.stdout.write(format_results(results))
+
+    if options.output is not None:
+        with open(options.output, "w") as f:
+            json.dump(results, f, indent=1)
+        sys.stdout.write("Wrote results to %s\n" % options.output)
+
+    if options.compare is not None:
+        with open(options.compare) as f:
+            rows = compare(json.load(f), results, options.threshold)
+        sys.stdout.write("\n" + format_comparison(rows))
+        if any(row[-1] for row in rows):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,160 @@
+"""
+Child documents included in a document with the ``child`` chunk option
+"""
+
+import os
+import sys
+import pickle
+import hashlib
+import multiprocessing
+from concurrent.futures import Future, ProcessPoolExecutor
+
+from .config import rcParams
+from .chunks import source_files
+
+
+def file_hash(path):
+    """SHA1 of the contents of a file"""
+    with open(path, "rb") as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+def _run_child(path, kernel, params):
+    """Run a child document in a worker process and return the executed chunks
+    and the files that were read"""
+    from .pweb import Pweb
+
+    rcParams.update(params)
+    doc = Pweb(path, kernel=kernel)
+    proc = doc._getprocessor()
+    proc.run()
+
+    document = os.path.splitext(os.path.basename(path))[0]
+    executed = []
+    for chunk in proc.getresults():
+        chunk = chunk.todict() if hasattr(chunk, "todict") else dict(chunk)
+        # Figures of the child are named after the child document
+        chunk.setdefault("document", document)
+        executed.append(chunk)
+
+    files = {path: file_hash(path)}
+    for source in source_files(doc.parsed, os.path.dirname(path)):
+        source = os.path.abspath(source)
+        files[source] = file_hash(source)
+    if proc.children is not None:
+        files.update(proc.children.files)
+    return {"executed": executed, "files": files}
+
+
+class PwebChildren(object):
+    """Runs child documents in parallel processes, each with its own kernel.
+    When results are cached, see ``rcParams["storeresults"]``, the executed
+    chunks of a child are stored in the cache directory next to the child as
+    ``<name>.child.pkl``. A cached child is run again only if it, a file it
+    reads with the ``source`` option or one of its own children has changed.
+
+    :param source: ``string`` parent document, children are relative to it
+    :param kernel: ``string`` kernel used to run the children
+    :param jobs: ``int`` number of parallel processes, defaults to number of CPUs
+    """
+
+    #: Cache format version, bump to invalidate existing caches
+    version = 1
+
+    def __init__(self, source, kernel="python3", jobs=None):
+        self.directory = os.path.dirname(os.path.abspath(source))
+        self.kernel = kernel
+        self.jobs = jobs
+        #: Files read for the children and their hashes
+        self.files = {}
+        self._futures = {}
+        self._cached = set()
+        self._executor = None
+
+    def path(self, child):
+        return os.path.normpath(os.path.join(self.directory, child))
+
+    def cachepath(self, path):
+        name = os.path.splitext(os.path.basename(path))[0]
+        return os.path.join(os.path.dirname(path), rcParams["cachedir"], name + ".child.pkl")
+
+    def params(self):
+        """rcParams used by the children, part of the cache key"""
+        return {"usematplotlib": rcParams["usematplotlib"],
+                "storeresults": rcParams["storeresults"],
+                "cachedir": rcParams["cachedir"]}
+
+    def _key(self):
+        from . import __version__
+        return ("pweave-child-%i" % self.version, __version__, self.kernel,
+                sorted(self.params().items()))
+
+    def _getcached(self, path):
+        try:
+            with open(self.cachepath(path), "rb") as f:
+                cached = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return None
+        if cached["key"] != self._key():
+            return None
+        for name, digest in cached["files"].items():
+            try:
+                if file_hash(name) != digest:
+                    return None
+            except OSError:
+                return None
+        return cached
+
+    def _putcached(self, path, result):
+        name = self.cachepath(path)
+        os.makedirs(os.path.dirname(name), exist_ok=True)
+        with open(name + ".tmp", "wb") as f:
+            pickle.dump(dict(result, key=self._key()), f, pickle.HIGHEST_PROTOCOL)
+        os.replace(name + ".tmp", name)
+
+    def start(self, chunks):
+        """Start running the children of code chunks"""
+        for chunk in chunks:
+            if chunk["type"] == "code" and chunk.get("options", {}).get("child"):
+                self.submit(chunk["options"]["child"])
+
+    def submit(self, child):
+        """Start running a child unless it is cached or already running"""
+        path = self.path(child)
+        if path in self._futures:
+            return
+        future = Future()
+        cached = self._getcached(path) if rcParams["storeresults"] else None
+        if cached is not None:
+            future.set_result(cached)
+            self._cached.add(path)
+        else:
+            if self._executor is None:
+                context = multiprocessing.get_context("spawn")
+                self._executor = ProcessPoolExecutor(max_workers=self.jobs or multiprocessing.cpu_count(),
+                                                     mp_context=context)
+            future = self._executor.submit(_run_child, path, self.kernel, self.params())
+        self._futures[path] = future
+
+    def get(self, child):
+        """Get the executed chunks of a child, waits until it has been run"""
+        self.submit(child)
+        path = self.path(child)
+        if path in self._cached:
+            sys.stdout.write("Using cached results for child %s\n" % child)
+            result = self._futures[path].result()
+        else:
+            sys.stdout.write("Waiting for child %s\n" % child)
+            result = self._futures[path].result()
+            if rcParams["storeresults"]:
+                self._putcached(path, result)
+        self.files.update(result["files"])
+        return result["executed"]
+
+    def close(self):
+        """Stop the worker processes"""
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+        self._futures = {}
+        self._cached = set()
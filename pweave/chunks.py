@@ -0,0 +1,216 @@
+"""
+Compact representation of parsed and executed chunks
+"""
+
+import os
+from collections.abc import Mapping, MutableMapping
+
+_missing = object()
+
+
+class PwebChunkOptions(MutableMapping):
+    """Options of a code chunk. Options set in the document are stored in
+    the chunk and the rest are looked up from defaults shared by all chunks.
+
+    :param options: ``dict`` options set in the document
+    :param defaults: ``dict`` default options e.g. ``rcParams["chunk"]["defaultoptions"]``
+    """
+
+    __slots__ = ("options", "defaults")
+
+    def __init__(self, options=None, defaults=None):
+        if isinstance(options, PwebChunkOptions):
+            options = options.options
+        self.options = {} if options is None else dict(options)
+        self.defaults = {} if defaults is None else defaults
+
+    def __getitem__(self, key):
+        try:
+            return self.options[key]
+        except KeyError:
+            return self.defaults[key]
+
+    def __setitem__(self, key, value):
+        self.options[key] = value
+
+    def __delitem__(self, key):
+        del self.options[key]
+
+    def __contains__(self, key):
+        return key in self.options or key in self.defaults
+
+    def __iter__(self):
+        yield from self.options
+        for key in self.defaults:
+            if key not in self.options:
+                yield key
+
+    def __len__(self):
+        return len(self.options) + sum(1 for key in self.defaults
+                                       if key not in self.options)
+
+    def __repr__(self):
+        return "PwebChunkOptions(%r)" % dict(self)
+
+    def copy(self):
+        return dict(self)
+
+
+class PwebChunk(MutableMapping):
+    """A parsed chunk that can be used like the chunk dictionaries
+    returned by readers.
+
+    Keys that are not set in the chunk are looked up from the chunk options
+    and then from the format defaults set with :py:meth:`setformat`, so
+    defaults are not copied to every chunk.
+    """
+
+    #: Keys stored in slots, other keys are stored in a dictionary
+    fields = ("type", "content", "number", "start_line", "options", "result", "figure")
+
+    __slots__ = fields + ("_extra", "_format")
+
+    def __init__(self, *args, **kwargs):
+        self._extra = None
+        self._format = None
+        self.update(*args, **kwargs)
+
+    @classmethod
+    def from_dict(cls, chunk):
+        """Create a chunk from a dictionary or copy a chunk"""
+        if isinstance(chunk, PwebChunk):
+            return chunk.copy()
+        return cls(chunk)
+
+    def setdefaults(self, defaults):
+        """Look up options not set in the document from `defaults`"""
+        self.options = PwebChunkOptions(self.get("options"), defaults)
+
+    def setformat(self, formatdict):
+        """Look up keys not set in the chunk or options from `formatdict`"""
+        self._format = formatdict
+
+    def _layers(self):
+        layers = []
+        if self._extra is not None:
+            layers.append(self._extra)
+        options = getattr(self, "options", None)
+        if isinstance(options, Mapping):
+            layers.append(options)
+        if self._format is not None:
+            layers.append(self._format)
+        return layers
+
+    def __getitem__(self, key):
+        if key in self.fields:
+            value = getattr(self, key, _missing)
+            if value is not _missing:
+                return value
+        for layer in self._layers():
+            if key in layer:
+                return layer[key]
+        raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        if key in self.fields:
+            setattr(self, key, value)
+        else:
+            if self._extra is None:
+                self._extra = {}
+            self._extra[key] = value
+
+    def __delitem__(self, key):
+        if key in self.fields and hasattr(self, key):
+            delattr(self, key)
+        elif self._extra is not None and key in self._extra:
+            del self._extra[key]
+        else:
+            raise KeyError(key)
+
+    def __contains__(self, key):
+        if key in self.fields and hasattr(self, key):
+            return True
+        return any(key in layer for layer in self._layers())
+
+    def __iter__(self):
+        seen = set()
+        for key in self.fields:
+            if hasattr(self, key):
+                seen.add(key)
+                yield key
+        for layer in self._layers():
+            for key in layer:
+                if key not in seen:
+                    seen.add(key)
+                    yield key
+
+    def __len__(self):
+        return sum(1 for key in self)
+
+    def __repr__(self):
+        return "PwebChunk(%r)" % dict(self)
+
+    def copy(self):
+        """Shallow copy, options and results are shared"""
+        new = PwebChunk.__new__(PwebChunk)
+        for key in self.fields:
+            value = getattr(self, key, _missing)
+            if value is not _missing:
+                setattr(new, key, value)
+        new._extra = None if self._extra is None else dict(self._extra)
+        new._format = self._format
+        return new
+
+    def todict(self):
+        """Convert to a dictionary with the options copied to the chunk
+        like in older versions of Pweave"""
+        chunk = dict(self)
+        if "options" in chunk:
+            chunk["options"] = dict(chunk["options"])
+        return chunk
+
+
+class PwebChunkIndex(object):
+    """Index of code chunks by number and name
+
+    :param chunks: ``list`` of chunks
+    """
+
+    __slots__ = ("numbers", "names")
+
+    def __init__(self, chunks):
+        self.numbers = {}
+        self.names = {}
+        for chunk in chunks:
+            if chunk["type"] != "code":
+                continue
+            self.numbers.setdefault(chunk["number"], chunk)
+            name = chunk.get("options", {}).get("name")
+            if name is not None:
+                self.names.setdefault(name, chunk)
+
+    def get(self, key):
+        """Get a code chunk by number or name, None if it is not found"""
+        if isinstance(key, int) or str(key).isdigit():
+            return self.numbers.get(int(key))
+        return self.names.get(key)
+
+
+def source_files(chunks, directory):
+    """Files read by chunks with the ``source`` option. Sources are looked up
+    from the working directory first and then from `directory`, sources that
+    are Python objects are left out.
+
+    :param chunks: ``list`` of parsed chunks
+    :param directory: ``string`` directory of the document
+    """
+    files = []
+    for chunk in chunks:
+        source = chunk.get("options", {}).get("source")
+        if not isinstance(source, str):
+            continue
+        if os.path.isfile(source):
+            files.append(source)
+        elif os.path.isfile(os.path.join(directory, source)):
+            files.append(os.path.join(directory, source))
+    return files
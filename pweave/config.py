@@ -1,8 +1,17 @@
+import contextlib
+
 
 rcParams = {"figdir": "figures",
             "usematplotlib": True,
             "storeresults": False,
             "cachedir": 'cache',
+            "checkpoints": False,
+            "serializer": "pickle",
+            "snapshots": 0,
+            "pipeline": 0,
+            "parallel": 0,
+            "urlcache": None,
+            "urltimeout": 30,
             "chunk": {"defaultoptions": {
                 "echo": True,
                 "results": 'verbatim',
@@ -26,6 +35,21 @@ rcParams = {"figdir": "figures",
     }
 }
 
+
+@contextlib.contextmanager
+def rc_context(params):
+    """Set rcParams while the block runs, the previous values are restored after it
+
+    :param params: ``dict`` rcParams to set
+    """
+    previous = dict((key, rcParams[key]) for key in params)
+    rcParams.update(params)
+    try:
+        yield
+    finally:
+        rcParams.update(previous)
+
+
 class PwebProcessorGlobals(object):
     """A class to hold the globals used in processors"""
     globals = {}
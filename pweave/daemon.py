@@ -0,0 +1,249 @@
+"""
+Persistent weave daemon that keeps kernels and parsed documents in memory.
+
+The daemon listens on a Unix socket. Each connection sends one request
+as a line of JSON and receives one JSON response. The client functions
+only use the standard library so that ``pweave --daemon`` starts fast.
+"""
+
+import os
+import sys
+import io
+import json
+import socket
+import tempfile
+import traceback
+import contextlib
+from collections import OrderedDict
+
+
+def default_socket():
+    """Default path of the daemon socket, can be set using PWEAVE_SOCKET
+    environment variable"""
+    path = os.environ.get("PWEAVE_SOCKET")
+    if path:
+        return path
+    uid = os.getuid() if hasattr(os, "getuid") else 0
+    return os.path.join(tempfile.gettempdir(), "pweave-%i.sock" % uid)
+
+
+def request(data, socket_path=None, timeout=None):
+    """Send a request to a running daemon and return the response.
+
+    :param data: ``dict`` request, must contain the key "command"
+    :param socket_path: ``string`` path of the socket, default from :py:func:`default_socket`
+    :raises: ``OSError`` if the daemon can't be reached
+    """
+    if socket_path is None:
+        socket_path = default_socket()
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(timeout)
+    try:
+        sock.connect(socket_path)
+        sock.sendall(json.dumps(data).encode("utf-8") + b"\n")
+        sock.shutdown(socket.SHUT_WR)
+        chunks = []
+        while True:
+            data = sock.recv(65536)
+            if not data:
+                break
+            chunks.append(data)
+    finally:
+        sock.close()
+    return json.loads(b"".join(chunks).decode("utf-8"))
+
+
+def is_running(socket_path=None):
+    """Check if a daemon is listening on the socket"""
+    if socket_path is None:
+        socket_path = default_socket()
+    if not os.path.exists(socket_path):
+        return False
+    try:
+        return request({"command": "ping"}, socket_path, timeout=5)["status"] == "ok"
+    except (OSError, ValueError, KeyError):
+        return False
+
+
+def outputs_to_text(outputs):
+    """Render outputs returned by the run_chunk request as plain text"""
+    text = ""
+    for out in outputs:
+        if out["output_type"] == "stream":
+            text += out["text"]
+        elif out["output_type"] == "error":
+            text += "\n".join(out["traceback"]) + "\n"
+        elif "text/plain" in out.get("data", {}):
+            text += out["data"]["text/plain"] + "\n"
+    return text
+
+
+class PwebDaemon(object):
+    """Serve weave requests over a Unix socket using warm kernels.
+
+    Woven documents are kept in memory with their kernels running, so
+    weaving the same document again only runs the chunks that have changed.
+
+    :param socket_path: ``string`` path of the socket
+    :param max_documents: ``int`` number of documents kept in memory,
+                          the least recently used document is closed first
+    """
+
+    def __init__(self, socket_path=None, max_documents=8):
+        if socket_path is None:
+            socket_path = default_socket()
+        self.socket_path = socket_path
+        self.max_documents = max_documents
+        self.documents = OrderedDict()
+        self.running = False
+        self.commands = {"ping": self.ping,
+                         "weave": self.weave,
+                         "run_chunk": self.run_chunk,
+                         "close": self.close_document,
+                         "shutdown": self.shutdown}
+
+    def serve(self):
+        """Listen to requests until shutdown request is received"""
+        import socketserver
+
+        if is_running(self.socket_path):
+            raise RuntimeError("Pweave daemon is already running on %s" % self.socket_path)
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+
+        daemon = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                response = daemon.handle(self.rfile.readline())
+                self.wfile.write(json.dumps(response).encode("utf-8") + b"\n")
+
+        server = socketserver.UnixStreamServer(self.socket_path, Handler)
+        os.chmod(self.socket_path, 0o600)
+        sys.stdout.write("Pweave daemon listening on %s\n" % self.socket_path)
+        self.running = True
+        try:
+            while self.running:
+                server.handle_request()
+        finally:
+            server.server_close()
+            os.remove(self.socket_path)
+            for doc in self.documents.values():
+                doc.close()
+            self.documents.clear()
+
+    def handle(self, line):
+        """Handle one request, returns a response dictionary"""
+        log = io.StringIO()
+        try:
+            data = json.loads(line.decode("utf-8"))
+            command = self.commands[data.pop("command")]
+            with contextlib.redirect_stdout(log):
+                response = command(**data)
+            response["status"] = "ok"
+        except Exception:
+            response = {"status": "error", "error": traceback.format_exc()}
+        response["log"] = log.getvalue()
+        return response
+
+    def ping(self):
+        return {"documents": list(key[0] for key in self.documents)}
+
+    def shutdown(self):
+        self.running = False
+        return {}
+
+    def getdocument(self, file, doctype=None, informat=None, kernel="python3",
+                    output=None, figdir='figures', mimetype=None):
+        """Get a document from memory or create a new one and parse the source"""
+        from .pweb import Pweb
+
+        key = (file, doctype, informat, kernel, output, figdir, mimetype)
+        if key in self.documents:
+            doc = self.documents.pop(key)
+            doc.read(reader=informat)
+        else:
+            doc = Pweb(file, informat=informat, doctype=doctype,
+                       kernel=kernel, output=output, figdir=figdir,
+                       mimetype=mimetype)
+        self.documents[key] = doc
+
+        while len(self.documents) > self.max_documents:
+            _, old = self.documents.popitem(last=False)
+            old.close()
+        return doc
+
+    def close_document(self, file):
+        """Close all documents woven from file"""
+        for key in [k for k in self.documents if k[0] == file]:
+            self.documents.pop(key).close()
+        return {}
+
+    def _setparams(self, doc, plot=True, docmode=False, cache=False, cachedir='cache',
+                   parse_cache=False, reuse_outputs=False, checkpoint=False,
+                   serializer="pickle", from_chunk=None, snapshots=0,
+                   pipeline=0, parallel=0):
+        """Set the options of a request to the document, returns docmode and
+        the rcParams used while the request is handled"""
+        from .parsecache import PwebParseCache
+        doc.from_chunk = from_chunk
+        doc.parse_cache = PwebParseCache() if parse_cache else None
+        if doc.reuse_outputs != reuse_outputs:
+            doc.reuse_outputs = reuse_outputs
+            doc.read(reader=doc.informat)
+        params = {"usematplotlib": plot,
+                  "cachedir": cachedir,
+                  "storeresults": cache,
+                  "checkpoints": checkpoint,
+                  "serializer": serializer,
+                  "snapshots": snapshots,
+                  "pipeline": pipeline,
+                  # Documents are run incrementally, so worker kernels are not used
+                  "parallel": parallel}
+        return docmode, params
+
+    def weave(self, file, doctype=None, informat=None, kernel="python3",
+              output=None, figdir='figures', mimetype=None, stream=False,
+              profile=False, **kwargs):
+        """Weave a document, see :py:func:`pweave.weave` for arguments"""
+        from .config import rc_context
+        from .profiling import PwebProfiler
+
+        doc = self.getdocument(file, doctype, informat, kernel, output, figdir, mimetype)
+        doc.documentationmode, params = self._setparams(doc, **kwargs)
+        doc.profiler = PwebProfiler() if profile else None
+        with rc_context(params):
+            doc.weave(incremental=True, stream=stream)
+        if profile:
+            trace = os.path.splitext(doc.sink)[0] + ".trace.json"
+            doc.profiler.write_trace(trace)
+            sys.stdout.write("\n" + doc.profiler.table())
+            sys.stdout.write("Wrote trace events to %s\n" % trace)
+        return {"sink": doc.sink}
+
+    def run_chunk(self, file, chunk, doctype=None, informat=None, kernel="python3",
+                  output=None, figdir='figures', mimetype=None, stream=False,
+                  profile=False, **kwargs):
+        """Run one code chunk in the kernel of a document and return the outputs.
+
+        :param chunk: chunk name or number
+        """
+        from .config import rc_context
+
+        # Use the most recently woven version of the document if there is one
+        keys = [k for k in self.documents if k[0] == file]
+        if keys:
+            doc = self.getdocument(*keys[-1])
+        else:
+            doc = self.getdocument(file, doctype, informat, kernel, output, figdir, mimetype)
+        _, params = self._setparams(doc, **kwargs)
+        with rc_context(params):
+            if doc.processor is None:
+                doc.run(incremental=True)
+
+            selected = doc.getchunk(chunk)
+            if selected is None:
+                raise KeyError("No code chunk %s in %s" % (chunk, file))
+
+            outputs = doc.processor.loadstring(selected["content"])
+        return {"outputs": outputs}
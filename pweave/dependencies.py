@@ -0,0 +1,457 @@
+"""
+Dependencies between code chunks from the names they define and use
+"""
+
+import re
+import ast
+import sys
+
+
+def transform(code):
+    """Python source of code with IPython syntax e.g. magics"""
+    from IPython.core.inputtransformer2 import TransformerManager
+    return TransformerManager().transform_cell(code)
+
+
+# Nodes that have their own local names
+_scopes = (ast.FunctionDef, ast.AsyncFunctionDef, ast.Lambda, ast.ClassDef,
+           ast.ListComp, ast.SetComp, ast.DictComp, ast.GeneratorExp)
+
+
+def _walk(nodes):
+    """Walk nodes without entering nested scopes"""
+    stack = list(nodes)
+    while stack:
+        node = stack.pop()
+        yield node
+        if not isinstance(node, _scopes):
+            stack.extend(ast.iter_child_nodes(node))
+
+
+def _root(node):
+    """Name node an expression like ``x.a[0].f()`` starts from or None"""
+    while isinstance(node, (ast.Attribute, ast.Subscript, ast.Call, ast.Starred)):
+        node = node.func if isinstance(node, ast.Call) else node.value
+    return node.id if isinstance(node, ast.Name) else None
+
+
+def _bound(node):
+    """Name bound by a node in the scope it is in or None"""
+    if isinstance(node, ast.Name) and not isinstance(node.ctx, ast.Load):
+        return node.id
+    if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+        return node.name
+    if isinstance(node, ast.ExceptHandler):
+        return node.name
+    # Capture patterns of match statements
+    if type(node).__name__ in ("MatchAs", "MatchStar"):
+        return node.name
+    if type(node).__name__ == "MatchMapping":
+        return node.rest
+    return None
+
+
+class _PwebNames(ast.NodeVisitor):
+    """Collects the global names that code defines and uses. Code that can
+    change an object defines its name: setting an attribute or an item,
+    calling a method of it or passing it to a function that isn't a known
+    pure builtin. Functions and classes that change global names when they
+    are called are collected to :py:attr:`changes`."""
+
+    #: Calls that can use or define any name
+    dynamic = {"exec", "eval", "globals", "locals", "vars", "get_ipython"}
+
+    #: Builtins that don't change their arguments
+    pure = {"print", "len", "repr", "str", "int", "float", "bool", "complex", "abs",
+            "round", "isinstance", "issubclass", "type", "id", "hash", "format",
+            "callable", "hasattr", "getattr", "ord", "chr", "bin", "hex", "oct",
+            "divmod", "pow", "max", "min", "sum", "sorted", "any", "all", "list",
+            "tuple", "set", "frozenset", "dict"}
+
+    def __init__(self):
+        self.defined = set()
+        self.used = set()
+        self.opaque = False
+        #: Global names changed by each function or class defined by the code
+        self.changes = {}
+        #: Global names used by each function or class when it's called
+        self.reads = {}
+        #: Global names called by the code (None) and by each function or class
+        self.calls = {}
+        # (local names, global declarations) of the enclosing scopes
+        self.scopes = []
+        # (name, is a function) of the enclosing functions and classes
+        self.owners = []
+        # Names defined by the statements above the current statement
+        self.bound = set()
+        self.statement = set()
+
+    def use(self, name):
+        if any(name in names for names, _ in self.scopes):
+            return
+        if self.owner is not None:
+            self.reads.setdefault(self.owner, set()).add(name)
+        if name not in self.bound:
+            self.used.add(name)
+
+    def store(self, name):
+        if not self.scopes or name in self.scopes[-1][1]:
+            self.defined.add(name)
+            self.statement.add(name)
+            if self.scopes:
+                self.change(name)
+
+    def isglobal(self, name):
+        for names, declared in reversed(self.scopes):
+            if name in declared:
+                return True
+            if name in names:
+                return False
+        return True
+
+    @property
+    def owner(self):
+        """Outermost function or class if the code is run when it's called"""
+        if any(function for _, function in self.owners):
+            return self.owners[0][0]
+        return None
+
+    def change(self, name):
+        """Code changes the object of a name"""
+        if name is None or not self.isglobal(name):
+            return
+        if self.owner is None:
+            self.defined.add(name)
+            self.statement.add(name)
+        else:
+            self.changes.setdefault(self.owner, set()).add(name)
+
+    def scope(self, body, names=()):
+        """Visit nodes of a new scope"""
+        names = set(names)
+        declared = set()
+        for node in _walk(body):
+            if isinstance(node, (ast.Global, ast.Nonlocal)):
+                declared.update(node.names)
+            elif isinstance(node, (ast.Import, ast.ImportFrom)):
+                names.update(alias.asname or alias.name.split(".")[0] for alias in node.names)
+            else:
+                name = _bound(node)
+                if name is not None:
+                    names.add(name)
+        self.scopes.append((names - declared, declared))
+        for node in body:
+            self.visit(node)
+        self.scopes.pop()
+
+    @staticmethod
+    def arguments(args):
+        names = [arg.arg for arg in args.posonlyargs + args.args + args.kwonlyargs]
+        names += [arg.arg for arg in (args.vararg, args.kwarg) if arg is not None]
+        return names
+
+    def visit_Name(self, node):
+        if isinstance(node.ctx, ast.Load):
+            self.use(node.id)
+        else:
+            self.store(node.id)
+
+    def _changed(self, node):
+        if not isinstance(node.ctx, ast.Load):
+            self.change(_root(node))
+
+    def visit_Attribute(self, node):
+        self._changed(node)
+        self.generic_visit(node)
+
+    def visit_Subscript(self, node):
+        self._changed(node)
+        self.generic_visit(node)
+
+    def visit_AugAssign(self, node):
+        if isinstance(node.target, ast.Name):
+            self.use(node.target.id)
+        self.generic_visit(node)
+
+    def visit_Import(self, node):
+        for alias in node.names:
+            self.store(alias.asname or alias.name.split(".")[0])
+
+    def visit_ImportFrom(self, node):
+        for alias in node.names:
+            if alias.name == "*":
+                self.opaque = True
+            else:
+                self.store(alias.asname or alias.name)
+
+    def visit_ExceptHandler(self, node):
+        if node.name:
+            self.store(node.name)
+        self.generic_visit(node)
+
+    def visit_Call(self, node):
+        pure = False
+        if isinstance(node.func, ast.Name):
+            if node.func.id in self.dynamic:
+                self.opaque = True
+            if self.isglobal(node.func.id):
+                self.calls.setdefault(self.owner, set()).add(node.func.id)
+            pure = node.func.id in self.pure
+        elif isinstance(node.func, ast.Attribute):
+            # Methods of literals e.g. ", ".join(x) don't change their arguments
+            pure = isinstance(node.func.value, ast.Constant)
+            self.change(_root(node.func.value))
+        if not pure:
+            for arg in node.args + [keyword.value for keyword in node.keywords]:
+                self.change(_root(arg))
+        self.generic_visit(node)
+
+    def visit_FunctionDef(self, node):
+        for child in node.decorator_list + node.args.defaults + node.args.kw_defaults:
+            if child is not None:
+                self.visit(child)
+        if node.returns is not None:
+            self.visit(node.returns)
+        self.store(node.name)
+        self.owners.append((node.name, True))
+        self.scope(node.body, self.arguments(node.args))
+        self.owners.pop()
+
+    visit_AsyncFunctionDef = visit_FunctionDef
+
+    def visit_Lambda(self, node):
+        for child in node.args.defaults + node.args.kw_defaults:
+            if child is not None:
+                self.visit(child)
+        self.scope([node.body], self.arguments(node.args))
+
+    def visit_ClassDef(self, node):
+        for child in node.decorator_list + node.bases + node.keywords:
+            self.visit(child)
+        self.store(node.name)
+        self.owners.append((node.name, False))
+        self.scope(node.body)
+        self.owners.pop()
+
+    def _comprehension(self, node, elements):
+        # The first iterable is evaluated in the enclosing scope
+        self.visit(node.generators[0].iter)
+        names = set()
+        for generator in node.generators:
+            names.update(n.id for n in ast.walk(generator.target) if isinstance(n, ast.Name))
+        self.scopes.append((names, set()))
+        for generator in node.generators:
+            self.visit(generator.target)
+            if generator is not node.generators[0]:
+                self.visit(generator.iter)
+            for condition in generator.ifs:
+                self.visit(condition)
+        for element in elements:
+            self.visit(element)
+        self.scopes.pop()
+
+    def visit_ListComp(self, node):
+        self._comprehension(node, [node.elt])
+
+    visit_SetComp = visit_GeneratorExp = visit_ListComp
+
+    def visit_DictComp(self, node):
+        self._comprehension(node, [node.key, node.value])
+
+
+_definitions = (ast.Assign, ast.AnnAssign, ast.Import, ast.ImportFrom, ast.FunctionDef,
+                ast.AsyncFunctionDef, ast.ClassDef)
+
+
+def _analyse(code):
+    """:py:class:`_PwebNames` of Python code or None"""
+    try:
+        tree = ast.parse(transform(code))
+    except SyntaxError:
+        return None
+    visitor = _PwebNames()
+    for statement in tree.body:
+        visitor.statement = set()
+        visitor.visit(statement)
+        # Names defined by statements that always run aren't used from other chunks
+        if isinstance(statement, _definitions):
+            visitor.bound.update(visitor.statement)
+    if visitor.opaque:
+        return None
+    return visitor
+
+
+def names(code):
+    """Global names defined and used by Python code as two sets, None if the
+    code can't be analysed e.g. because it uses exec, star imports or magics.
+    Global names changed by calling functions defined in other code are not
+    included."""
+    visitor = _analyse(code)
+    if visitor is None:
+        return None
+    return visitor.defined, visitor.used
+
+
+def pure(code):
+    """Does running Python code leave the global names unchanged"""
+    visitor = _analyse(code)
+    if visitor is None or visitor.defined:
+        return False
+    # Functions defined in other code can change global names
+    return not (visitor.calls.get(None, set()) - _PwebNames.pure)
+
+
+def inline_code(content):
+    """Code of the inline code blocks of a doc chunk"""
+    code = []
+    for block in re.findall(r'<%[\w\s\W]*?%>', content):
+        code.append(block.replace("<%=", "").replace("<%", "").replace("%>", "").strip())
+    return "\n".join(code)
+
+
+class PwebDependencies(object):
+    """Dependency graph of the code in a document. A chunk depends on the
+    latest chunks above it that define the names it uses and on the chunks
+    given with the ``depends`` chunk option. Code that can't be analysed
+    depends on all code above it and all code below it depends on it.
+
+    Nodes are ``(chunk type, chunk number)`` tuples, doc chunks with inline
+    code are included. Chunks with ``complete = False`` are part of the next
+    complete chunk.
+
+    :param chunks: ``iterable`` of :py:class:`pweave.chunks.PwebChunk` with
+                   default options set, in document order
+    """
+
+    def __init__(self, chunks):
+        #: Code of each node in document order
+        self.code = {}
+        #: Position of each node in the document
+        self.order = {}
+        #: Names defined by each node
+        self.defined = {}
+        #: Nodes each node depends on directly
+        self.parents = {}
+        #: Nodes that other nodes depend on
+        self.needed = set()
+        #: Nodes that can't be analysed
+        self.opaque = set()
+        #: Global names changed by calling each function or class defined so far
+        self.changes = {}
+        #: Global names used by calling each function or class defined so far
+        self.reads = {}
+        self._ancestors = {}
+
+        latest = {}
+        barrier = None
+        pending = ""
+        nodes = {}
+        for chunk in chunks:
+            if chunk["type"] == "doc":
+                code = inline_code(chunk["content"])
+                if not code:
+                    continue
+            elif chunk["type"] == "code":
+                if chunk.get("child"):
+                    continue
+                if not chunk["complete"]:
+                    pending += chunk["content"]
+                    continue
+                code, pending = pending + chunk["content"], ""
+                if not chunk["evaluate"]:
+                    continue
+            else:
+                continue
+
+            node = (chunk["type"], chunk["number"])
+            parents = set()
+            result = None if "source" in chunk else _analyse(code)
+            if result is None:
+                parents.update(self.order)
+                self.opaque.add(node)
+                defined = set()
+            else:
+                defined, used = self._names(result)
+                parents.update(latest[name] for name in used if name in latest)
+                if barrier is not None:
+                    parents.add(barrier)
+            if chunk["type"] == "code":
+                parents.update(self._depends(chunk, nodes))
+                nodes[str(chunk["number"])] = node
+                if chunk["name"]:
+                    nodes[str(chunk["name"])] = node
+
+            self.code[node] = code
+            self.order[node] = len(self.order)
+            self.defined[node] = defined
+            self.parents[node] = parents
+            self.needed.update(parents)
+            if result is None:
+                barrier = node
+            for name in defined:
+                latest[name] = node
+
+    def _names(self, visitor):
+        """Names defined and used by code including the names changed and used
+        by the functions it calls, updates :py:attr:`changes` and :py:attr:`reads`"""
+        self.changes = self._called(visitor, self.changes, visitor.changes)
+        self.reads = self._called(visitor, self.reads, visitor.reads)
+        changed = set()
+        read = set()
+        for called in visitor.calls.get(None, ()):
+            changed |= self.changes.get(called, set())
+            read |= self.reads.get(called, set())
+        return visitor.defined | changed, visitor.used | changed | read
+
+    @staticmethod
+    def _called(visitor, known, found):
+        """Update names by function, `known`, with the names `found` in the
+        functions defined by the code of visitor"""
+        result = dict(known)
+        for name in visitor.defined:
+            result.pop(name, None)
+        owners = set(found) | (set(visitor.calls) - {None})
+        for owner in owners:
+            result[owner] = set(found.get(owner, ()))
+        # Functions defined together can call each other
+        grown = True
+        while grown:
+            grown = False
+            for owner in owners:
+                for called in visitor.calls.get(owner, ()):
+                    new = result.get(called, set()) - result[owner]
+                    if new:
+                        result[owner] |= new
+                        grown = True
+        return result
+
+    def _depends(self, chunk, nodes):
+        """Nodes given with the depends option"""
+        depends = chunk.get("depends")
+        if depends is True:
+            return set(self.order)
+        if not depends:
+            return set()
+        if not isinstance(depends, (list, tuple)):
+            depends = [depends]
+        parents = set()
+        for name in depends:
+            if str(name) in nodes:
+                parents.add(nodes[str(name)])
+            else:
+                sys.stderr.write("Chunk %s depends on %s, there is no such chunk above it\n" %
+                                 (chunk["name"] or chunk["number"], name))
+        return parents
+
+    def ancestors(self, node):
+        """Nodes node depends on directly or indirectly in document order"""
+        if node not in self._ancestors:
+            found = set()
+            stack = list(self.parents[node])
+            while stack:
+                parent = stack.pop()
+                if parent not in found:
+                    found.add(parent)
+                    stack.extend(self.parents[parent])
+            self._ancestors[node] = sorted(found, key=self.order.get)
+        return self._ancestors[node]
@@ -0,0 +1,270 @@
+"""
+Fetching documents from URLs with an on-disk HTTP cache
+"""
+
+import os
+import sys
+import json
+import hashlib
+import threading
+import http.client
+from urllib import parse, request, error
+from concurrent.futures import ThreadPoolExecutor
+
+from .config import rcParams
+
+
+def is_url(source):
+    """Check if source is an http or https URL"""
+    return parse.urlsplit(source).scheme in ("http", "https")
+
+
+class PwebConnectionPool(object):
+    """Keeps HTTP connections open between requests so that several documents
+    from the same host are fetched using one connection for each thread.
+
+    :param timeout: ``float`` timeout in seconds for connecting and reading
+    :param maxsize: ``int`` maximum number of idle connections kept for each host
+    """
+
+    def __init__(self, timeout=None, maxsize=8):
+        self.timeout = timeout
+        self.maxsize = maxsize
+        self._idle = {}
+        self._lock = threading.Lock()
+
+    def _connect(self, scheme, netloc):
+        if scheme == "https":
+            return http.client.HTTPSConnection(netloc, timeout=self.timeout)
+        return http.client.HTTPConnection(netloc, timeout=self.timeout)
+
+    def _get(self, key):
+        with self._lock:
+            idle = self._idle.get(key)
+            if idle:
+                return idle.pop()
+        return None
+
+    def _put(self, key, conn):
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            if len(idle) < self.maxsize:
+                idle.append(conn)
+                return
+        conn.close()
+
+    def request(self, url, headers=None):
+        """Send a GET request
+
+        :param url: ``string`` http or https URL
+        :param headers: ``dict`` request headers
+        :return: ``tuple`` (status, reason, response headers, body)
+        """
+        parts = parse.urlsplit(url)
+        key = (parts.scheme, parts.netloc)
+        path = parse.urlunsplit(("", "", parts.path or "/", parts.query, ""))
+        headers = dict(headers or {})
+        headers.setdefault("User-Agent", "Pweave")
+
+        conn = self._get(key)
+        reused = conn is not None
+        while True:
+            if conn is None:
+                conn = self._connect(*key)
+            try:
+                conn.request("GET", path, headers=headers)
+                response = conn.getresponse()
+                body = response.read()
+            except (http.client.RemoteDisconnected, http.client.BadStatusLine,
+                    ConnectionResetError, BrokenPipeError):
+                conn.close()
+                # The server may have closed an idle connection, try once more
+                if not reused:
+                    raise
+                conn, reused = None, False
+                continue
+            except Exception:
+                conn.close()
+                raise
+            break
+
+        if response.will_close:
+            conn.close()
+        else:
+            self._put(key, conn)
+        return response.status, response.reason, response.msg, body
+
+    def close(self):
+        """Close idle connections"""
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for conns in idle.values():
+            for conn in conns:
+                conn.close()
+
+
+class PwebHTTPCache(object):
+    """Fetches URLs and stores the responses on disk. A cached response is
+    validated with a conditional request using its ETag and Last-Modified
+    headers and the body is only downloaded again if it has changed. The
+    cached copy is used if the server can't be reached.
+
+    :param directory: ``string`` directory for cached responses, defaults to
+        rcParams["urlcache"] or ~/.cache/pweave/urls if that is None. False
+        disables the disk cache.
+    :param timeout: ``float`` timeout in seconds, defaults to rcParams["urltimeout"]
+    """
+
+    #: Number of redirects followed
+    max_redirects = 5
+
+    def __init__(self, directory=None, timeout=None):
+        if directory is None:
+            directory = rcParams.get("urlcache")
+        if directory is None:
+            base = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+            directory = os.path.join(base, "pweave", "urls")
+        if timeout is None:
+            timeout = rcParams.get("urltimeout")
+        self.directory = directory
+        self.timeout = timeout
+        self.pool = PwebConnectionPool(timeout)
+
+    def path(self, url):
+        """Get the path of the cached response without extension"""
+        return os.path.join(self.directory, hashlib.sha1(url.encode("utf-8")).hexdigest())
+
+    def get(self, url):
+        """Get the cached response
+
+        :return: ``tuple`` (metadata dict, body bytes) or None
+        """
+        if not self.directory:
+            return None
+        name = self.path(url)
+        try:
+            with open(name + ".json") as f:
+                meta = json.load(f)
+            with open(name + ".body", "rb") as f:
+                body = f.read()
+        except (OSError, ValueError):
+            return None
+        if meta.get("url") != url:
+            return None
+        return meta, body
+
+    def put(self, url, headers, body):
+        """Store a response if it has an ETag or Last-Modified header"""
+        if not self.directory:
+            return
+        meta = {"url": url,
+                "etag": headers.get("ETag"),
+                "last_modified": headers.get("Last-Modified")}
+        if meta["etag"] is None and meta["last_modified"] is None:
+            return
+        if "no-store" in (headers.get("Cache-Control") or ""):
+            return
+        name = self.path(url)
+        os.makedirs(self.directory, exist_ok=True)
+        # Write the body first so that metadata never refers to a partial body
+        for ext, data in ((".body", body), (".json", json.dumps(meta).encode("utf-8"))):
+            tmp = "%s%s.%i.%i.tmp" % (name, ext, os.getpid(), threading.get_ident())
+            with open(tmp, "wb") as f:
+                f.write(data)
+            os.replace(tmp, name + ext)
+
+    def fetch(self, url):
+        """Get the body of url, using the cached copy if it hasn't changed
+
+        :param url: ``string`` URL, URLs that aren't http or https are
+            opened with urllib without caching
+        :return: ``bytes`` body
+        """
+        if not is_url(url):
+            with request.urlopen(url, timeout=self.timeout) as r:
+                return r.read()
+
+        cached = self.get(url)
+        headers = {}
+        if cached is not None:
+            meta = cached[0]
+            if meta["etag"] is not None:
+                headers["If-None-Match"] = meta["etag"]
+            if meta["last_modified"] is not None:
+                headers["If-Modified-Since"] = meta["last_modified"]
+
+        try:
+            status, reason, response_headers, body = self._request(url, headers)
+        except (OSError, http.client.HTTPException) as e:
+            if cached is None:
+                raise
+            sys.stderr.write("Can't fetch %s, using cached copy: %s\n" % (url, e))
+            return cached[1]
+
+        if status == 304 and cached is not None:
+            return cached[1]
+        if status != 200:
+            raise error.HTTPError(url, status, reason, response_headers, None)
+        self.put(url, response_headers, body)
+        return body
+
+    def _request(self, url, headers):
+        for i in range(self.max_redirects + 1):
+            status, reason, response_headers, body = self.pool.request(url, headers)
+            location = response_headers.get("Location")
+            if status not in (301, 302, 303, 307, 308) or location is None:
+                break
+            url = parse.urljoin(url, location)
+        return status, reason, response_headers, body
+
+    def prefetch(self, urls, jobs=8):
+        """Fetch several URLs concurrently so that later reads are served
+        from the cache
+
+        :param urls: ``list`` of URLs
+        :param jobs: ``int`` number of concurrent requests
+        :return: ``dict`` mapping each URL to the exception raised while
+            fetching it or None
+        """
+        urls = list(dict.fromkeys(urls))
+        if not urls:
+            return {}
+
+        def fetch(url):
+            try:
+                self.fetch(url)
+            except Exception as e:
+                return e
+            return None
+
+        with ThreadPoolExecutor(max_workers=max(1, min(jobs, len(urls)))) as executor:
+            return dict(zip(urls, executor.map(fetch, urls)))
+
+    def close(self):
+        self.pool.close()
+
+
+_cache = None
+_cache_params = None
+
+
+def default_cache():
+    """Get a cache shared in the process using the current rcParams"""
+    global _cache, _cache_params
+    params = (rcParams.get("urlcache"), rcParams.get("urltimeout"))
+    if _cache is None or params != _cache_params:
+        if _cache is not None:
+            _cache.close()
+        _cache = PwebHTTPCache(*params)
+        _cache_params = params
+    return _cache
+
+
+def fetch(url):
+    """Get the body of url using the default cache"""
+    return default_cache().fetch(url)
+
+
+def prefetch(urls, jobs=8):
+    """Fetch the http and https URLs in urls concurrently using the default cache"""
+    return default_cache().prefetch([u for u in urls if is_url(u)], jobs)
@@ -1,44 +1,76 @@
-from .tex import PwebTexFormatter, PwebMintedFormatter, \
-                 PwebTexPweaveFormatter, PwebTexPygmentsFormatter
-from .rst import  PwebRstFormatter, PwebSphinxFormatter
-from .markdown import PwebLeanpubFormatter, PwebPandocFormatter, PwebSoftCoverFormatter
-from .publish import  PwebMDtoHTMLFormatter, PwebPandocMDtoHTMLFormatter,\
-    PwebPandoctoTexFormatter, PwebHTMLFormatter
-from .jupyter_notebook import PwebNotebookFormatter
 import os
+import importlib
+from collections import UserDict
+
+# Formatter classes are imported from their modules when they are first used,
+# the formatters import e.g. nbconvert and pygments
+_formatters = {"PwebTexFormatter": "tex",
+               "PwebMintedFormatter": "tex",
+               "PwebTexPweaveFormatter": "tex",
+               "PwebTexPygmentsFormatter": "tex",
+               "PwebRstFormatter": "rst",
+               "PwebSphinxFormatter": "rst",
+               "PwebLeanpubFormatter": "markdown",
+               "PwebPandocFormatter": "markdown",
+               "PwebSoftCoverFormatter": "markdown",
+               "PwebMDtoHTMLFormatter": "publish",
+               "PwebPandocMDtoHTMLFormatter": "publish",
+               "PwebPandoctoTexFormatter": "publish",
+               "PwebHTMLFormatter": "publish",
+               "PwebNotebookFormatter": "jupyter_notebook"}
+
+__all__ = ["PwebFormats"] + list(_formatters)
+
+
+def __getattr__(name):
+    if name in _formatters:
+        module = importlib.import_module("." + _formatters[name], __name__)
+        return getattr(module, name)
+    raise AttributeError("module %r has no attribute %r" % (__name__, name))
+
+
+class _PwebFormat(UserDict):
+    """Format description, the formatter class is imported when it's first used"""
+
+    def __getitem__(self, key):
+        value = self.data[key]
+        if key == "class" and isinstance(value, str):
+            value = self.data[key] = __getattr__(value)
+        return value
+
 
 class PwebFormats(object):
     """Contains a dictionary of available output formats"""
-    formats = {'tex': {'class': PwebTexFormatter,
-                       'description': 'Latex with verbatim for code and results'},
-               'texminted': {'class': PwebMintedFormatter,
-                             'description': 'Latex with predefined minted environment for codeblocks'},
-               'texpweave': {'class': PwebTexPweaveFormatter,
-                             'description': 'Latex output with user defined formatting using named environments (in latex header)'},
-               'texpygments': {'class': PwebTexPygmentsFormatter,
-                               'description': 'Latex output with pygments highlighted output'},
-               'rst': {'class': PwebRstFormatter,
-                       'description': 'reStructuredText'},
-               'pandoc': {'class': PwebPandocFormatter,
-                          'description': 'Pandoc markdown'},
-               'markdown': {'class': PwebPandocFormatter, 'description':
-                   'Pandoc markdown, same as format pandoc'},
-               'leanpub': {'class': PwebLeanpubFormatter,
-                           'description': 'Leanpub markdown'},
-               'sphinx': {'class': PwebSphinxFormatter,
-                          'description': 'reStructuredText for Sphinx'},
-               'html': {'class': PwebHTMLFormatter,
-                        'description': 'HTML with pygments highlighting'},
-               'md2html': {'class': PwebMDtoHTMLFormatter,
-                           'description': 'Markdown to HTML using Python-Markdown'},
-               'softcover': {'class': PwebSoftCoverFormatter,
-                            'description': 'SoftCover markdown'},
-               'pandoc2latex': {'class': PwebPandoctoTexFormatter,
-                                'description': 'Markdown to Latex using Pandoc, requires Pandoc in path'},
-               'pandoc2html': {'class': PwebPandocMDtoHTMLFormatter,
-                               'description': 'Markdown to HTML using Pandoc, requires Pandoc in path'},
-               'notebook': {'class': PwebNotebookFormatter,
-                               'description': 'Jupyter notebook'}
+    formats = {'tex': _PwebFormat({'class': 'PwebTexFormatter',
+                                   'description': 'Latex with verbatim for code and results'}),
+               'texminted': _PwebFormat({'class': 'PwebMintedFormatter',
+                                         'description': 'Latex with predefined minted environment for codeblocks'}),
+               'texpweave': _PwebFormat({'class': 'PwebTexPweaveFormatter',
+                                         'description': 'Latex output with user defined formatting using named environments (in latex header)'}),
+               'texpygments': _PwebFormat({'class': 'PwebTexPygmentsFormatter',
+                                           'description': 'Latex output with pygments highlighted output'}),
+               'rst': _PwebFormat({'class': 'PwebRstFormatter',
+                                   'description': 'reStructuredText'}),
+               'pandoc': _PwebFormat({'class': 'PwebPandocFormatter',
+                                      'description': 'Pandoc markdown'}),
+               'markdown': _PwebFormat({'class': 'PwebPandocFormatter', 'description':
+                   'Pandoc markdown, same as format pandoc'}),
+               'leanpub': _PwebFormat({'class': 'PwebLeanpubFormatter',
+                                       'description': 'Leanpub markdown'}),
+               'sphinx': _PwebFormat({'class': 'PwebSphinxFormatter',
+                                      'description': 'reStructuredText for Sphinx'}),
+               'html': _PwebFormat({'class': 'PwebHTMLFormatter',
+                                    'description': 'HTML with pygments highlighting'}),
+               'md2html': _PwebFormat({'class': 'PwebMDtoHTMLFormatter',
+                                       'description': 'Markdown to HTML using Python-Markdown'}),
+               'softcover': _PwebFormat({'class': 'PwebSoftCoverFormatter',
+                                        'description': 'SoftCover markdown'}),
+               'pandoc2latex': _PwebFormat({'class': 'PwebPandoctoTexFormatter',
+                                            'description': 'Markdown to Latex using Pandoc, requires Pandoc in path'}),
+               'pandoc2html': _PwebFormat({'class': 'PwebPandocMDtoHTMLFormatter',
+                                           'description': 'Markdown to HTML using Pandoc, requires Pandoc in path'}),
+               'notebook': _PwebFormat({'class': 'PwebNotebookFormatter',
+                                           'description': 'Jupyter notebook'})
                 }
 
     @classmethod
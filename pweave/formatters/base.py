@@ -1,8 +1,8 @@
 import textwrap
 import os
 import base64
-import copy
-from nbconvert import filters
+from ..chunks import PwebChunk
+from .. import profiling
 
 # Pweave output formatters
 class PwebFormatter(object):
@@ -19,6 +19,8 @@ class PwebFormatter(object):
         self.source = source
         self.theme = theme
         self.language = language
+        #: :py:class:`pweave.profiling.PwebProfiler` used to time formatting
+        self.profiler = None
 
         #To be set in child classess
         self.file_ext = None
@@ -40,34 +42,67 @@ class PwebFormatter(object):
 
 
     def format(self):
-        self.formatted = []
-        for chunk in self.executed:
-            # Fill in options for code chunks
-            if chunk['type'] == "code":
-                for key in self.formatdict.keys():
-                    if not key in chunk:
-                        chunk[key] = self.formatdict[key]
-
-            # Wrap text if option is set
-            if chunk['type'] == "code":
-                if chunk["wrap"] is True or chunk['wrap'] == "code":
-                    chunk['content'] = self._wrap(chunk['content'])
-
-            # Preformat chunk content before default formatters
-            chunk = self.preformat_chunk(chunk)
-
-            if chunk['type'] == "doc":
-                self.formatted.append(self.format_docchunk(chunk))
-            elif chunk['type'] == "code":
-                self.formatted.append(self.format_codechunks(chunk))
-            else:
-                self.formatted.append(chunk["content"])
-
-        self.formatted = "\n".join(self.formatted)
+        self.formatted = "\n".join(self.format_chunk(chunk) for chunk in self.executed)
         self.convert()  # Convert to e.g. markdown
         self.add_header()
         self.add_footer()
 
+    def format_chunk(self, chunk):
+        """Format one executed chunk. The chunk is not modified, results
+        are shared with the copy used for formatting"""
+        label = "%s %s" % (chunk["type"], chunk.get("number", ""))
+        with profiling.span(self.profiler, "format", label):
+            return self._format_chunk(PwebChunk.from_dict(chunk))
+
+    def _format_chunk(self, chunk):
+        # Options not set in code chunks are looked up from formatdict
+        if chunk['type'] == "code":
+            chunk.setformat(self.formatdict)
+
+        # Wrap text if option is set
+        if chunk['type'] == "code":
+            if chunk["wrap"] is True or chunk['wrap'] == "code":
+                chunk['content'] = self._wrap(chunk['content'])
+
+        # Preformat chunk content before default formatters
+        chunk = self.preformat_chunk(chunk)
+
+        if chunk['type'] == "doc":
+            return self.format_docchunk(chunk)
+        elif chunk['type'] == "code":
+            return self.format_codechunks(chunk)
+        else:
+            return chunk["content"]
+
+    def streamable(self):
+        """Formatters that convert the whole document in :py:meth:`convert`
+        can't format one chunk at a time"""
+        return type(self).convert is PwebFormatter.convert
+
+    def iterformat(self, chunks):
+        """Format chunks from an iterable one at a time and yield the
+        formatted document in pieces, gives the same result as :py:meth:`format`"""
+        header = None
+        for chunk in chunks:
+            text = self.format_chunk(chunk)
+            # The header is added after formatting the first chunk,
+            # which can contain the title
+            if header is None:
+                header = self._added_text(self.add_header)
+                yield header
+            else:
+                yield "\n"
+            yield text
+        if header is None:
+            yield self._added_text(self.add_header)
+        yield self._added_text(self.add_footer)
+
+    def _added_text(self, method):
+        """Get the text added to the document by add_header or add_footer"""
+        self.formatted = ""
+        method()
+        return self.formatted
+
     def convert(self):
         pass
 
@@ -136,18 +171,19 @@ class PwebFormatter(object):
             return ""
 
     def highlight_ansi_and_escape(self, text):
+        from nbconvert import filters
         return self.escape(filters.strip_ansi(text))
 
     def escape(self, text):
         return text
 
     def render_traceback(self, text, chunk):
-        chunk = copy.deepcopy(chunk)
+        chunk = chunk.copy()
         text = self.highlight_ansi_and_escape(text)
         return self.format_text_result(text, chunk)
 
     def render_text(self, text, chunk):
-        chunk = copy.deepcopy(chunk)
+        chunk = chunk.copy()
         text = self.highlight_ansi_and_escape(text)
         return self.format_text_result(text, chunk)
 
@@ -226,7 +262,8 @@ class PwebFormatter(object):
             result += other_result
 
         #Handle figures
-        chunk['figure'] = self.figures_from_chunk(chunk) #Save embedded figures to file
+        with profiling.span(self.profiler, "figures"):
+            chunk['figure'] = self.figures_from_chunk(chunk) #Save embedded figures to file
 
         if chunk['fig'] and 'figure' in chunk:
             if chunk['include']:
@@ -301,7 +338,8 @@ class PwebFormatter(object):
         include_dir = self.figdir
 
         ext = "." + self.mime_extensions[mimetype]
-        base = os.path.splitext(os.path.basename(self.source))[0]
+        # Chunks from child documents have the name of the child
+        base = chunk.get("document") or os.path.splitext(os.path.basename(self.source))[0]
 
         if chunk['name'] is None:
             prefix = base + '_figure' + str(chunk['number']) + "_" + str(i)
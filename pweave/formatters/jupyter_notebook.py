@@ -1,4 +1,4 @@
-import nbformat
+from ..readers import PwebNBReader
 
 
 class PwebNotebookFormatter(object):
@@ -35,6 +35,7 @@ class PwebNotebookFormatter(object):
         self.executed = executed
 
     def format(self):
+        import nbformat
         for chunk in self.executed:
             if chunk["type"] == "doc":
                 self.notebook["cells"].append(
@@ -47,6 +48,7 @@ class PwebNotebookFormatter(object):
                     }
                 )
             if chunk["type"] == "code":
+                source = chunk["content"].lstrip()
                 self.notebook["cells"].append(
                     {
                         "cell_type": "code",
@@ -54,9 +56,12 @@ class PwebNotebookFormatter(object):
                         "metadata": {
                             "collapsed": False,
                             "autoscroll": "auto",
-                            "options" : chunk["options"]
+                            "options" : dict(chunk["options"]),
+                            "pweave" : {
+                                "source_hash" : PwebNBReader.source_hash(source)
+                            }
                         },
-                        "source": chunk["content"].lstrip(),
+                        "source": source,
                         "outputs" : chunk["result"]
                     }
                 )
@@ -64,4 +69,5 @@ class PwebNotebookFormatter(object):
         self.notebook = nbformat.from_dict(self.notebook)
 
     def getformatted(self):
+        import nbformat
         return nbformat.writes(self.notebook)
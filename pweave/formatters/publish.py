@@ -6,7 +6,6 @@ import sys
 import os
 import io
 import html
-from nbconvert import filters
 
 class PwebHTMLFormatter(PwebFormatter):
 
@@ -42,6 +41,7 @@ class PwebHTMLFormatter(PwebFormatter):
         return html.escape(text)
 
     def highlight_ansi_and_escape(self, text):
+        from nbconvert import filters
         return filters.ansi2html(text)
 
     def formatfigure(self, chunk):
@@ -1,5 +1,4 @@
 from .base import PwebFormatter
-from nbconvert import filters
 
 class PwebTexFormatter(PwebFormatter):
 
@@ -85,6 +84,7 @@ class PwebTexPygmentsFormatter(PwebTexFormatter):
         self.fig_mimetypes = ["application/pdf", "image/png", "image/jpg"]
 
     def highlight_ansi_and_escape(self, text):
+        from nbconvert import filters
         return filters.ansi2latex(text)
 
     def format_codechunks(self, chunk):
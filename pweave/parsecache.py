@@ -0,0 +1,81 @@
+"""
+Cache for parsed documents
+"""
+
+import os
+import hashlib
+import pickle
+
+
+class PwebParseCache(object):
+    """Stores the parsed chunks of documents on disk, so that unchanged
+    documents don't need to be parsed again.
+
+    An entry is used if the document has the same content and it was parsed
+    with the same reader class and Pweave version. Only the latest entry of
+    each document is kept.
+
+    :param directory: ``string`` directory for cached documents, if None the
+                      cache is stored next to each document in
+                      ``rcParams["cachedir"]``
+    """
+
+    #: Cache format version, bump to invalidate existing caches
+    version = 1
+
+    #: Size of blocks read when hashing documents
+    block_size = 1 << 20
+
+    def __init__(self, directory=None):
+        self.directory = directory
+
+    def key(self, source, Reader):
+        """Key for a document file parsed with `Reader`"""
+        from . import __version__
+
+        h = hashlib.sha1()
+        for part in ["pweave-parse-%i" % self.version, __version__,
+                     Reader.__module__, Reader.__qualname__,
+                     str(getattr(Reader, "version", ""))]:
+            h.update(part.encode("utf-8"))
+            h.update(b"\0")
+        with open(source, "rb") as f:
+            for block in iter(lambda: f.read(self.block_size), b""):
+                h.update(block)
+        return h.hexdigest()
+
+    def path(self, source):
+        """Cache file for a document"""
+        name = os.path.basename(source) + ".parsed.pkl"
+        if self.directory is None:
+            from .config import rcParams
+            return os.path.join(os.path.dirname(os.path.abspath(source)),
+                                rcParams["cachedir"], name)
+        prefix = hashlib.sha1(os.path.abspath(source).encode("utf-8")).hexdigest()[:16]
+        return os.path.join(self.directory, prefix + "-" + name)
+
+    def get(self, source, key):
+        """Get the parsed chunks of a document or None if the document has
+        changed since it was stored"""
+        try:
+            with open(self.path(source), "rb") as f:
+                # The key is stored first so that the chunks of a
+                # changed document are not loaded
+                if pickle.load(f) != key:
+                    return None
+                return pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return None
+
+    def put(self, source, key, parsed):
+        """Store the parsed chunks of a document"""
+        name = self.path(source)
+        directory = os.path.dirname(name)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        # Write to a temporary file first so that an interrupted run
+        # doesn't leave broken entries behind
+        with open(name + ".tmp", "wb") as f:
+            pickle.dump(key, f, pickle.HIGHEST_PROTOCOL)
+            pickle.dump(parsed, f, pickle.HIGHEST_PROTOCOL)
+        os.replace(name + ".tmp", name)
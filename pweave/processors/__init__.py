@@ -1,15 +1,42 @@
-from . jupyter import JupyterProcessor, IPythonProcessor
+import importlib
+from collections import UserDict
+
+# The processors import jupyter_client and IPython, they are imported when first used
+_processors = {"JupyterProcessor": "jupyter",
+               "IPythonProcessor": "jupyter",
+               "AsyncJupyterProcessor": "asyncjupyter",
+               "PwebKernelPool": "pool"}
+
+__all__ = ["PwebProcessors"] + list(_processors)
+
+
+def __getattr__(name):
+    if name in _processors:
+        module = importlib.import_module("." + _processors[name], __name__)
+        return getattr(module, name)
+    raise AttributeError("module %r has no attribute %r" % (__name__, name))
+
+
+class _PwebProcessor(UserDict):
+    """Processor description, the class is imported when it's first used"""
+
+    def __getitem__(self, key):
+        value = self.data[key]
+        if key == "class" and isinstance(value, str):
+            value = self.data[key] = __getattr__(value)
+        return value
+
 
 class PwebProcessors(object):
     """Lists available input formats"""
-    formats = {'python': {'class': IPythonProcessor,
-                          'description': 'Python shell'},
-               'jupyter': {'class': JupyterProcessor,
-                          'description': 'Run code using Jupyter client'}}
+    formats = {'python': _PwebProcessor({'class': 'IPythonProcessor',
+                                         'description': 'Python shell'}),
+               'jupyter': _PwebProcessor({'class': 'JupyterProcessor',
+                                          'description': 'Run code using Jupyter client'})}
 
     @classmethod
     def getprocessor(cls, kernel):
         if "python" in kernel:
-            return IPythonProcessor
+            return __getattr__("IPythonProcessor")
         else:
-            return JupyterProcessor
+            return __getattr__("JupyterProcessor")
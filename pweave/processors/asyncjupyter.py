@@ -0,0 +1,186 @@
+"""
+Jupyter processor that uses the asyncio kernel client
+"""
+
+import os
+import asyncio
+
+from jupyter_client import AsyncKernelManager
+
+from .. import profiling
+from .jupyter import JupyterProcessor
+
+
+class _PwebRequest(object):
+    """Reply and outputs of an execute request, filled in by the channel readers"""
+
+    def __init__(self, chunk, loop):
+        self.chunk = chunk
+        self.cell = {}
+        self.outputs = []
+        self.reply = loop.create_future()
+        self.idle = asyncio.Event()
+
+
+class AsyncJupyterProcessor(JupyterProcessor):
+    """Runs code using the asyncio Jupyter client. The shell and iopub channels
+    are read concurrently and messages are routed to requests by msg_id, so
+    outputs are handled as they arrive instead of polling the channels after
+    the reply.
+
+    The synchronous processor methods run the event loop until the request is
+    done. Processors that share a loop can run code concurrently by running
+    their :py:meth:`execute` coroutines in it. The processor always starts its own
+    kernel, pooled and embedded kernels use the blocking client.
+
+    The processor is not chosen by kernel name, pass it to
+    :py:meth:`pweave.Pweb.run` as ``Processor=AsyncJupyterProcessor``. Like
+    :py:class:`JupyterProcessor` it does none of the matplotlib setup of
+    :py:class:`IPythonProcessor`: matplotlib is not initialized, the ``f_size``
+    and ``dpi`` chunk options are not applied and nothing is done by
+    ``savefigs``. Figures are included only if the kernel sends them as
+    display data.
+
+    :param output_callback: called with the chunk and each output as it arrives,
+                            e.g. to show progress of long chunks. The chunk is None
+                            for inline code.
+    :param loop: ``asyncio.AbstractEventLoop`` to use, a new loop is created by default
+    """
+
+    def __init__(self, *args, output_callback=None, loop=None, **kwargs):
+        self.output_callback = output_callback
+        #: Seconds to wait for outputs after the reply
+        self.iopub_timeout = 4
+        self.loop = loop
+        self._ownloop = loop is None
+        self._requests = {}
+        self._readers = []
+        super(AsyncJupyterProcessor, self).__init__(*args, **kwargs)
+
+    def startkernel(self, path, embed_kernel=None, snapshots=0):
+        self.kernel_pool = None
+        self.embedded = False
+        if self.loop is None:
+            self.loop = asyncio.new_event_loop()
+        self.loop.run_until_complete(self.start(path))
+
+    async def start(self, cwd):
+        """Start the kernel and the channel readers"""
+        self.km = AsyncKernelManager(kernel_name=self.kernel)
+        await self.km.start_kernel(cwd=cwd, stderr=open(os.devnull, 'w'))
+        self.kc = self.km.client()
+        self.kc.start_channels()
+        try:
+            await self.kc.wait_for_ready()
+        except RuntimeError:
+            print(
+                "Timeout from starting kernel\nTry restarting python session and running weave again")
+            await self.shutdown()
+            raise
+        self.kc.allow_stdin = False
+        self._startreaders()
+
+    def _startreaders(self):
+        self._readers = [asyncio.ensure_future(self._read(self.kc.shell_channel, self._onreply)),
+                         asyncio.ensure_future(self._read(self.kc.iopub_channel, self._oniopub))]
+
+    async def _stopreaders(self):
+        for reader in self._readers:
+            reader.cancel()
+        await asyncio.gather(*self._readers, return_exceptions=True)
+        self._readers = []
+
+    async def restart(self):
+        """Restart the kernel, the readers are stopped while waiting for it"""
+        await self._stopreaders()
+        await self.km.restart_kernel(now=True)
+        await self.kc.wait_for_ready()
+        self._startreaders()
+
+    async def _read(self, channel, handler):
+        """Read messages from a channel and pass them to the handler of the request"""
+        try:
+            while True:
+                msg = await channel.get_msg()
+                request = self._requests.get(msg['parent_header'].get('msg_id'))
+                if request is not None:
+                    handler(request, msg)
+        except Exception as e:
+            for request in self._requests.values():
+                if not request.reply.done():
+                    request.reply.set_exception(e)
+            raise
+
+    def _onreply(self, request, msg):
+        if not request.reply.done():
+            request.reply.set_result(msg)
+
+    def _oniopub(self, request, msg):
+        if msg['msg_type'] == 'status' and msg['content']['execution_state'] == 'idle':
+            request.idle.set()
+            return
+        out = self._addoutput(msg, request.cell, request.outputs)
+        if out is not None and self.output_callback is not None:
+            self.output_callback(request.chunk, out)
+
+    async def execute(self, code, chunk=None):
+        """Run code and return the outputs"""
+        msg_id = self.kc.execute(code, store_history=False)
+        self._requests[msg_id] = _PwebRequest(chunk, self.loop)
+        return await self.wait(msg_id)
+
+    async def wait(self, msg_id):
+        """Wait for a request to finish and return the outputs"""
+        request = self._requests[msg_id]
+        timeout = self.timeout if self.timeout >= 0 else None
+        try:
+            with profiling.span(self.profiler, "execute"):
+                try:
+                    await asyncio.wait_for(asyncio.shield(request.reply), timeout)
+                except asyncio.TimeoutError:
+                    if not self.interrupt_on_timeout:
+                        raise TimeoutError("Cell execution timed out, see log for details.")
+                    await self.km.interrupt_kernel()
+            with profiling.span(self.profiler, "collect"):
+                try:
+                    await asyncio.wait_for(request.idle.wait(), self.iopub_timeout)
+                except asyncio.TimeoutError:
+                    print(
+                        "Timeout waiting for IOPub output\nTry restarting python session and running weave again")
+                    raise RuntimeError("Timeout waiting for IOPub output")
+        finally:
+            del self._requests[msg_id]
+        return request.outputs
+
+    async def shutdown(self):
+        """Stop the channel readers and the kernel"""
+        await self._stopreaders()
+        self.kc.stop_channels()
+        await self.km.shutdown_kernel()
+
+    def restartkernel(self):
+        self.loop.run_until_complete(self.restart())
+        return True
+
+    def run_cell(self, src, chunk=None):
+        return self.loop.run_until_complete(self.execute(src.lstrip(), chunk))
+
+    def loadstring(self, code_str, chunk=None, **kwargs):
+        return self.run_cell(code_str, chunk)
+
+    def submit(self, code, chunk=None):
+        msg_id = self.kc.execute(code.lstrip(), store_history=False, stop_on_error=False)
+        # Outputs are routed to the request while earlier requests are waited for
+        self._requests[msg_id] = _PwebRequest(chunk, self.loop)
+        return msg_id
+
+    def collect(self, msg_id, chunk=None):
+        return self.loop.run_until_complete(self.wait(msg_id))
+
+    def discard(self, msg_id):
+        self._requests.pop(msg_id, None)
+
+    def close(self):
+        self.loop.run_until_complete(self.shutdown())
+        if self._ownloop:
+            self.loop.close()
@@ -6,16 +6,22 @@ import sys
 import re
 import os
 import io
-import copy
-import pickle
+from collections import deque
 
 from ..config import rcParams
+from .cache import PwebChunkCache
+from .checkpoints import PwebCheckpoints
+from ..chunks import PwebChunk
+from .. import profiling
 
 
 class PwebProcessorBase(object):
     """Processors run code from parsed Pweave documents. This is an abstract base
     class for specific implementations"""
 
+    #: Can run independent chunks in worker kernels, see :py:meth:`startworker`
+    supports_workers = False
+
     def __init__(self, parsed, source, docmode, figdir, outdir,
                  *args, **kwargs):
         self.parsed = parsed
@@ -25,13 +31,52 @@ class PwebProcessorBase(object):
         self.outdir = outdir
         self.executed = []
         self.isexecuted = False
+        self.kernel = None
+        self.cache = None
+        #: Keep the kernel running after run and reuse unchanged results on next run
+        self.incremental = False
+        #: :py:class:`pweave.profiling.PwebProfiler` used to time chunks
+        self.profiler = None
         self._oldresults = None
+        self._upstream = None
+        self._replay = []
+        self._index = []
+        # Cache keys and code the kernel has run in order
+        self._kernelkeys = []
+        self._live = set()
+        # The same from the previous incremental run
+        self._previous = []
+        # Cached code the running kernel has run in the previous incremental run
+        self._skipped = []
+        # Cache key of the code the kernel state is the result of
+        self._statekey = None
+        #: :py:class:`pweave.children.PwebChildren` for chunks with the child option
+        self.children = None
+        #: :py:class:`PwebCheckpoints` of the kernel namespace
+        self.checkpoints = None
+        #: Name or number of a chunk to resume from. Chunks above it are not run,
+        #: the kernel namespace is restored from the latest checkpoint before it.
+        self.from_chunk = None
+        # Requests of chunks sent to the kernel ahead, see _submitahead
+        self._pipeline = deque()
+        self._ahead = deque()
+        self._scanned = 0
+        self._chunks = None
+        # PwebParallel that runs chunks in worker kernels
+        self._parallel = None
 
         self.cwd = os.path.dirname(os.path.abspath(source))
         self.basename = os.path.basename(os.path.abspath(source)).split(".")[0]
         self.pending_code = ""  # Used for multichunk splits
 
     def run(self):
+        self.executed = list(self.iterrun())
+
+    def iterrun(self):
+        """Execute the document and yield executed chunks one at a time.
+        Chunks are removed from :py:attr:`parsed` as they are executed and
+        the results are not kept in :py:attr:`executed`, so they can be
+        released as soon as the caller has written them."""
         # Create directory for figures
         self.ensureDirectoryExists(self.getFigDirectory())
         # Documentation mode uses results from previous  executions
@@ -40,6 +85,8 @@ class PwebProcessorBase(object):
             success = self._getoldresults()
             if success:
                 print("Restoring cached results")
+                self.isexecuted = True
+                yield from self.executed
                 return
             else:
                 sys.stderr.write(
@@ -47,67 +94,160 @@ class PwebProcessorBase(object):
                 rcParams["storeresults"] = True
 
         self.executed = []
-
-        # Term chunk returns a list of dicts, this flattens the results
-        for chunk in self.parsed:
-            res = self._runcode(chunk)
-            if isinstance(res, list):
-                self.executed = self.executed + res
-            else:
-                self.executed.append(res)
-
-        self.isexecuted = True
-        if rcParams["storeresults"]:
-            self.store(self.executed)
-        self.close()
+        self.pending_code = ""
+        if self.cache is None and (rcParams["storeresults"] or self.incremental or
+                                   self._usecheckpoints()):
+            self.cache = self.getcache()
+        if self.checkpoints is None and self._usecheckpoints():
+            self.checkpoints = self.getcheckpoints()
+        if self.cache is not None:
+            self._upstream = self.cache.seed
+            self._index = []
+            self._replay = []
+            # Chunks the kernel has already run don't need to be replayed
+            self._live = set(key for key, _ in self._kernelkeys)
+            self._previous, self._kernelkeys = self._kernelkeys, []
+            self._skipped = []
+            # Snapshot of the new kernel for resuming when the first chunk changes
+            if self._statekey is None and self.savesnapshot(self.cache.seed):
+                self._statekey = self.cache.seed
+
+        # Child documents are run in parallel while this document is run
+        if isinstance(self.parsed, list) and any(self._childof(c) for c in self.parsed):
+            self._getchildren().start(self.parsed)
+
+        # Chunks are copied when they are run, the parsed chunks are not modified.
+        # Parsed chunks can be an iterator that reads the document as it is run.
+        if self._workercount():
+            from .parallel import PwebParallel
+            from ..dependencies import PwebDependencies
+
+            # The dependencies are found from all chunks before running them
+            self.parsed = list(self.parsed)
+            dependencies = PwebDependencies(self._withdefaults(c) for c in self.parsed)
+            self._parallel = PwebParallel(self, dependencies, self._workercount())
+        self._chunks = iter(self.parsed)
+        self.parsed = []
+        self._pipeline.clear()
+        self._ahead.clear()
+        self._scanned = 0
+        try:
+            for chunk in self._iterchunks():
+                chunk = PwebChunk.from_dict(chunk)
+                label = "%s %s" % (chunk["type"], chunk.get("number", ""))
+                with profiling.span(self.profiler, "run", label):
+                    res = self._runcode(chunk)
+                # Term chunk returns a list of dicts, this flattens the results
+                if isinstance(res, list):
+                    yield from res
+                else:
+                    yield res
+                del res
+
+            if self.from_chunk is not None:
+                sys.stderr.write("Can't resume from chunk %s, there is no such chunk\n" % self.from_chunk)
+                self.from_chunk = None
+            self.isexecuted = True
+            if self.cache is not None:
+                self.store()
+        finally:
+            if self._parallel is not None:
+                self._parallel.close()
+                self._parallel = None
+            if self.children is not None:
+                self.children.close()
+            if not self.incremental:
+                self.close()
 
     def close(self):
         pass
 
+    def _iterchunks(self):
+        """Iterate parsed chunks, including chunks that have been read ahead"""
+        while True:
+            if self._ahead:
+                self._scanned = max(self._scanned - 1, 0)
+                yield self._ahead.popleft()
+                continue
+            try:
+                yield next(self._chunks)
+            except StopIteration:
+                return
+
+    @staticmethod
+    def _childof(chunk):
+        """Child document included by a chunk or None"""
+        if chunk["type"] != "code":
+            return None
+        return chunk.get("options", {}).get("child")
+
+    def _getchildren(self):
+        if self.children is None:
+            from ..children import PwebChildren
+            self.children = PwebChildren(self.source, self.kernel or "python3")
+        return self.children
+
+    def _runchild(self, chunk):
+        """Get the executed chunks of the child document of a chunk"""
+        return [PwebChunk(executed) for executed in self._getchildren().get(chunk["child"])]
+
     def ensureDirectoryExists(self, figdir):
         if not os.path.isdir(figdir):
             os.makedirs(figdir)
 
     def getresults(self):
-        # flattened = list(itertools.chain.from_iterable(self.executed))
-        return copy.deepcopy(self.executed)
-
-    def store(self, data):
-        """Cache the results"""
-        cachedir = os.path.join(self.cwd, rcParams["cachedir"])
-        self.ensureDirectoryExists(cachedir)
-
-        name = cachedir + "/" + self.basename + ".pkl"
-        with open(name, 'wb') as f:
-            pickle.dump(data, f, pickle.HIGHEST_PROTOCOL)
+        """Hand the executed chunks over to the caller, the processor
+        doesn't keep them"""
+        executed, self.executed = self.executed, []
+        return executed
+
+    def _usecheckpoints(self):
+        return rcParams["checkpoints"] or self.from_chunk is not None
+
+    def getcache(self):
+        """Get the chunk cache for the current document, results are stored
+        on disk if caching or checkpoints are enabled"""
+        if rcParams["storeresults"] or self._usecheckpoints():
+            cachedir = os.path.join(self.cwd, rcParams["cachedir"], self.basename)
+        else:
+            cachedir = None
+        seed = "%s:%s" % (self.kernel, rcParams["usematplotlib"])
+        return PwebChunkCache(cachedir, seed)
+
+    def getcheckpoints(self):
+        """Get the checkpoints of the current document"""
+        directory = os.path.join(self.cwd, rcParams["cachedir"], self.basename, "checkpoints")
+        return PwebCheckpoints(directory, rcParams["serializer"], rcParams["checkpoints"] is True)
+
+    def store(self):
+        """Store the index of cached chunks used by documentation mode"""
+        self.cache.store_index(self._index)
 
     def restore(self):
-        """Restore results from cache"""
-        cachedir = os.path.join(self.cwd, rcParams["cachedir"])
-        name = cachedir + "/" + self.basename + ".pkl"
-
-        if os.path.exists(name):
-            with open(name, 'rb') as f:
-                self._oldresults = pickle.load(f)
-            return True
+        """Restore results of the previous run from cache"""
+        cache = self.getcache()
+        index = cache.restore_index()
+        if index is None:
+            return False
 
-        return False
+        self._oldresults = {}
+        for chunk_type, number, key in index:
+            if chunk_type != "code":
+                continue
+            data = cache.get(key)
+            if data is None:
+                return False
+            self._oldresults[number] = data
+        return True
 
     def _runcode(self, chunk):
         """Execute code from a code chunk based on options"""
         if chunk['type'] != 'doc' and chunk['type'] != 'code':
             return chunk
 
-        # Add defaultoptions to parsed options
+        # Options that are not set in the chunk are looked up from defaultoptions
         if chunk['type'] == 'code':
-            defaults = rcParams["chunk"]["defaultoptions"].copy()
-            defaults.update(chunk["options"])
-            chunk.update(defaults)
-            # This is a bit redundant,
-            # it is added afterwards to support adding options as
-            # metadata to notebooks
-            chunk["options"] = defaults
-            #del chunk['options']
+            chunk.setdefaults(rcParams["chunk"]["defaultoptions"])
 
             # Read the content from file or object
         if 'source' in chunk:
@@ -119,6 +259,8 @@ class PwebProcessorBase(object):
             else:
                 # Get the text from chunk
                 chunk_text = chunk["content"]
+                # inspect needs the modules imported by previous chunks
+                self._flushreplay()
                 # Get the module source using inspect
                 module_text = self.loadstring(
                     "import inspect\nprint(inspect.getsource(%s))" % source)
@@ -131,6 +273,9 @@ class PwebProcessorBase(object):
             return chunk
 
         if chunk['type'] == 'code':
+            if chunk.get("child"):
+                return self._runchild(chunk)
+
             sys.stdout.write(
                 "Processing chunk %(number)s named %(name)s from line %(start_line)s\n" % chunk)
 
@@ -149,8 +294,49 @@ class PwebProcessorBase(object):
                 chunk['result'] = ''
                 return chunk
 
-            self.pre_run_hook(chunk)
+            if self.from_chunk is not None and str(self.from_chunk) in (chunk["name"], str(chunk["number"])):
+                self._resume(chunk)
+
+            # The kernel has already been sent the code of chunks read ahead
+            request = self._pipelined(chunk)
+            # Chunks run by a worker kernel at the same time as the chunks above them
+            offloaded = self._parallel is not None and self._parallel.running(chunk)
+            key = None
+            upstream = self._upstream
+            if self.cache is not None:
+                key = self.cache.key(self._upstream, chunk)
+                self._upstream = key
+                self._index.append(("code", chunk["number"], key))
+                cached = self.cache.get(key) if request is None and not offloaded else None
+                if cached is not None:
+                    sys.stdout.write("Using cached results for chunk %(number)s\n" % chunk)
+                    return self._usecached(chunk, cached, key, old_content)
+
+            # Chunks above the chunk to resume from are not run
+            if self.from_chunk is not None:
+                sys.stdout.write("Skipping chunk %(number)s\n" % chunk)
+                chunk['result'] = ''
+                return chunk
 
+            # Outputs stored in an executed notebook, see PwebNBReader.reuse_outputs
+            if "outputs" in chunk and not chunk["term"]:
+                sys.stdout.write("Using notebook outputs for chunk %(number)s\n" % chunk)
+                cached = {"result": chunk["outputs"]}
+                if self.cache is not None:
+                    self.cache.put(key, cached)
+                return self._usecached(chunk, cached, key, old_content)
+            if request is None and not offloaded:
+                self._flushreplay()
+                self._syncstate(upstream)
+
+                with profiling.span(self.profiler, "pre_run_hook"):
+                    self.pre_run_hook(chunk)
+            if self._parallel is not None:
+                self._parallel.submitahead(chunk, self._lookahead())
+            elif not chunk['term']:
+                request = self._submitahead(chunk, request)
+
+            code = chunk['content']
             if chunk['term']:
                 # Running in term mode can return a list of chunks
                 chunks = []
@@ -174,21 +360,296 @@ class PwebProcessorBase(object):
                     new_chunk["result"] = ""
                     chunks.append(new_chunk)
 
-                return chunks
+                result = chunks
             else:
-                chunk['result'] = self.loadstring(chunk['content'], chunk=chunk)
-
-        # After executing the code save the figure
-        if chunk['fig']:
-            chunk['figure'] = self.savefigs(chunk)
+                if offloaded:
+                    chunk['result'] = self._parallel.collect(chunk)
+                elif request is None:
+                    chunk['result'] = self.loadstring(chunk['content'], chunk=chunk)
+                else:
+                    chunk['result'] = self.collect(request, chunk=chunk)
+
+                # After executing the code save the figure
+                if chunk['fig']:
+                    with profiling.span(self.profiler, "figures"):
+                        chunk['figure'] = self.savefigs(chunk)
+
+                if old_content is not None:
+                    # The code from current chunk for display
+                    chunk['content'] = old_content
+
+                self.post_run_hook(chunk)
+                result = chunk
+
+            if self.cache is not None:
+                self.cache.put(key, result)
+                self._kernelkeys.append((key, [code]))
+                self._snapshot(key)
+                if self.checkpoints is not None and self.checkpoints.wanted(chunk):
+                    self._checkpoint(chunk, key)
+
+            return result
+
+    def _pipelinedepth(self):
+        """Number of chunks to send to the kernel ahead of the running chunk.
+        Checkpoints need the kernel state after each chunk, so they are not
+        used together."""
+        if self.checkpoints is not None or self.from_chunk is not None:
+            return 0
+        return rcParams["pipeline"]
+
+    def _submitahead(self, chunk, request):
+        """Send chunk, unless it has been sent already, and the chunks after it to
+        the kernel without waiting for the results, so the kernel doesn't wait for
+        Pweave between chunks.
+
+        Chunks are read ahead until one needs Pweave to run it, e.g. a doc
+        chunk with inline code or a term chunk. Returns the request of chunk or
+        None if the processor doesn't pipeline requests."""
+        depth = self._pipelinedepth()
+        if depth < 1:
+            return request
+        if request is None:
+            request = self.submit(chunk["content"], chunk=chunk)
+            if request is None:
+                return None
+        while len(self._pipeline) < depth:
+            ahead = self._peek(self._scanned)
+            if ahead is None or not self._canpipeline(ahead):
+                break
+            self._scanned += 1
+            if ahead["type"] == "code" and ahead["evaluate"]:
+                self.pre_run_hook(ahead)
+                self._pipeline.append((ahead["number"], self.submit(ahead["content"], chunk=ahead)))
+        return request
+
+    def _peek(self, i):
+        """The i:th chunk after the running chunk with default options or None"""
+        while len(self._ahead) <= i:
+            try:
+                self._ahead.append(next(self._chunks))
+            except StopIteration:
+                return None
+        return self._withdefaults(self._ahead[i])
+
+    def _lookahead(self):
+        """Iterate the chunks after the running chunk"""
+        i = 0
+        while True:
+            chunk = self._peek(i)
+            if chunk is None:
+                return
+            yield chunk
+            i += 1
+
+    @staticmethod
+    def _withdefaults(chunk):
+        chunk = PwebChunk.from_dict(chunk)
+        if chunk["type"] == "code":
+            chunk.setdefaults(rcParams["chunk"]["defaultoptions"])
+        return chunk
 
+    def _workercount(self):
+        """Number of worker kernels for running independent chunks at the same time.
+        Workers are not used when the kernel state is kept after the run or restored
+        from checkpoints."""
+        if (not self.supports_workers or self.incremental or self.checkpoints is not None or
+                self.from_chunk is not None):
+            return 0
+        return rcParams["parallel"]
+
+    @staticmethod
+    def _canpipeline(chunk):
+        """Can the chunk be run without Pweave running code in between"""
+        if "source" in chunk:
+            return False
+        if chunk["type"] == "doc":
+            return "<%" not in chunk["content"]
+        if chunk["type"] != "code":
+            return True
+        return (chunk["complete"] and not chunk["term"] and not chunk.get("child") and
+                "outputs" not in chunk)
+
+    def _pipelined(self, chunk):
+        """Request of a chunk that was sent to the kernel ahead or None"""
+        if self._pipeline and self._pipeline[0][0] == chunk["number"]:
+            return self._pipeline.popleft()[1]
+        return None
+
+    def _usecached(self, chunk, cached, key, old_content):
+        """Use cached results for a chunk. The code is replayed later
+        if a chunk that is executed needs the kernel state"""
+        self._addreplay(key, chunk, [chunk["content"]])
+
+        # Term chunks are stored as a list
+        if isinstance(cached, list):
+            chunks = []
+            for old in cached:
+                new_chunk = chunk.copy()
+                new_chunk["content"] = old["content"]
+                new_chunk["result"] = old["result"]
+                chunks.append(new_chunk)
+            return chunks
+
+        chunk["result"] = cached["result"]
+        if "figure" in cached:
+            chunk["figure"] = cached["figure"]
         if old_content is not None:
-            # The code from current chunk for display
-            chunk['content'] = old_content
+            chunk["content"] = old_content
+        return chunk
 
-        self.post_run_hook(chunk)
+    def _addreplay(self, key, chunk, code):
+        """Queue code from a cached chunk for replaying, code is a list of strings.
+        `chunk` is None for inline code from doc chunks"""
+        if key in self._live and not self._replay:
+            # The kernel is still running from the previous run
+            self._kernelkeys.append((key, code))
+            self._skipped.append((key, chunk, code))
+        else:
+            self._replay.append((key, chunk, code))
+
+    def _flushreplay(self):
+        """Run the code from cached chunks to restore the kernel state. The
+        namespace is restored from the latest valid checkpoint if there is one
+        and only chunks after it are replayed."""
+        if not self._replay:
+            return
+        replay, self._replay = self._replay, []
+        for i in range(len(replay) - 1, -1, -1):
+            if self._restorestate(replay[i][0], replay[i][1]):
+                self._kernelkeys.extend((entry[0], entry[2]) for entry in replay[:i + 1])
+                replay = replay[i + 1:]
+                break
+        if not replay:
+            return
+        sys.stdout.write(
+            "Replaying %i cached chunks to restore kernel state\n" % len(replay))
+        for key, chunk, code in replay:
+            for code_str in code:
+                if chunk is None:
+                    self.load_inline_string(code_str)
+                else:
+                    self.pre_run_hook(chunk)
+                    self.loadstring(code_str, chunk=chunk)
+            self._kernelkeys.append((key, code))
+            self._snapshot(key)
+            # Store checkpoints that are missing e.g. because serializing failed
+            if (chunk is not None and self.checkpoints is not None and
+                    self.checkpoints.wanted(chunk) and self.checkpoints.find(key) is None):
+                self._checkpoint(chunk, key)
+
+    def _restorestate(self, key, chunk):
+        """Restore the kernel state after cached code from a snapshot or a checkpoint,
+        `chunk` is None for inline code"""
+        if self._resumesnapshot(key):
+            source = "snapshot"
+        else:
+            path = None
+            if chunk is not None and self.checkpoints is not None:
+                path = self.checkpoints.find(key)
+            if path is None or not self._restore(path):
+                return False
+            source = "checkpoint"
+            self._statekey = key
+        after = "inline code" if chunk is None else "chunk %s" % chunk["number"]
+        sys.stdout.write("Restored kernel state from %s after %s\n" % (source, after))
+        return True
 
-        return chunk
+    def _snapshot(self, key):
+        """The kernel state is the result of code with key, store a snapshot of it"""
+        self._statekey = key
+        with profiling.span(self.profiler, "snapshot"):
+            self.savesnapshot(key)
+
+    def _resumesnapshot(self, key):
+        with profiling.span(self.profiler, "snapshot"):
+            if not self.restoresnapshot(key):
+                return False
+        self._statekey = key
+        return True
+
+    def _syncstate(self, upstream):
+        """Roll the kernel back to the state after the code above if it has run other
+        code since, e.g. chunks below a changed chunk in the previous incremental run.
+        The kernel resumes from a snapshot or it is restarted and the code above is
+        replayed."""
+        if self._statekey is None or self._statekey == upstream:
+            return
+        if self._resumesnapshot(upstream):
+            sys.stdout.write("Resumed kernel from snapshot of the code above\n")
+            return
+        if self._unchanged(upstream):
+            self._statekey = upstream
+            return
+        sys.stdout.write("Restarting kernel to discard the results of the code below\n")
+        self._statekey = None
+        if not self.restartkernel():
+            sys.stderr.write("Can't restart the kernel, variables from the previous run "
+                             "are still defined\n")
+            return
+        self._replay, self._skipped = self._skipped, []
+        self._kernelkeys = []
+        self._previous = []
+        self._live = set()
+        self._flushreplay()
+
+    def _unchanged(self, upstream):
+        """Did the code the kernel ran after the code above in the previous
+        incremental run leave the global names unchanged, e.g. only print them"""
+        from ..dependencies import pure
+
+        keys = [key for key, _ in self._previous]
+        if not keys or keys[-1] != self._statekey:
+            return False
+        start = keys.index(upstream) + 1 if upstream in keys else 0
+        return all(pure("\n".join(code)) for _, code in self._previous[start:])
+
+    def _checkpoint(self, chunk, key):
+        """Store a checkpoint of the kernel namespace after chunk"""
+        path = self.checkpoints.newpath(chunk["number"], key)
+        with profiling.span(self.profiler, "checkpoint"):
+            if self.savecheckpoint(path, self.checkpoints.serializer):
+                sys.stdout.write("Stored checkpoint after chunk %(number)s\n" % chunk)
+
+    def _restore(self, path):
+        with profiling.span(self.profiler, "checkpoint"):
+            return self.restorecheckpoint(path)
+
+    def _resume(self, chunk):
+        """Restore the namespace from the latest checkpoint before chunk, chunks
+        after the checkpoint that were cached are replayed"""
+        self.from_chunk = None
+        found = self.checkpoints.before(chunk["number"])
+        if found is None or not self._restore(found[1]):
+            sys.stdout.write("No checkpoint before chunk %(number)s, replaying cached chunks\n" % chunk)
+            return
+        number, path = found
+        sys.stdout.write("Resuming from checkpoint after chunk %i\n" % number)
+        self._statekey = None
+        self._replay = [entry for entry in self._replay
+                        if entry[1] is not None and entry[1]["number"] > number]
+
+    def savecheckpoint(self, path, serializer, names=None):
+        """Store the kernel namespace or the variables in `names` to path using a
+        serializer module, returns True if the checkpoint was stored"""
+        return False
+
+    def restorecheckpoint(self, path):
+        """Restore the kernel namespace from path, returns True on success"""
+        return False
+
+    def savesnapshot(self, key):
+        """Keep a snapshot of the kernel state with key, returns True if the
+        snapshot was stored"""
+        return False
+
+    def restoresnapshot(self, key):
+        """Continue from the snapshot stored with key, returns True on success"""
+        return False
+
+    def restartkernel(self):
+        """Start over with an empty kernel namespace, returns True on success"""
+        return False
 
     def post_run_hook(self, chunk):
         pass
@@ -214,16 +675,15 @@ class PwebProcessorBase(object):
 
         executed = []
 
-        n = len(self.parsed)
-
-        for i in range(n):
-            chunk = self.parsed[i]
+        for chunk in self.parsed:
             if chunk['type'] != "code":
                 executed.append(self._hideinline(chunk.copy()))
-            else:
-                chunks = [c for c in self._oldresults
-                          if c["number"] == i and c["type"] == "code"]
-                executed = executed + chunks
+            elif chunk['number'] in self._oldresults:
+                old = self._oldresults[chunk['number']]
+                if isinstance(old, list):
+                    executed = executed + old
+                else:
+                    executed.append(old)
 
         self.executed = executed
         return True
@@ -237,6 +697,25 @@ class PwebProcessorBase(object):
     def loadterm(self, code_string, chunk=None):
         pass
 
+    def startworker(self):
+        """Start a processor with a new kernel for running chunks at the same time
+        as this processor, see :py:class:`pweave.processors.parallel.PwebParallel`"""
+        return None
+
+    def submit(self, code, chunk=None):
+        """Send code to the kernel without waiting for it to finish. Returns a
+        request for :py:meth:`collect` or None if the processor doesn't support
+        pipelining requests."""
+        return None
+
+    def collect(self, request, chunk=None):
+        """Wait for a request from :py:meth:`submit` and return the results"""
+        pass
+
+    def discard(self, request):
+        """The results of a request from :py:meth:`submit` won't be collected"""
+        pass
+
     def load_inline_string(self, code_string):
         pass
 
@@ -249,6 +728,8 @@ class PwebProcessorBase(object):
             return content
 
         n = len(splitted)
+        positions = []
+        code = []
 
         for i in range(n):
             elem = splitted[i]
@@ -256,15 +737,38 @@ class PwebProcessorBase(object):
                 continue
             if elem.startswith('<%='):
                 code_str = elem.replace('<%=', '').replace('%>', '').lstrip()
-                result = self.load_inline_string(code_str).strip()
-                splitted[i] = result
-                continue
-            if elem.startswith('<%'):
+            else:
                 code_str = elem.replace('<%', '').replace('%>', '').lstrip()
-                result = self.load_inline_string(code_str).strip()
-                splitted[i] = result
+            positions.append(i)
+            code.append(code_str)
+
+        for i, result in zip(positions, self._runinline(code)):
+            splitted[i] = result
         return ''.join(splitted)
 
+    def _runinline(self, code):
+        """Evaluate a list of inline code strings, using cache if possible"""
+        if self.cache is not None:
+            upstream = self._upstream
+            key = self.cache.inline_key(self._upstream, code)
+            self._upstream = key
+            self._index.append(("doc", None, key))
+            cached = self.cache.get(key)
+            if cached is not None:
+                self._addreplay(key, None, code)
+                return cached
+        self._flushreplay()
+        if self.cache is not None:
+            self._syncstate(upstream)
+
+        results = [self.load_inline_string(code_str).strip() for code_str in code]
+
+        if self.cache is not None:
+            self.cache.put(key, results)
+            self._kernelkeys.append((key, code))
+            self._snapshot(key)
+        return results
+
     def add_echo(self, code_str):
         return 'print(%s),' % code_str
 
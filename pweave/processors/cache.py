@@ -0,0 +1,106 @@
+"""
+Content addressed cache for the results of executed chunks
+"""
+
+import os
+import hashlib
+import pickle
+
+
+class PwebChunkCache(object):
+    """Stores the results of executed chunks in memory and on disk.
+
+    Each chunk is stored under a key computed from its code, the options that
+    affect execution and the key of the previous chunk, so a chunk is only
+    reused if nothing above it in the document has changed either.
+
+    :param directory: ``string`` directory for the cached chunks of one document,
+                      if None results are only kept in memory
+    :param seed: ``string`` extra data to mix into the first key e.g. kernel name
+    """
+
+    #: Cache format version, bump to invalidate existing caches
+    version = 1
+
+    #: Options that only affect the formatting of results
+    format_options = {"echo", "results", "include", "caption", "wrap",
+                      "name", "label", "width", "f_pos", "f_env", "f_spines",
+                      "option_string", "display_data", "display_stream", "checkpoint"}
+
+    def __init__(self, directory=None, seed=""):
+        self.directory = directory
+        self.seed = self.hash("pweave-cache-%i" % self.version, seed)
+        self.memory = {}
+
+    @staticmethod
+    def hash(*parts):
+        h = hashlib.sha1()
+        for part in parts:
+            h.update(part.encode("utf-8"))
+            h.update(b"\0")
+        return h.hexdigest()
+
+    def key(self, upstream, chunk):
+        """Key for a code chunk, `upstream` is the key of the previous chunk"""
+        options = sorted((k, repr(v)) for k, v in chunk["options"].items()
+                         if k not in self.format_options)
+        return self.hash(upstream, "code", chunk["content"], repr(options))
+
+    def inline_key(self, upstream, code):
+        """Key for inline code from a doc chunk, `code` is a list of strings"""
+        return self.hash(upstream, "doc", *code)
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + ".pkl")
+
+    def get(self, key):
+        """Get a stored entry or None"""
+        if key in self.memory:
+            return self.memory[key]
+        if self.directory is None:
+            return None
+        try:
+            with open(self._path(key), 'rb') as f:
+                return pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return None
+
+    def put(self, key, data):
+        """Store an entry"""
+        self.memory[key] = data
+        if self.directory is None:
+            return
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        # Write to a temporary file first so that an interrupted run
+        # doesn't leave broken entries behind
+        name = self._path(key)
+        with open(name + ".tmp", 'wb') as f:
+            pickle.dump(data, f, pickle.HIGHEST_PROTOCOL)
+        os.replace(name + ".tmp", name)
+
+    def store_index(self, index):
+        """Store the keys used by the last run as a list of
+        (chunk type, chunk number, key) tuples and remove entries that are
+        no longer used"""
+        used = set(entry[-1] for entry in index)
+        self.memory = dict((k, v) for k, v in self.memory.items() if k in used)
+        if self.directory is None:
+            return
+
+        self.put("index", index)
+        del self.memory["index"]
+        keep = set(key + ".pkl" for key in used)
+        keep.add("index.pkl")
+        for name in os.listdir(self.directory):
+            if name.endswith(".pkl") and name not in keep:
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except OSError:
+                    pass
+
+    def restore_index(self):
+        """Get the index stored by the last run or None"""
+        if self.directory is None:
+            return None
+        return self.get("index")
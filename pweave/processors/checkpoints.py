@@ -0,0 +1,66 @@
+"""
+Snapshots of the kernel namespace stored after code chunks
+"""
+
+import os
+
+
+class PwebCheckpoints(object):
+    """Checkpoints of the kernel namespace. A checkpoint is stored under the
+    cache key of the chunk it was taken after, so it is valid as long as the
+    chunk and all chunks above it are unchanged. Only the latest checkpoint of
+    each chunk is kept.
+
+    :param directory: ``string`` directory for the checkpoints
+    :param serializer: ``string`` module used to serialize the namespace in the
+        kernel: pickle, cloudpickle or dill
+    :param every: ``bool`` store a checkpoint after every code chunk, otherwise only
+        after chunks with the checkpoint option
+    """
+
+    extension = ".ckpt"
+
+    def __init__(self, directory, serializer="pickle", every=False):
+        self.directory = directory
+        self.serializer = serializer
+        self.every = every
+
+    def wanted(self, chunk):
+        """Should a checkpoint be stored after chunk"""
+        return self.every or bool(chunk.get("checkpoint"))
+
+    def entries(self):
+        """List stored checkpoints as (chunk number, key, path) tuples"""
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            return []
+        entries = []
+        for name in names:
+            base, ext = os.path.splitext(name)
+            number, _, key = base.partition("-")
+            if ext == self.extension and number.isdigit():
+                entries.append((int(number), key, os.path.join(self.directory, name)))
+        return entries
+
+    def newpath(self, number, key):
+        """Path for a new checkpoint of a chunk, removes older checkpoints of the chunk"""
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        for old, _, path in self.entries():
+            if old == number:
+                os.remove(path)
+        return os.path.abspath(os.path.join(self.directory, "%i-%s%s" % (number, key, self.extension)))
+
+    def find(self, key):
+        """Path of the checkpoint stored with key or None"""
+        for _, old, path in self.entries():
+            if old == key:
+                return path
+        return None
+
+    def before(self, number):
+        """Latest checkpoint of a chunk before chunk `number` regardless of
+        whether it is valid, returns (chunk number, path) or None"""
+        entries = [(n, path) for n, _, path in self.entries() if n < number]
+        return max(entries) if entries else None
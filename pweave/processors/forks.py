@@ -0,0 +1,351 @@
+"""
+Fork snapshots of the embedded Python kernel, Linux only
+"""
+
+import os
+import sys
+import uuid
+import signal
+import socket
+import select
+import traceback
+from collections import OrderedDict, deque
+from multiprocessing.connection import Connection
+from queue import Queue, Empty
+
+#: Snapshots rely on copy-on-write fork, they are only used on Linux
+supported = sys.platform.startswith("linux")
+
+
+def _address(pid):
+    """Abstract socket of a snapshot, nothing is created in the file system"""
+    return "\0pweave-snapshot-%i" % pid
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _fork():
+    """Fork a process that is not a child of the caller, so it doesn't need to be
+    waited for. Returns True in the new process."""
+    sys.stdout.flush()
+    sys.stderr.flush()
+    pid = os.fork()
+    if pid == 0:
+        if os.fork() != 0:
+            os._exit(0)
+        return True
+    os.waitpid(pid, 0)
+    return False
+
+
+def _exit(function, *args):
+    """Run function in a forked process and exit, the process must never
+    return to the code that forked it"""
+    try:
+        function(*args)
+    except BaseException:
+        traceback.print_exc()
+    finally:
+        os._exit(0)
+
+
+def _message(msg):
+    """Copy of a kernel message that can be sent to Pweave"""
+    return {key: msg[key] for key in ("header", "parent_header", "metadata", "content", "msg_type")
+            if key in msg}
+
+
+class _PwebForkHost(object):
+    """Runs an embedded kernel in a forked process and serves the requests of
+    :py:class:`PwebForkKernelManager`. A snapshot is a suspended fork of the host
+    that forks again to resume, so each snapshot can be resumed any number of times.
+
+    :param conn: ``multiprocessing.connection.Connection`` to Pweave
+    :param parent: ``int`` process id of Pweave, the host and snapshots exit with it
+    """
+
+    def __init__(self, conn, parent, kernel_name, cwd):
+        self.conn = conn
+        self.parent = parent
+        self.kernel_name = kernel_name
+        self.cwd = cwd
+        self.km = None
+        self.kc = None
+
+    def start(self):
+        from ipykernel.inprocess.ipkernel import InProcessInteractiveShell
+
+        # Don't share the namespace of other embedded kernels of Pweave
+        InProcessInteractiveShell.clear_instance()
+        os.chdir(self.cwd)
+        self.start_kernel()
+        self.conn.send(("started", os.getpid()))
+        self.serve()
+
+    def start_kernel(self):
+        """Start the embedded kernel, the threads of a kernel don't survive fork so
+        a resumed snapshot starts a new kernel. The new kernel uses the existing
+        shell with the namespace of the snapshot."""
+        from ipykernel.inprocess import InProcessKernelManager
+
+        self.km = InProcessKernelManager(kernel_name=self.kernel_name)
+        self.km.start_kernel()
+        self.km.kernel.shell.kernel = self.km.kernel
+        # The kernel is ready when it has been started, wait_for_ready would
+        # poll the iopub channel for 0.2 s
+        self.kc = self.km.client()
+        self.kc.start_channels()
+        self.kc.allow_stdin = False
+
+    def serve(self):
+        while True:
+            try:
+                if not self.conn.poll(1):
+                    if _alive(self.parent):
+                        continue
+                    break
+                request = self.conn.recv()
+            except KeyboardInterrupt:
+                continue
+            except (EOFError, OSError):
+                break
+            if request[0] == "execute":
+                self.conn.send(self.execute(*request[1:]))
+            elif request[0] == "snapshot":
+                self.conn.send(("snapshot", self.snapshot()))
+            else:
+                break
+
+    def execute(self, code, kwargs):
+        msg_id = self.kc.execute(code, **kwargs)
+        shell = [_message(self.kc.get_shell_msg(timeout=1))]
+        iopub = []
+        while True:
+            try:
+                msg = self.kc.iopub_channel.get_msg(timeout=4)
+            except Empty:
+                break
+            iopub.append(_message(msg))
+            if (msg['parent_header'].get('msg_id') == msg_id and msg['msg_type'] == 'status' and
+                    msg['content']['execution_state'] == 'idle'):
+                break
+        return ("reply", msg_id, shell, iopub)
+
+    def snapshot(self):
+        """Fork a suspended copy of the host, returns its process id or None"""
+        r, w = os.pipe()
+        if _fork():
+            os.close(r)
+            _exit(self.suspend, w)
+        os.close(w)
+        with os.fdopen(r, "rb") as f:
+            pid = f.read()
+        return int(pid) if pid else None
+
+    def suspend(self, ready):
+        """Wait until Pweave resumes from the snapshot or exits"""
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        self.conn.close()
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.bind(_address(os.getpid()))
+        sock.listen()
+        os.write(ready, str(os.getpid()).encode())
+        os.close(ready)
+
+        while _alive(self.parent):
+            if not select.select([sock], [], [], 1)[0]:
+                continue
+            client, _ = sock.accept()
+            if _fork():
+                sock.close()
+                signal.signal(signal.SIGINT, signal.default_int_handler)
+                self.conn = Connection(client.detach())
+                _exit(self.resume)
+            client.close()
+
+    def resume(self):
+        self.start_kernel()
+        self.conn.send(("resumed", os.getpid()))
+        self.serve()
+
+
+class PwebForkKernelClient(object):
+    """Client for :py:class:`PwebForkKernelManager` with the methods of
+    ``jupyter_client.BlockingKernelClient`` that the processors use"""
+
+    def __init__(self, manager):
+        self.manager = manager
+        self.allow_stdin = False
+        self.reset()
+
+    def reset(self):
+        """Drop messages from the previous kernel"""
+        self.shell_channel = Queue()
+        self.iopub_channel = _PwebForkChannel(self)
+        # Local message ids of requests that haven't been replied to
+        self._pending = deque()
+
+    def start_channels(self):
+        pass
+
+    def stop_channels(self):
+        pass
+
+    def wait_for_ready(self, timeout=None):
+        pass
+
+    def execute(self, code, silent=False, store_history=True, user_expressions=None,
+                allow_stdin=None, stop_on_error=True):
+        kwargs = dict(silent=silent, store_history=store_history,
+                      user_expressions=user_expressions, stop_on_error=stop_on_error)
+        self.manager.conn.send(("execute", code, kwargs))
+        msg_id = uuid.uuid4().hex
+        self._pending.append(msg_id)
+        return msg_id
+
+    def get_shell_msg(self, timeout=None):
+        return self._get(self.shell_channel, timeout)
+
+    def _get(self, queue, timeout):
+        """Get a message from a local queue, receives replies from the host
+        until there is one"""
+        while queue.empty():
+            if not self._pending or not self.manager.conn.poll(timeout):
+                raise Empty
+            _, host_id, shell, iopub = self.manager.conn.recv()
+            msg_id = self._pending.popleft()
+            for msg in shell + iopub:
+                if msg['parent_header'].get('msg_id') == host_id:
+                    msg['parent_header']['msg_id'] = msg_id
+            for msg in shell:
+                self.shell_channel.put(msg)
+            for msg in iopub:
+                self.iopub_channel.queue.put(msg)
+        return queue.get()
+
+
+class _PwebForkChannel(object):
+
+    def __init__(self, client):
+        self.client = client
+        self.queue = Queue()
+
+    def get_msg(self, timeout=None):
+        return self.client._get(self.queue, timeout)
+
+
+class PwebForkKernelManager(object):
+    """Runs the embedded Python kernel in a forked process and keeps suspended
+    forks of it as snapshots of the kernel state. Resuming from a snapshot forks
+    it again, which takes milliseconds and works for objects that can't be
+    serialized. Memory is shared copy-on-write between the kernel and the
+    snapshots until they change it.
+
+    Has the methods of ``jupyter_client.KernelManager`` that the processors use.
+
+    :param kernel_name: ``string`` name of the kernel
+    :param max_snapshots: ``int`` number of snapshots kept, the least recently
+        used snapshots are removed
+    """
+
+    def __init__(self, kernel_name="python3", max_snapshots=16):
+        self.kernel_name = kernel_name
+        self.max_snapshots = max_snapshots
+        #: Process ids of snapshots by key, least recently used first
+        self.snapshots = OrderedDict()
+        self.conn = None
+        self.pid = None
+        self._client = None
+
+    def start_kernel(self, cwd=None, **kwargs):
+        cwd = cwd or os.getcwd()
+        parent = os.getpid()
+        ours, theirs = socket.socketpair()
+        if _fork():
+            ours.close()
+            host = _PwebForkHost(Connection(theirs.detach()), parent, self.kernel_name, cwd)
+            _exit(host.start)
+        theirs.close()
+        self.conn = Connection(ours.detach())
+        try:
+            _, self.pid = self.conn.recv()
+        except EOFError:
+            raise RuntimeError("Can't start kernel in a forked process")
+
+    def client(self):
+        if self._client is None:
+            self._client = PwebForkKernelClient(self)
+        return self._client
+
+    def is_alive(self):
+        return self.pid is not None and _alive(self.pid)
+
+    def interrupt_kernel(self):
+        os.kill(self.pid, signal.SIGINT)
+
+    def snapshot(self, key):
+        """Store a snapshot of the current kernel state with key, returns
+        True if the snapshot was stored"""
+        self.conn.send(("snapshot",))
+        pid = self.conn.recv()[1]
+        if pid is None:
+            return False
+        self._remove(key)
+        self.snapshots[key] = pid
+        while len(self.snapshots) > self.max_snapshots:
+            self._remove(next(iter(self.snapshots)))
+        return True
+
+    def resume(self, key):
+        """Replace the kernel with a fork of the snapshot stored with key,
+        returns False if there is no such snapshot"""
+        pid = self.snapshots.get(key)
+        if pid is None:
+            return False
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(_address(pid))
+            conn = Connection(sock.detach())
+            _, newpid = conn.recv()
+        except (OSError, EOFError):
+            sock.close()
+            self.snapshots.pop(key)
+            return False
+        self._stop()
+        self.conn, self.pid = conn, newpid
+        self.snapshots.move_to_end(key)
+        if self._client is not None:
+            self._client.reset()
+        return True
+
+    def _remove(self, key):
+        pid = self.snapshots.pop(key, None)
+        if pid is not None:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    def _stop(self):
+        try:
+            self.conn.send(("shutdown",))
+        except OSError:
+            pass
+        self.conn.close()
+
+    def shutdown_kernel(self, now=False, restart=False):
+        """Stop the kernel and the snapshots"""
+        if self.conn is None:
+            return
+        self._stop()
+        self.conn = None
+        for key in list(self.snapshots):
+            self._remove(key)
@@ -4,57 +4,133 @@ from jupyter_client.manager import start_new_kernel
 from jupyter_client import KernelManager
 from nbformat.v4 import output_from_msg
 import os
+import sys
 
 from .. import config
+from .. import profiling
 from .base import PwebProcessorBase
 from . import subsnippets
+from . import forks
 from IPython.core import inputsplitter
 from ipykernel.inprocess import InProcessKernelManager
 
 from queue import Empty
+from collections import deque
+
+
+def start_kernel(kernel, cwd, embed_kernel=False, snapshots=0):
+    """Start a kernel and return the kernel manager and client
+
+    :param snapshots: ``int`` run the embedded kernel in a forked process and keep
+                      this many snapshots of it, see :py:mod:`pweave.processors.forks`
+    """
+    if embed_kernel and snapshots:
+        km = forks.PwebForkKernelManager(kernel_name=kernel, max_snapshots=snapshots)
+    elif embed_kernel:
+        km = InProcessKernelManager(kernel_name=kernel)
+    else:
+        km = KernelManager(kernel_name=kernel)
+
+    km.start_kernel(cwd=cwd, stderr=open(os.devnull, 'w'))
+    kc = km.client()
+    kc.start_channels()
+    try:
+        kc.wait_for_ready()
+    except RuntimeError:
+        print(
+            "Timeout from starting kernel\nTry restarting python session and running weave again")
+        kc.stop_channels()
+        km.shutdown_kernel()
+        raise
+
+    kc.allow_stdin = False
+    return km, kc
 
 
 class JupyterProcessor(PwebProcessorBase):
-    """Generic Jupyter processor, should work with any kernel"""
+    """Generic Jupyter processor, should work with any kernel
+
+    :param kernel_pool: :py:class:`pweave.processors.pool.PwebKernelPool` to take
+                        a running kernel from instead of starting a new one
+    """
 
     def __init__(self, parsed, kernel, source, mode,
-                 figdir, outdir, embed_kernel=None):
+                 figdir, outdir, embed_kernel=None, kernel_pool=None, snapshots=0):
         super(JupyterProcessor, self).__init__(parsed, source, mode, figdir, outdir)
 
+        self.kernel = kernel
         self.extra_arguments = None
+        #: Seconds to wait for a cell to finish, -1 waits forever
         self.timeout = -1
-        path = os.path.abspath(outdir)
-
-        if embed_kernel:
-            km = InProcessKernelManager(kernel_name=kernel)
+        #: Interrupt the kernel when a cell times out instead of raising TimeoutError
+        self.interrupt_on_timeout = False
+        self.kernel_pool = kernel_pool
+        # Reply and iopub messages of submitted requests by msg_id, kept when
+        # another request is waited for first
+        self._pending = {}
+        self.startkernel(os.path.abspath(outdir), embed_kernel, snapshots)
+
+    def startkernel(self, path, embed_kernel=None, snapshots=0):
+        """Start the kernel or take a running kernel from the pool"""
+        self.embedded = bool(embed_kernel) and self.kernel_pool is None
+        if self.kernel_pool is not None:
+            self.pooled = self.kernel_pool.acquire(self.kernel, path)
+            self.km = self.pooled.km
+            self.kc = self.pooled.kc
         else:
-            km = KernelManager(kernel_name=kernel)
-
-        km.start_kernel(cwd=path, stderr=open(os.devnull, 'w'))
-        kc = km.client()
-        kc.start_channels()
-        try:
-            kc.wait_for_ready()
-        except RuntimeError:
-            print(
-                "Timeout from starting kernel\nTry restarting python session and running weave again")
-            kc.stop_channels()
-            km.shutdown_kernel()
-            raise
-
-        self.km = km
-        self.kc = kc
-        self.kc.allow_stdin = False
+            self.km, self.kc = start_kernel(self.kernel, path, embed_kernel, snapshots)
 
     def close(self):
-        self.kc.stop_channels()
-        self.km.shutdown_kernel()
+        if self.kernel_pool is not None:
+            self.kernel_pool.release(self.pooled)
+        else:
+            self.kc.stop_channels()
+            self.km.shutdown_kernel()
+
+    def restartkernel(self):
+        if self.embedded:
+            # The embedded kernel runs in this process and can't be restarted
+            self.loadstring("get_ipython().run_line_magic('reset', '-f')")
+        else:
+            self.km.restart_kernel(now=True)
+            self.kc.wait_for_ready()
+        self._pending = {}
+        return True
 
     def run_cell(self, src):
         cell = {}
         cell["source"] = src.lstrip()
-        msg_id = self.kc.execute(src.lstrip(), store_history=False)
-
+        with profiling.span(self.profiler, "execute"):
+            msg_id = self.kc.execute(src.lstrip(), store_history=False)
+            self._wait_for_reply(msg_id)
+        with profiling.span(self.profiler, "collect"):
+            return self._collect_outputs(msg_id, cell)
+
+    def submit(self, code, chunk=None):
+        # The embedded kernel runs the code before execute returns
+        if self.embedded:
+            return None
+        # The kernel would abort the requests after an error, but chunks are
+        # run after errors in earlier chunks
+        msg_id = self.kc.execute(code.lstrip(), store_history=False, stop_on_error=False)
+        self._pending[msg_id] = {"reply": None, "iopub": []}
+        return msg_id
+
+    def discard(self, msg_id):
+        self._pending.pop(msg_id, None)
+
+    def collect(self, msg_id, chunk=None):
+        cell = {}
+        with profiling.span(self.profiler, "execute"):
+            self._wait_for_reply(msg_id)
+        with profiling.span(self.profiler, "collect"):
+            return self._collect_outputs(msg_id, cell)
+
+    def _wait_for_reply(self, msg_id):
+        """Wait for the kernel to finish executing the request"""
+        pending = self._pending.get(msg_id)
+        if pending is not None and pending["reply"] is not None:
+            return
         # wait for finish, with timeout
         while True:
             try:
@@ -74,59 +150,73 @@ class JupyterProcessor(PwebProcessorBase):
                     raise exception(
                         "Cell execution timed out, see log for details.")
 
-            if msg['parent_header'].get('msg_id') == msg_id:
+            parent = msg['parent_header'].get('msg_id')
+            if parent == msg_id:
                 break
-            else:
-                # not our reply
-                continue
+            elif parent in self._pending:
+                # Reply of a request that is collected later
+                self._pending[parent]["reply"] = msg
 
+    def _collect_outputs(self, msg_id, cell):
+        """Collect outputs of the request from the iopub channel"""
         outs = []
+        pending = self._pending.pop(msg_id, None)
+        buffered = deque(pending["iopub"]) if pending is not None else deque()
 
         while True:
-            try:
-                # We've already waited for execute_reply, so all output
-                # should already be waiting. However, on slow networks, like
-                # in certain CI systems, waiting < 1 second might miss messages.
-                # So long as the kernel sends a status:idle message when it
-                # finishes, we won't actually have to wait this long, anyway.
-                msg = self.kc.iopub_channel.get_msg(block=True, timeout=4)
-            except Empty:
-                print(
-                    "Timeout waiting for IOPub output\nTry restarting python session and running weave again")
-                raise RuntimeError("Timeout waiting for IOPub output")
-
+            if buffered:
+                msg = buffered.popleft()
+            else:
+                try:
+                    # We've already waited for execute_reply, so all output
+                    # should already be waiting. However, on slow networks, like
+                    # in certain CI systems, waiting < 1 second might miss messages.
+                    # So long as the kernel sends a status:idle message when it
+                    # finishes, we won't actually have to wait this long, anyway.
+                    msg = self.kc.iopub_channel.get_msg(timeout=4)
+                except Empty:
+                    print(
+                        "Timeout waiting for IOPub output\nTry restarting python session and running weave again")
+                    raise RuntimeError("Timeout waiting for IOPub output")
+
+            parent = msg['parent_header'].get('msg_id')
+            if parent != msg_id and parent in self._pending:
+                # Output of a request that is collected later
+                self._pending[parent]["iopub"].append(msg)
+                continue
             # stdout from InProcessKernelManager has no parent_header
-            if msg['parent_header'].get('msg_id') != msg_id and msg['msg_type'] != "stream":
+            if parent != msg_id and (msg['msg_type'] != "stream" or msg['parent_header']):
                 continue
 
-            msg_type = msg['msg_type']
-            content = msg['content']
+            if msg['msg_type'] == 'status' and msg['content']['execution_state'] == 'idle':
+                break
+            self._addoutput(msg, cell, outs)
 
-            # set the prompt number for the input and the output
-            if 'execution_count' in content:
-                cell['execution_count'] = content['execution_count']
+        return outs
 
-            if msg_type == 'status':
-                if content['execution_state'] == 'idle':
-                    break
-                else:
-                    continue
-            elif msg_type == 'execute_input':
-                continue
-            elif msg_type == 'clear_output':
-                outs = []
-                continue
-            elif msg_type.startswith('comm'):
-                continue
+    def _addoutput(self, msg, cell, outs):
+        """Add the output from an iopub message to outs, returns the output or
+        None for messages that have no output"""
+        msg_type = msg['msg_type']
+        content = msg['content']
 
-            try:
-                out = output_from_msg(msg)
-            except ValueError:
-                print("unhandled iopub msg: " + msg_type)
-            else:
-                outs.append(out)
+        # set the prompt number for the input and the output
+        if 'execution_count' in content:
+            cell['execution_count'] = content['execution_count']
 
-        return outs
+        if msg_type in ('status', 'execute_input') or msg_type.startswith('comm'):
+            return None
+        elif msg_type == 'clear_output':
+            del outs[:]
+            return None
+
+        try:
+            out = output_from_msg(msg)
+        except ValueError:
+            print("unhandled iopub msg: " + msg_type)
+            return None
+        outs.append(out)
+        return out
 
     def loadstring(self, code_str, **kwargs):
         return self.run_cell(code_str)
@@ -156,16 +246,24 @@ class JupyterProcessor(PwebProcessorBase):
 class IPythonProcessor(JupyterProcessor):
     """Contains IPython specific functions"""
 
+    supports_workers = True
+
     def __init__(self, *args, **kwargs):
         kernel = args[1]
 
         embed = kwargs.pop('embed_kernel', None)
-        if embed is None and kernel == "python3":
+        if embed is None and kernel == "python3" and kwargs.get('kernel_pool') is None:
             embed = True
         else:
             embed = False
 
-        super(IPythonProcessor, self).__init__(*args, **kwargs, embed_kernel=embed)
+        snapshots = config.rcParams["snapshots"] if embed else 0
+        if snapshots and not forks.supported:
+            sys.stderr.write("Kernel snapshots are only supported on Linux\n")
+            snapshots = 0
+
+        super(IPythonProcessor, self).__init__(*args, **kwargs, embed_kernel=embed,
+                                               snapshots=snapshots)
 
         if config.rcParams["usematplotlib"]:
             self.init_matplotlib()
@@ -173,11 +271,65 @@ class IPythonProcessor(JupyterProcessor):
     def init_matplotlib(self):
         self.loadstring(subsnippets.init_matplotlib)
 
+    def restartkernel(self):
+        super(IPythonProcessor, self).restartkernel()
+        if config.rcParams["usematplotlib"]:
+            self.init_matplotlib()
+        return True
+
+    def startworker(self):
+        worker = type(self)([], self.kernel, self.source, False, self.figdir, self.outdir,
+                            embed_kernel=False)
+        worker.timeout = self.timeout
+        worker.interrupt_on_timeout = self.interrupt_on_timeout
+        return worker
+
+    def _checkpointstatus(self, outputs):
+        text = "".join(out.get("text", "") for out in outputs if out["output_type"] == "stream")
+        if "PWEAVE_CHECKPOINT_OK" in text:
+            return True
+        if "PWEAVE_CHECKPOINT_SKIPPED" in text:
+            names = text.split("PWEAVE_CHECKPOINT_SKIPPED", 1)[1].strip()
+            sys.stdout.write("Can't store checkpoint, these variables can't be serialized: %s\n" % names)
+        return False
+
+    def savecheckpoint(self, path, serializer, names=None):
+        return self._checkpointstatus(
+            self.loadstring(subsnippets.checkpoint_save % (path, serializer, names)))
+
+    def submitcheckpoint(self, path, serializer, names=None):
+        """Send the code storing a checkpoint to the kernel without waiting for it,
+        returns a request for :py:meth:`collectcheckpoint`"""
+        return self.submit(subsnippets.checkpoint_save % (path, serializer, names))
+
+    def collectcheckpoint(self, request):
+        """Wait for a checkpoint from :py:meth:`submitcheckpoint`, returns True
+        if the checkpoint was stored"""
+        return self._checkpointstatus(self.collect(request))
+
+    def restorecheckpoint(self, path):
+        return self._checkpointstatus(self.loadstring(subsnippets.checkpoint_restore % path))
+
+    def savesnapshot(self, key):
+        if not isinstance(self.km, forks.PwebForkKernelManager):
+            return False
+        return self.km.snapshot(key)
+
+    def restoresnapshot(self, key):
+        if not isinstance(self.km, forks.PwebForkKernelManager):
+            return False
+        return self.km.resume(key)
+
     def pre_run_hook(self, chunk):
+        if not config.rcParams["usematplotlib"]:
+            return
         f_size = """matplotlib.rcParams.update({"figure.figsize" : (%i, %i)})""" % chunk[
             "f_size"]
         f_dpi = """matplotlib.rcParams.update({"figure.dpi" : %i})""" % chunk["dpi"]
-        self.loadstring("\n".join([f_size, f_dpi]))
+        # The kernel runs the requests in order, so there is no need to wait for
+        # this to finish before sending the chunk
+        self.kc.execute("\n".join([f_size, f_dpi]), silent=True, store_history=False,
+                        stop_on_error=False)
 
     def loadterm(self, code_str, **kwargs):
         splitter = inputsplitter.IPythonInputSplitter()
@@ -0,0 +1,181 @@
+"""
+Runs independent code chunks at the same time in worker kernels
+"""
+
+import os
+import sys
+import shutil
+import tempfile
+
+from ..config import rcParams
+
+
+class _PwebWorker(object):
+    """A worker kernel and the code it has run"""
+
+    def __init__(self, proc):
+        self.proc = proc
+        #: Dependency graph nodes the kernel has run
+        self.done = set()
+        #: Chunks sent to the kernel that haven't been collected
+        self.running = 0
+
+
+class PwebParallel(object):
+    """Runs chunks that don't depend on the chunk the processor is running in
+    worker kernels at the same time. Before a chunk, a worker runs the code the
+    chunk depends on that it hasn't run yet. When chunks below use the variables
+    a chunk run by a worker defines, they are serialized in the worker and
+    loaded in the kernel of the processor. Variables that can't be serialized
+    are created by running the chunk again in the kernel of the processor.
+
+    :param processor: processor that runs the document, workers are started with
+                      its :py:meth:`startworker` method
+    :param dependencies: :py:class:`pweave.dependencies.PwebDependencies` of the document
+    :param size: ``int`` number of worker kernels
+    """
+
+    #: Chunks below the running chunk that are looked at for chunks to run
+    lookahead = 100
+
+    def __init__(self, processor, dependencies, size):
+        self.processor = processor
+        self.dependencies = dependencies
+        self.size = size
+        self.workers = []
+        # Worker and requests of the chunks sent to workers by node
+        self._requests = {}
+        # Workers that have run chunks by node
+        self._ranby = {}
+        self._directory = None
+
+    @staticmethod
+    def node(chunk):
+        return ("code", chunk["number"])
+
+    def running(self, chunk):
+        """Has chunk been sent to a worker"""
+        return self.node(chunk) in self._requests
+
+    def submitahead(self, chunk, ahead):
+        """Send chunks from `ahead`, the chunks below chunk, that don't depend on
+        chunk or the chunks between them to workers"""
+        start = self.dependencies.order.get(self.node(chunk))
+        if start is None:
+            return
+        for i, other in enumerate(ahead):
+            if len(self._requests) >= 2 * self.size or i >= self.lookahead:
+                break
+            node = self.node(other) if other["type"] == "code" else None
+            if node not in self.dependencies.order or node in self._requests:
+                continue
+            if node in self.dependencies.opaque:
+                break
+            if other["term"] or "outputs" in other:
+                continue
+            # Code run by the processor is run again by the worker, code that
+            # hasn't been run yet or has been run by another worker is not
+            workers = set()
+            for parent in self.dependencies.ancestors(node):
+                if parent in self._requests:
+                    workers.add(self._requests[parent][0])
+                elif parent in self._ranby:
+                    workers.add(self._ranby[parent])
+                elif self.dependencies.order[parent] >= start:
+                    workers.add(None)
+            if None in workers or len(workers) > 1:
+                continue
+            self.submit(other, workers.pop() if workers else None)
+
+    def submit(self, chunk, worker=None):
+        """Send chunk and the code it depends on to a worker"""
+        node = self.node(chunk)
+        ancestors = self.dependencies.ancestors(node)
+        if worker is None:
+            worker = self._worker(ancestors)
+        if self._conflicts(worker, ancestors):
+            # The processor runs the chunk if the worker is busy
+            if worker.running:
+                return
+            self._reset(worker)
+        for parent in ancestors:
+            if parent not in worker.done:
+                worker.proc.discard(worker.proc.submit(self.dependencies.code[parent]))
+                worker.done.add(parent)
+        sys.stdout.write("Running chunk %(number)s in a worker kernel\n" % chunk)
+        worker.proc.pre_run_hook(chunk)
+        request = worker.proc.submit(self.dependencies.code[node], chunk=chunk)
+        # The variables are stored before the worker runs other code
+        path = None
+        names = sorted(self.dependencies.defined[node])
+        if node in self.dependencies.needed and names:
+            path = self._path(chunk)
+            stored = worker.proc.submitcheckpoint(path, rcParams["serializer"], names)
+            path = (path, stored)
+        self._requests[node] = (worker, request, path)
+        worker.done.add(node)
+        worker.running += 1
+
+    def collect(self, chunk):
+        """Wait for a chunk sent to a worker and return the results. The variables
+        the chunk defines are loaded to the kernel of the processor if they are
+        used by chunks below it."""
+        node = self.node(chunk)
+        worker, request, path = self._requests.pop(node)
+        results = worker.proc.collect(request, chunk=chunk)
+        worker.running -= 1
+        self._ranby[node] = worker
+        if path is not None:
+            self._transfer(worker, chunk, node, *path)
+        return results
+
+    def _worker(self, ancestors):
+        """The worker with least chunks to run, a new worker is started if
+        all workers are busy"""
+        if len(self.workers) < self.size and all(w.running for w in self.workers):
+            self.workers.append(_PwebWorker(self.processor.startworker()))
+        return min(self.workers, key=lambda w: (w.running, len(set(ancestors) - w.done)))
+
+    def _conflicts(self, worker, ancestors):
+        """Would running code the worker hasn't run change variables defined by
+        code below it that the worker has run"""
+        order = self.dependencies.order
+        defined = self.dependencies.defined
+        for parent in ancestors:
+            if parent in worker.done:
+                continue
+            for node in worker.done:
+                if order[node] > order[parent] and defined[node] & defined[parent]:
+                    return True
+        return False
+
+    def _reset(self, worker):
+        worker.proc.loadstring("get_ipython().run_line_magic('reset', '-f')")
+        if rcParams["usematplotlib"]:
+            worker.proc.init_matplotlib()
+        worker.done = set()
+
+    def _path(self, chunk):
+        if self._directory is None:
+            self._directory = tempfile.mkdtemp(prefix="pweave-")
+        return os.path.join(self._directory, "%s.ckpt" % chunk["number"])
+
+    def _transfer(self, worker, chunk, node, path, stored):
+        """Load the variables stored by a worker to the kernel of the processor"""
+        if worker.proc.collectcheckpoint(stored) and self.processor.restorecheckpoint(path):
+            os.remove(path)
+            return
+        sys.stdout.write("Running chunk %(number)s again, its variables can't be "
+                         "transferred from the worker kernel\n" % chunk)
+        self.processor.loadstring(self.dependencies.code[node], chunk=chunk)
+
+    def close(self):
+        """Stop the worker kernels"""
+        for worker in self.workers:
+            worker.proc.close()
+        self.workers = []
+        self._requests = {}
+        self._ranby = {}
+        if self._directory is not None:
+            shutil.rmtree(self._directory, ignore_errors=True)
+            self._directory = None
@@ -0,0 +1,185 @@
+"""
+Pool of running Jupyter kernels that are reused for several documents
+"""
+
+import os
+import sys
+from queue import Empty
+
+from jupyter_client import kernelspec
+
+from .jupyter import start_kernel
+
+
+class PwebPooledKernel(object):
+    """A running kernel owned by :py:class:`PwebKernelPool`"""
+
+    def __init__(self, name, cwd, km, kc):
+        self.name = name
+        self.cwd = cwd
+        self.km = km
+        self.kc = kc
+        self.uses = 0
+
+    @property
+    def pid(self):
+        """Process id of the kernel or None if it is not known"""
+        provisioner = getattr(self.km, "provisioner", None)
+        if provisioner is not None:
+            return getattr(provisioner, "pid", None)
+        kernel = getattr(self.km, "kernel", None)
+        return getattr(kernel, "pid", None)
+
+    def rss(self):
+        """Resident memory of the kernel process in bytes, None if not available"""
+        try:
+            with open("/proc/%i/status" % self.pid) as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        return int(line.split()[1]) * 1024
+        except (OSError, TypeError, ValueError):
+            pass
+        return None
+
+    def execute(self, code, timeout=60):
+        """Run code silently and wait for it to finish
+
+        :raises: ``TimeoutError`` if the kernel doesn't reply in `timeout` seconds
+        """
+        msg_id = self.kc.execute(code, silent=True, store_history=False)
+        while True:
+            try:
+                msg = self.kc.get_shell_msg(timeout=timeout)
+            except Empty:
+                raise TimeoutError("Pooled %s kernel didn't reply in %s seconds, "
+                                   "it is hung or has died" % (self.name, timeout))
+            if msg['parent_header'].get('msg_id') == msg_id:
+                break
+        # Wait for the kernel to become idle so the next document
+        # doesn't receive output from this request
+        while True:
+            try:
+                msg = self.kc.iopub_channel.get_msg(timeout=timeout)
+            except Empty:
+                break
+            if (msg['parent_header'].get('msg_id') == msg_id and
+                    msg['msg_type'] == 'status' and
+                    msg['content']['execution_state'] == 'idle'):
+                break
+        return msg
+
+    def shutdown(self):
+        self.kc.stop_channels()
+        self.km.shutdown_kernel(now=True)
+
+
+class PwebKernelPool(object):
+    """Keeps kernels running between documents to avoid the kernel startup time.
+
+    Kernels are taken from the pool with :py:meth:`acquire` and returned with
+    :py:meth:`release`, which resets the namespace of Python kernels. Other
+    kernels are restarted when they are returned. Use as a context manager
+    to shutdown the kernels at the end::
+
+        with PwebKernelPool(size=2) as pool:
+            for name in files:
+                Pweb(name, kernel_pool=pool).weave()
+
+    :param size: ``int`` number of idle kernels kept running per kernel name
+    :param kernels: ``list`` kernel names to start when the pool is created
+    :param max_uses: ``int`` shutdown a kernel after it has been used this many times
+    :param max_rss: ``int`` shutdown a kernel if its resident memory exceeds
+                    this many bytes after a document
+    """
+
+    def __init__(self, size=1, kernels=(), max_uses=None, max_rss=None):
+        self.size = size
+        self.max_uses = max_uses
+        self.max_rss = max_rss
+        #: Seconds to wait for a kernel to change directory or reset, kernels
+        #: that don't reply are shutdown
+        self.timeout = 60
+        self.idle = {}
+        self.busy = []
+        self._languages = {}
+        for name in kernels:
+            self.prestart(name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def language(self, name):
+        if name not in self._languages:
+            self._languages[name] = kernelspec.get_kernel_spec(name).language
+        return self._languages[name]
+
+    def prestart(self, name, cwd=None):
+        """Start kernels until there are `size` idle kernels for name"""
+        if cwd is None:
+            cwd = os.getcwd()
+        idle = self.idle.setdefault(name, [])
+        while len(idle) < self.size:
+            km, kc = start_kernel(name, cwd)
+            idle.append(PwebPooledKernel(name, cwd, km, kc))
+
+    def acquire(self, name, cwd):
+        """Get a running kernel with working directory set to cwd"""
+        idle = self.idle.setdefault(name, [])
+        is_python = self.language(name) == "python"
+        for kernel in idle:
+            if is_python or kernel.cwd == cwd:
+                idle.remove(kernel)
+                break
+        else:
+            km, kc = start_kernel(name, cwd)
+            kernel = PwebPooledKernel(name, cwd, km, kc)
+
+        if is_python and kernel.cwd != cwd:
+            try:
+                kernel.execute("import os as _os\n_os.chdir(%r)\ndel _os" % cwd, self.timeout)
+                kernel.cwd = cwd
+            except TimeoutError as e:
+                sys.stderr.write("%s, starting a new kernel\n" % e)
+                kernel.shutdown()
+                km, kc = start_kernel(name, cwd)
+                kernel = PwebPooledKernel(name, cwd, km, kc)
+        kernel.uses += 1
+        self.busy.append(kernel)
+        return kernel
+
+    def release(self, kernel):
+        """Return a kernel to the pool after resetting it"""
+        self.busy.remove(kernel)
+        idle = self.idle.setdefault(kernel.name, [])
+
+        recycle = (len(idle) >= self.size or
+                   (self.max_uses is not None and kernel.uses >= self.max_uses))
+        if not recycle and self.max_rss is not None:
+            rss = kernel.rss()
+            recycle = rss is not None and rss > self.max_rss
+        if recycle or not kernel.km.is_alive():
+            kernel.shutdown()
+            return
+
+        try:
+            if self.language(kernel.name) == "python":
+                kernel.execute("get_ipython().run_line_magic('reset', '-f')", self.timeout)
+            else:
+                kernel.km.restart_kernel(now=True)
+                kernel.kc.wait_for_ready(self.timeout)
+        except (TimeoutError, RuntimeError) as e:
+            # The kernel is not returned to the pool
+            sys.stderr.write("%s\n" % e)
+            kernel.shutdown()
+            return
+        idle.append(kernel)
+
+    def close(self):
+        """Shutdown all kernels"""
+        for kernel in self.busy + [k for idle in self.idle.values() for k in idle]:
+            kernel.shutdown()
+        self.busy = []
+        self.idle = {}
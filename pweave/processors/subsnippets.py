@@ -6,3 +6,62 @@ from IPython.display import set_matplotlib_formats
 set_matplotlib_formats('png', 'pdf', 'svg')
 import matplotlib
 """
+
+# Store the user namespace or the given names to a file, modules are stored by
+# name. Nothing is written if some variables can't be serialized.
+checkpoint_save = """
+def _pweave_checkpoint(path, serializer, names):
+    import os, types, pickle, importlib
+    dumps = importlib.import_module(serializer).dumps
+    shell = get_ipython()
+    values, modules, skipped = {}, {}, []
+    for name, value in list(shell.user_ns.items()):
+        if names is not None:
+            if name not in names:
+                continue
+        elif name.startswith("_") or name in shell.user_ns_hidden:
+            continue
+        if isinstance(value, types.ModuleType):
+            modules[name] = value.__name__
+        elif (serializer == "pickle" and isinstance(value, (types.FunctionType, type)) and
+              value.__module__ == "__main__"):
+            # pickle stores functions and classes by reference
+            skipped.append(name)
+        else:
+            values[name] = value
+    data = None
+    if not skipped:
+        try:
+            data = dumps(values)
+        except Exception as e:
+            for name, value in values.items():
+                try:
+                    dumps(value)
+                except Exception:
+                    skipped.append(name)
+            skipped = skipped or [repr(e)]
+    if skipped:
+        print("PWEAVE_CHECKPOINT_SKIPPED " + " ".join(sorted(skipped)))
+        return
+    with open(path + ".tmp", "wb") as f:
+        pickle.dump({"serializer": serializer, "modules": modules, "data": data}, f,
+                    pickle.HIGHEST_PROTOCOL)
+    os.replace(path + ".tmp", path)
+    print("PWEAVE_CHECKPOINT_OK")
+_pweave_checkpoint(%r, %r, %r)
+del _pweave_checkpoint
+"""
+
+checkpoint_restore = """
+def _pweave_restore(path):
+    import pickle, importlib
+    with open(path, "rb") as f:
+        state = pickle.load(f)
+    namespace = get_ipython().user_ns
+    for name, module in state["modules"].items():
+        namespace[name] = importlib.import_module(module)
+    namespace.update(importlib.import_module(state["serializer"]).loads(state["data"]))
+    print("PWEAVE_CHECKPOINT_OK")
+_pweave_restore(%r)
+del _pweave_restore
+"""
@@ -0,0 +1,123 @@
+"""
+Timing of weave stages and chunks
+"""
+
+import os
+import time
+import json
+import contextlib
+
+
+def span(profiler, name, chunk=None):
+    """Time a block using `profiler`, does nothing if profiler is None"""
+    if profiler is None:
+        return contextlib.nullcontext()
+    return profiler.span(name, chunk)
+
+
+class PwebProfiler(object):
+    """Records wall time and CPU time of the weave stages and of each chunk.
+
+    Spans are recorded with :py:meth:`span`. Spans inside a span that has a
+    chunk are attributed to the same chunk. CPU time is measured for the
+    Pweave process, code run by an external kernel only shows up in the
+    wall time.
+    """
+
+    #: Stages of the weave shown in the table
+    stages = ("read", "run", "format", "write", "stream")
+
+    #: Columns of the chunk table, run includes execute, collect and
+    #: pre_run_hook, format includes figures. Code run by pre_run_hook is
+    #: only included in the pre_run_hook column.
+    columns = ("run", "execute", "collect", "pre_run_hook", "format", "figures")
+
+    def __init__(self):
+        self.events = []
+        self._start = time.perf_counter()
+        self._chunks = []
+        self._names = []
+
+    @contextlib.contextmanager
+    def span(self, name, chunk=None):
+        """Context manager that records the time spent in the block
+
+        :param name: ``string`` name of the stage or part of chunk processing
+        :param chunk: ``string`` chunk label e.g. "code 1"
+        """
+        if chunk is not None:
+            self._chunks.append(chunk)
+        parent = self._names[-1] if self._names else None
+        self._names.append(name)
+        start = time.perf_counter()
+        cpu = time.process_time()
+        try:
+            yield
+        finally:
+            self._names.pop()
+            self.events.append({"name": name,
+                                "parent": parent,
+                                "chunk": self._chunks[-1] if self._chunks else None,
+                                "start": start - self._start,
+                                "wall": time.perf_counter() - start,
+                                "cpu": time.process_time() - cpu})
+            if chunk is not None:
+                self._chunks.pop()
+
+    def totals(self):
+        """Get total wall and CPU time for each (chunk, name) pair,
+        in the order the chunks were first seen"""
+        totals = {}
+        for event in sorted(self.events, key=lambda e: e["start"]):
+            if event["parent"] == "pre_run_hook":
+                continue
+            key = (event["chunk"], event["name"])
+            wall, cpu = totals.get(key, (0.0, 0.0))
+            totals[key] = (wall + event["wall"], cpu + event["cpu"])
+        return totals
+
+    def table(self):
+        """Format the timings as a text table"""
+        totals = self.totals()
+        lines = ["%-10s %10s %10s" % ("Stage", "Wall (s)", "CPU (s)")]
+        for stage in self.stages:
+            if (None, stage) in totals:
+                wall, cpu = totals[(None, stage)]
+                lines.append("%-10s %10.3f %10.3f" % (stage, wall, cpu))
+
+        chunks = []
+        for chunk, name in totals:
+            if chunk is not None and chunk not in chunks:
+                chunks.append(chunk)
+        if chunks:
+            lines.append("")
+            lines.append(("%-10s" + " %12s" * len(self.columns)) %
+                         (("Chunk",) + self.columns))
+            for chunk in chunks:
+                row = [totals.get((chunk, name), (0.0, 0.0))[0] for name in self.columns]
+                lines.append(("%-10s" + " %12.3f" * len(row)) % tuple([chunk] + row))
+        return "\n".join(lines) + "\n"
+
+    def trace(self):
+        """Get the timings as Chrome trace events, the result can be opened
+        in chrome://tracing or Perfetto"""
+        pid = os.getpid()
+        events = []
+        for event in self.events:
+            args = {"cpu_ms": round(event["cpu"] * 1e3, 3)}
+            if event["chunk"] is not None:
+                args["chunk"] = event["chunk"]
+            events.append({"name": event["name"],
+                           "cat": "chunk" if event["chunk"] is not None else "stage",
+                           "ph": "X",
+                           "ts": round(event["start"] * 1e6, 1),
+                           "dur": round(event["wall"] * 1e6, 1),
+                           "pid": pid,
+                           "tid": 0,
+                           "args": args})
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def write_trace(self, filename):
+        """Write Chrome trace events to a JSON file"""
+        with open(filename, "w") as f:
+            json.dump(self.trace(), f)
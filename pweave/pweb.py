@@ -1,15 +1,16 @@
 import sys
 import os
 import re
-import copy
 import io
+import functools
 
-from .readers import PwebReaders
+from .readers import PwebReaders, STDIN
 from . formatters import PwebFormats
 from . processors import PwebProcessors
-from jupyter_client import kernelspec
 
 from .mimetypes import MimeTypes
+from .chunks import PwebChunkIndex
+from . import profiling
 from urllib import parse
 
 
@@ -17,7 +18,8 @@ class Pweb(object):
     """
     Process a Pweave document
 
-    :param source: ``string`` name of the input document.
+    :param source: ``string`` name of the input document, ``"-"`` reads the
+                   document from standard input.
     :param doctype: ``string`` output format.
     :param informat: ``string`` input format
     :param kernel: ``string`` name of jupyter kernel used to run code
@@ -25,16 +27,26 @@ class Pweb(object):
     :param figdir: ``string`` figure directory
     :param mimetype: Source document's text mimetype. This is used to set cell
                      type in Jupyter notebooks
+    :param kernel_pool: :py:class:`PwebKernelPool` to take a running kernel from
+    :param profiler: :py:class:`pweave.profiling.PwebProfiler` to record timings of
+                     stages and chunks
+    :param parse_cache: :py:class:`pweave.parsecache.PwebParseCache` to load the
+                        parsed chunks of an unchanged document from
+    :param reuse_outputs: ``bool`` use outputs stored in an executed notebook instead
+                          of running unchanged cells, see :py:attr:`PwebNBReader.reuse_outputs`
     """
 
     def __init__(self, source, *args, doctype=None, informat=None, kernel="python3",
-                 output=None, figdir='figures', mimetype=None, kernel_args={}, **kwargs):
+                 output=None, figdir='figures', mimetype=None, kernel_args={},
+                 kernel_pool=None, profiler=None, parse_cache=None, reuse_outputs=False,
+                 **kwargs):
         self.source = source
-        name, ext = os.path.splitext(os.path.basename(source))
+        name, ext = os.path.splitext(os.path.basename(self._sourcename()))
         self.basename = name
         self.file_ext = ext
         self.figdir = figdir
         self.doctype = doctype
+        self.informat = informat
         self.sink = None
         self.language = None
 
@@ -50,16 +62,26 @@ class Pweb(object):
             self.file_ext = None
 
         self.output = output
+        self.kernel_pool = kernel_pool
+        self.profiler = profiler
+        self.parse_cache = parse_cache
+        self.reuse_outputs = reuse_outputs
         self.setkernel(kernel, kernel_args)
         self._setwd()
 
         # Init variables not set using the constructor
         #: Use documentation mode
         self.documentationmode = False
-        self.parsed = None
+        #: Name or number of a chunk to resume from, see :py:attr:`PwebProcessorBase.from_chunk`
+        self.from_chunk = None
+        self._parsed = None
+        self._fromfile = False
+        self._chunkindex = None
         self.executed = None
+        self.processor = None
         self.formatted = None
         self.reader = None
+        self._Formatter = None
         self.formatter = None
         self.theme = "skeleton"
 
@@ -80,6 +102,7 @@ class Pweb(object):
         self.kernel_args = kernel_args
 
         if kernel is not None:
+            from jupyter_client import kernelspec
             self.language = kernelspec.get_kernel_spec(kernel).language
 
     def getformat(self):
@@ -90,9 +113,17 @@ class Pweb(object):
         """Update existing format, See: http://mpastell.com/pweave/customizing.html"""
         self.formatter.formatdict.update(dict)
 
+    def _sourcename(self):
+        """Name of the source used for output and figure files"""
+        if self.source == STDIN:
+            return "stdin"
+        return self.source
+
     def read(self, string=None, basename="string_input", reader=None):
         """
-        Parse document
+        Set the document to parse. The document is parsed when
+        :py:attr:`parsed` is first used or read as it is run by
+        :py:meth:`stream`.
 
         :param: None (set automatically), reader name or class object
         """
@@ -108,24 +139,107 @@ class Pweb(object):
         else:
             self.reader = Reader(string=string)
             self.source = basename  # non-trivial implications possible
+        if self.reuse_outputs and hasattr(self.reader, "reuse_outputs"):
+            self.reader.reuse_outputs = True
+            self.reader.kernel = self.kernel
+        self._fromfile = string is None and os.path.isfile(self.source)
+        self._parsed = None
+        self._chunkindex = None
+
+    @property
+    def parsed(self):
+        """Parsed chunks, the document is parsed when this is first used"""
+        if self._parsed is None and self.reader is not None:
+            with profiling.span(self.profiler, "read"):
+                self._parsed = self._parse()
+        return self._parsed
+
+    def _parse(self):
+        # Stored outputs are not kept in the parse cache
+        cache = self.parse_cache if self._fromfile and not self.reuse_outputs else None
+        if cache is not None:
+            key = cache.key(self.source, type(self.reader))
+            parsed = cache.get(self.source, key)
+            if parsed is not None:
+                return parsed
+
         self.reader.parse()
-        self.parsed = self.reader.getparsed()
+        parsed = self.reader.getparsed()
+        if cache is not None:
+            cache.put(self.source, key, parsed)
+        return parsed
+
+    @parsed.setter
+    def parsed(self, parsed):
+        self._parsed = parsed
+        self._chunkindex = None
+
+    def iterparsed(self):
+        """Iterate over parsed chunks. If the document hasn't been parsed
+        yet and the reader supports it, chunks are yielded as they are read
+        from the source and they are not kept."""
+        if (self._parsed is None and hasattr(self.reader, "iterparse") and
+                (self.parse_cache is None or not self._fromfile)):
+            return self.reader.iterparse()
+        return iter(self.parsed)
+
+    def getchunk(self, key):
+        """Get a parsed code chunk by number or name, None if there is no such chunk"""
+        if self._chunkindex is None:
+            self._chunkindex = PwebChunkIndex(self.parsed)
+        return self._chunkindex.get(key)
+
+    def run(self, Processor=None, incremental=False):
+        """Execute code in the document
+
+        :param Processor: Processor class, default is chosen based on kernel
+        :param incremental: ``bool`` keep the kernel running and on the next
+            incremental run only execute code starting from the first changed chunk
+        """
+        # Parsing is profiled as its own stage, not as a part of running
+        parsed = self.parsed
+        with profiling.span(self.profiler, "run"):
+            proc = self._getprocessor(Processor, incremental, parsed)
+            proc.run()
+            self.executed = proc.getresults()
+        if incremental:
+            self.processor = proc
+
+    def _getprocessor(self, Processor=None, incremental=False, parsed=None):
+        if parsed is None:
+            parsed = self.parsed
+        if incremental and self.processor is not None:
+            proc = self.processor
+            proc.parsed = parsed
+            proc.profiler = self.profiler
+            proc.from_chunk = self.from_chunk
+            return proc
 
-    def run(self, Processor=None):
-        """Execute code in the document"""
         if Processor is None:
             Processor = PwebProcessors.getprocessor(self.kernel)
 
-        proc = Processor(copy.deepcopy(self.parsed),
+        kernel_args = self.kernel_args
+        if self.kernel_pool is not None:
+            kernel_args = dict(kernel_args, kernel_pool=self.kernel_pool)
+
+        proc = Processor(parsed,
                          self.kernel,
-                         self.source,
+                         self._sourcename(),
                          self.documentationmode,
                          self.figdir,
                          self.wd,
-                         **self.kernel_args
+                         **kernel_args
                          )
-        proc.run()
-        self.executed = proc.getresults()
+        proc.incremental = incremental
+        proc.profiler = self.profiler
+        proc.from_chunk = self.from_chunk
+        return proc
+
+    def close(self):
+        """Shutdown the kernel kept running by incremental runs"""
+        if self.processor is not None:
+            self.processor.close()
+            self.processor = None
 
     def setformat(self, doctype=None, Formatter=None):
         """
@@ -145,26 +259,41 @@ class Pweb(object):
         else:
             Formatter = PwebFormats.getFormatter(self.doctype)
 
-        self.formatter = Formatter([],
-                                   kernel=self.kernel,
-                                   language=self.language,
-                                   mimetype=self.mimetype.type,
-                                   source=self.source,
-                                   theme=self.theme,
-                                   figdir=self.figdir,
-                                   wd=self.wd)
+        # The formatter is created when it is first used,
+        # tangling doesn't need to import the formatter dependencies
+        self._Formatter = functools.partial(Formatter, [],
+                                            kernel=self.kernel,
+                                            language=self.language,
+                                            mimetype=self.mimetype.type,
+                                            source=self._sourcename(),
+                                            figdir=self.figdir,
+                                            wd=self.wd)
+        self._formatter = None
+
+    @property
+    def formatter(self):
+        """Formatter for the output format set using :py:meth:`setformat`"""
+        if self._formatter is None and self._Formatter is not None:
+            self._formatter = self._Formatter(theme=self.theme)
+        return self._formatter
+
+    @formatter.setter
+    def formatter(self, formatter):
+        self._formatter = formatter
 
     def format(self):
         """Format executed code for writing. """
-        self.formatter.executed = copy.deepcopy(self.executed)
-        self.formatter.format()
-        self.formatted = self.formatter.getformatted()
+        with profiling.span(self.profiler, "format"):
+            self.formatter.profiler = self.profiler
+            self.formatter.executed = self.executed
+            self.formatter.format()
+            self.formatted = self.formatter.getformatted()
 
     def setsink(self):
         if self.output is not None:
             self.sink = self.output
         elif parse.urlparse(self.source).scheme == "":
-            self.sink = os.path.splitext(self.source)[
+            self.sink = os.path.splitext(self._sourcename())[
                 0] + '.' + self.formatter.file_ext
         else:
             url_path = parse.urlparse(self.source).path
@@ -175,7 +304,8 @@ class Pweb(object):
         """Write formatted code to file"""
         self.setsink()
 
-        self._writeToSink(self.formatted.replace("\r", ""))
+        with profiling.span(self.profiler, "write"):
+            self._writeToSink(self.formatted.replace("\r", ""))
         self._print('Weaved {src} to {dst}\n'.format(src=self.source,
                                                      dst=self.sink))
 
@@ -187,9 +317,51 @@ class Pweb(object):
         f.write(data)
         f.close()
 
-    def weave(self):
-        """Weave the document, equals -> parse, run, format, write"""
-        self.run()
+    def stream(self, incremental=False):
+        """Weave the document writing each chunk to the output file as soon as
+        it has been executed and formatted. Results are released after they
+        have been written, so :py:attr:`executed` and :py:attr:`formatted`
+        are not set. If the document hasn't been parsed yet, it is read as
+        it is run. Formats that convert the whole document at once are
+        woven normally.
+
+        :param incremental: ``bool`` see :py:meth:`weave`
+        """
+        if not getattr(self.formatter, "streamable", lambda: False)():
+            self.weave(incremental=incremental)
+            return
+
+        proc = self._getprocessor(incremental=incremental, parsed=self.iterparsed())
+        self.formatter.profiler = self.profiler
+        self.executed = None
+        self.formatted = None
+        self.setsink()
+        with profiling.span(self.profiler, "stream"), \
+                io.open(self.sink, 'wt', encoding='utf-8') as f:
+            for text in self.formatter.iterformat(proc.iterrun()):
+                f.write(text.replace("\r", ""))
+                f.flush()
+        if incremental:
+            self.processor = proc
+        self._print('Weaved {src} to {dst}\n'.format(src=self.source,
+                                                     dst=self.sink))
+
+    def weave(self, incremental=False, stream=False):
+        """Weave the document, equals -> parse, run, format, write
+
+        :param incremental: ``bool`` keep the kernel running between calls and
+            only run code starting from the first chunk that has changed since
+            the previous incremental weave. Call :py:meth:`read` to parse the
+            updated document first. If the kernel has run chunks below the first
+            changed chunk, it is restarted and the unchanged chunks are replayed,
+            or it resumes from a kernel snapshot if snapshots are enabled.
+        :param stream: ``bool`` write chunks to the output as they are executed,
+            see :py:meth:`stream`
+        """
+        if stream:
+            self.stream(incremental=incremental)
+            return
+        self.run(incremental=incremental)
         self.format()
         self.write()
 
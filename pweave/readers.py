@@ -1,11 +1,15 @@
 # Pweave readers
 import re
-import copy
+import sys
+import ast
 import json
 import io
+import codecs
+import hashlib
+import functools
 from subprocess import Popen, PIPE
 import os
-from urllib import request, parse
+from urllib import parse
 
 
 def read_file_or_url(source):
@@ -17,31 +21,442 @@ def read_file_or_url(source):
         contents = codefile.read()
         codefile.close()
     except IOError:
-        r = request.urlopen(source)
-        contents = r.read().decode("utf-8")
-        r.close()
+        from .fetch import fetch
+        contents = fetch(source).decode("utf-8")
 
     return contents
 
-class PwebReader(object):
-    """Reads and parses Pweb documents"""
 
-    # regex that matches beginning of code block
-    code_begin = r"^<<(.*?)>>=\s*$"
-    doc_begin = r"^@$"
+#: Source name that reads the document from standard input
+STDIN = "-"
 
-    def __init__(self, file=None, string=None):
-        self.source = file
 
-        # Get input from string or
-        if file is not None:
-            self.rawtext = read_file_or_url(self.source)
+def read_blocks(stream, size=1 << 20):
+    """Read text from a file object or a buffer in blocks.
+
+    :param stream: text or binary file object, ``mmap.mmap`` or bytes. Binary
+                   input is decoded as UTF-8.
+    :param size: ``int`` block size
+    """
+    if isinstance(stream, str):
+        yield stream
+        return
+    if isinstance(stream, (bytes, bytearray, memoryview)):
+        stream = io.BytesIO(stream)
+
+    decoder = None
+    while True:
+        block = stream.read(size)
+        if not block:
+            break
+        if not isinstance(block, str):
+            if decoder is None:
+                decoder = codecs.getincrementaldecoder("utf-8")()
+            block = decoder.decode(block)
+        if block:
+            yield block
+    if decoder is not None:
+        block = decoder.decode(b"", final=True)
+        if block:
+            yield block
+
+
+#: Characters that str.splitlines treats as line breaks in addition to \n
+_line_breaks = "\r\x0b\x0c\x1c\x1d\x1e\x85\u2028\u2029"
+_line_break_table = str.maketrans(dict.fromkeys(_line_breaks, "\n"))
+_nonblank = re.compile(r"\S")
+
+
+class PwebTextScanner(object):
+    """Finds lines of a document with precompiled patterns while the
+    document is read in blocks.
+
+    Line separators are normalized to \\n like with str.splitlines and
+    the text starts with a newline so that every line follows a \\n.
+    Text before :py:attr:`pos`, the start of the current chunk, is
+    dropped when more text is read.
+
+    :param blocks: iterable of text blocks
+    """
+
+    __slots__ = ("text", "pos", "eof", "blocks", "_carry", "_base", "_offset", "_line")
+
+    def __init__(self, blocks):
+        self.blocks = iter(blocks)
+        self.text = "\n"
+        self.pos = 1
+        self.eof = False
+        self._carry = ""
+        # Lines before the text and a cursor for counting lines in the text
+        self._base = 0
+        self._offset = 0
+        self._line = 0
+
+    def read(self):
+        """Read the next block, returns False at the end of the document"""
+        block = next(self.blocks, None)
+        if block is None:
+            text = self._normalize(self._carry)
+            self._carry = ""
+            if not (text or self.text).endswith("\n"):
+                text += "\n"
+            self.text += text
+            self.eof = True
+            return False
+
+        block = self._carry + block
+        # \r\n can be split between blocks
+        if block.endswith("\r"):
+            block, self._carry = block[:-1], "\r"
         else:
-            self.rawtext = string
-        self.state = "doc"  # Initial state of document
+            self._carry = ""
+        self.text += self._normalize(block)
+        return True
+
+    def compact(self):
+        """Drop the text before the current chunk, returns the number of
+        characters dropped"""
+        cut = self.pos - 1
+        if cut > 0:
+            self._base = self.lineno(cut)
+            self._offset = 0
+            self._line = 0
+            self.text = self.text[cut:]
+            self.pos -= cut
+        return cut
+
+    @staticmethod
+    def _normalize(text):
+        if "\r" in text:
+            text = text.replace("\r\n", "\n")
+        if any(c in text for c in _line_breaks):
+            text = text.translate(_line_break_table)
+        return text
+
+    def readall(self):
+        while self.read():
+            pass
+
+    def find(self, prefix, test):
+        """Find the first line at or after :py:attr:`pos` that passes test.
+
+        Candidate lines are found with a precompiled pattern `prefix` that
+        matches at the newline before the line. Returns the start and end
+        offsets of the line and the line, or None at the end of the document.
+        """
+        search = self.pos - 1
+        while True:
+            text = self.text
+            for m in prefix.finditer(text, search):
+                start = m.start() + 1
+                end = text.find("\n", start)
+                if end == -1:
+                    break
+                line = text[start:end]
+                if test(line):
+                    return start, end, line
+            if self.eof:
+                return None
+            # Only the last line can be incomplete, search again from there
+            search = max(text.rfind("\n"), self.pos - 1)
+            search -= self.compact()
+            self.read()
+
+    def lineno(self, offset):
+        """Get the line number (starting from 1) of a character offset.
+        Newlines are counted from the previous lookup, so looking up
+        increasing offsets scans the text once."""
+        if offset < self._offset:
+            self._offset = 0
+            self._line = 0
+        self._line += self.text.count("\n", self._offset, offset)
+        self._offset = offset
+        return self._base + self._line
+
+    def lines(self):
+        """Number of lines in the document, call after the whole document has been read"""
+        return self.lineno(len(self.text)) - 1
+
+
+class PwebJSONScanner(object):
+    """Reads a JSON document incrementally from text blocks. Values are
+    only decoded when :py:meth:`value` is called, :py:meth:`skip` passes
+    over a value without building it, keeping about one block in memory.
+
+    Objects and arrays are read with :py:meth:`members` and :py:meth:`items`,
+    the value of each member or item must be read with one of the methods
+    before the next one.
+
+    :param blocks: iterable of text blocks
+    """
+
+    __slots__ = ("text", "pos", "eof", "blocks", "_lines")
+
+    _whitespace = re.compile(r"[ \t\n\r]*")
+    _structure = re.compile(r'["\[\]{}]')
+    _delimiter = re.compile(r"[,\]}\s]")
+    _decoder = json.JSONDecoder()
+
+    def __init__(self, blocks):
+        self.blocks = iter(blocks)
+        self.text = ""
+        self.pos = 0
+        self.eof = False
+        # Lines in the text that has been dropped
+        self._lines = 0
+
+    def read(self):
+        """Read the next block dropping text before :py:attr:`pos`,
+        returns False at the end of the document"""
+        block = None if self.eof else next(self.blocks, None)
+        if block is None:
+            self.eof = True
+            return False
+        self._lines += self.text.count("\n", 0, self.pos)
+        self.text = self.text[self.pos:] + block
+        self.pos = 0
+        return True
+
+    def lineno(self):
+        """Line number of :py:attr:`pos` starting from 1"""
+        return self._lines + self.text.count("\n", 0, self.pos) + 1
+
+    def error(self, message):
+        return ValueError("Invalid JSON: %s near %r" % (message, self.text[self.pos:self.pos + 20]))
+
+    def peek(self):
+        """Get the next character that isn't whitespace, '' at the end"""
+        while True:
+            self.pos = self._whitespace.match(self.text, self.pos).end()
+            if self.pos < len(self.text):
+                return self.text[self.pos]
+            if not self.read():
+                return ""
+
+    def expect(self, chars):
+        """Read one of chars and return it"""
+        c = self.peek()
+        if not c or c not in chars:
+            raise self.error("expected %s" % " or ".join(repr(ch) for ch in chars))
+        self.pos += 1
+        return c
+
+    def value(self):
+        """Decode the next value"""
+        if self.peek() not in ('"', "[", "{"):
+            # Numbers may continue in the next block
+            while not self._delimiter.search(self.text, self.pos) and self.read():
+                pass
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self.text, self.pos)
+            except ValueError:
+                end = None
+            # A value at the end of the text may continue in the next block
+            if end is not None and (end < len(self.text) or self.eof):
+                self.pos = end
+                return value
+            # Read until the text has doubled to avoid decoding long values many times
+            size = len(self.text) - self.pos
+            while self.read() and len(self.text) < 2 * size:
+                pass
+            if self.eof and end is None and len(self.text) - self.pos == size:
+                raise self.error("invalid value")
+
+    def skip(self):
+        """Skip the next value without decoding it"""
+        c = self.peek()
+        if c not in ('"', "[", "{"):
+            self.value()
+            return
+        depth = 0
+        instring = False
+        while True:
+            text = self.text
+            if instring:
+                # str.find is much faster than a regex in long strings
+                end = text.find('"', self.pos)
+                escape = text.find("\\", self.pos, len(text) if end == -1 else end)
+                end = escape if escape != -1 else end
+                c = text[end] if end != -1 else None
+            else:
+                m = self._structure.search(text, self.pos)
+                end, c = (m.start(), m.group()) if m else (-1, None)
+            if c is None:
+                self.pos = len(text)
+                if not self.read():
+                    raise self.error("unexpected end of document")
+                continue
+            self.pos = end + 1
+            if c == "\\":
+                # Skip the escaped character
+                if self.pos == len(text) and not self.read():
+                    raise self.error("unexpected end of document")
+                self.pos += 1
+            elif c == '"':
+                instring = not instring
+                if not instring and depth == 0:
+                    return
+            elif c in "[{":
+                depth += 1
+            else:
+                depth -= 1
+                if depth == 0:
+                    return
+
+    def members(self):
+        """Iterate over the keys of an object"""
+        self.expect("{")
+        if self.peek() == "}":
+            self.pos += 1
+            return
+        while True:
+            if self.peek() != '"':
+                raise self.error("expected a key")
+            key = self.value()
+            self.expect(":")
+            yield key
+            if self.expect(",}") == "}":
+                return
+
+    def items(self):
+        """Iterate over an array, yields the index of each item"""
+        self.expect("[")
+        if self.peek() == "]":
+            self.pos += 1
+            return
+        i = 0
+        while True:
+            yield i
+            i += 1
+            if self.expect(",]") == "]":
+                return
+
+
+class PwebOptionError(ValueError):
+    """Invalid chunk options
+
+    :param message: ``string`` description of the error
+    :param option_string: ``string`` the chunk options
+    """
+
+    def __init__(self, message, option_string=None, source=None, lineno=None):
+        ValueError.__init__(self, message)
+        self.message = message
+        self.option_string = option_string
+        self.source = source
+        self.lineno = lineno
+
+    def __str__(self):
+        location = ""
+        if self.lineno is not None:
+            location = "%s:%i: " % (self.source or "<string>", self.lineno)
+        return "%sinvalid chunk options %r: %s" % (location, self.option_string, self.message)
+
+
+#: Aliases for False and True to conform with Sweave syntax
+_option_aliases = {"FALSE": False, "TRUE": True}
+
+
+def _option_value(node, source, optstring):
+    if isinstance(node, ast.Name) and node.id in _option_aliases:
+        return _option_aliases[node.id]
+    try:
+        return ast.literal_eval(node)
+    except ValueError:
+        raise PwebOptionError("values must be literals, got %s" %
+                              ast.get_source_segment(source, node), optstring) from None
+
+
+@functools.lru_cache(maxsize=4096)
+def parse_options(optstring):
+    """Parse chunk options ``name, key=value, ...`` to a dictionary. Values
+    must be Python literals, the code isn't executed.
+
+    Results are cached and identical option strings return the same
+    dictionary, it must not be modified.
+
+    :param optstring: ``string`` the options
+    :raises PwebOptionError: if the options are not valid
+    """
+    # First option can be a name/label
+    if optstring.split(',')[0].find('=') == -1:
+        splitted = optstring.split(',')
+        splitted[0] = 'name = "%s"' % splitted[0]
+        optstring = ','.join(splitted)
+
+    source = "dict(" + optstring + ")"
+    try:
+        call = ast.parse(source, mode="eval").body
+    except SyntaxError as e:
+        raise PwebOptionError(e.msg, optstring) from None
+    if not isinstance(call, ast.Call) or call.args:
+        raise PwebOptionError("options must be name=value pairs", optstring)
+
+    chunkoptions = {}
+    for keyword in call.keywords:
+        if keyword.arg is None:
+            raise PwebOptionError("options must be name=value pairs", optstring)
+        if keyword.arg in chunkoptions:
+            raise PwebOptionError("option %s is repeated" % keyword.arg, optstring)
+        chunkoptions[keyword.arg] = _option_value(keyword.value, source, optstring)
+    chunkoptions["option_string"] = optstring
+
+    if 'label' in chunkoptions:
+        chunkoptions['name'] = chunkoptions['label']
+
+    return chunkoptions
+
+
+class PwebTextReader(object):
+    """Base class for readers of text documents
+
+    :param file: ``string`` file name or url, :py:data:`STDIN` reads from standard input
+    :param string: ``string`` document
+    :param stream: file object or buffer e.g. ``mmap.mmap`` to read the document from
+    """
+
+    #: Size of blocks read from files
+    block_size = 1 << 20
+
+    def __init__(self, file=None, string=None, stream=None):
+        self.source = file
+        self._rawtext = string
+        self.stream = stream
+        if file == STDIN and stream is None:
+            self.stream = sys.stdin
+
+    @property
+    def rawtext(self):
+        """The whole document, read from the file when it is first used"""
+        if self._rawtext is None:
+            if self.stream is not None:
+                self._rawtext = "".join(read_blocks(self.stream, self.block_size))
+            elif self.source is not None:
+                self._rawtext = read_file_or_url(self.source)
+        return self._rawtext
+
+    @rawtext.setter
+    def rawtext(self, text):
+        self._rawtext = text
+
+    def blocks(self):
+        """Read the document in blocks"""
+        if self._rawtext is not None:
+            yield self._rawtext
+        elif self.stream is not None:
+            yield from read_blocks(self.stream, self.block_size)
+        else:
+            try:
+                f = io.open(self.source, 'r', encoding='utf-8', newline='')
+            except IOError:
+                yield self.rawtext
+                return
+            with f:
+                yield from read_blocks(f, self.block_size)
 
     def getparsed(self):
-        return copy.deepcopy(self.parsed)
+        return self.parsed
 
     def count_emptylines(self, line):
         """Counts empty lines for parser, the result is stored in self.n_emptylines"""
@@ -50,6 +465,42 @@ class PwebReader(object):
         else:
             self.n_emptylines = 0
 
+    def parse(self):
+        """Parse the whole document to :py:attr:`parsed`"""
+        self.parsed = list(self.iterparse())
+
+    def _parse_options(self, optstring):
+        """Parse options using :py:func:`parse_options`, errors show the
+        line number in :py:attr:`lineNo`"""
+        try:
+            return parse_options(optstring)
+        except PwebOptionError as e:
+            e.source = self.source
+            e.lineno = getattr(self, "lineNo", None)
+            raise
+
+    def iterparse(self):
+        """Yield chunks as they are parsed, the document is read in blocks"""
+        raise NotImplementedError
+
+
+class PwebReader(PwebTextReader):
+    """Reads and parses Pweb documents"""
+
+    # regex that matches beginning of code block
+    code_begin = r"^<<(.*?)>>=\s*$"
+    doc_begin = r"^@$"
+
+    # Patterns that match at the newline before every line that can match
+    # code_begin and doc_begin (after stripping whitespace). They are used
+    # to find the chunk delimiters without looking at every line.
+    code_prefix = r"\n<<"
+    doc_prefix = r"\n[^\S\n]*@"
+
+    def __init__(self, file=None, string=None, stream=None):
+        PwebTextReader.__init__(self, file, string, stream)
+        self.state = "doc"  # Initial state of document
+
     def codestart(self, line):
         if not re.match(self.code_begin, line):
             return False, True
@@ -62,7 +513,80 @@ class PwebReader(object):
         else:
             return True, True
 
-    def parse(self):
+    def _line_hooks(self):
+        """Check if a subclass customizes parsing of individual lines"""
+        cls = type(self)
+        return (cls.codestart is not PwebReader.codestart or
+                cls.docstart is not PwebReader.docstart or
+                cls.count_emptylines is not PwebReader.count_emptylines or
+                hasattr(self, "strip_comments"))
+
+    def iterparse(self):
+        """Yield chunks as they are parsed. The document is read in blocks
+        and scanned for the lines that start and end code chunks.
+        Subclasses that override :py:meth:`codestart`, :py:meth:`docstart`
+        or define strip_comments are parsed line by line using
+        :py:meth:`parse_lines`."""
+        if self._line_hooks():
+            self.parse_lines()
+            yield from self.parsed
+            return
+
+        scanner = PwebTextScanner(self.blocks())
+        code_prefix = re.compile(self.code_prefix)
+        doc_prefix = re.compile(self.doc_prefix)
+        code_begin = re.compile(self.code_begin).match
+        doc_begin = re.compile(self.doc_begin).match
+
+        codeN = 1
+        docN = 1
+        opts = {"option_string": ""}
+        state = "doc"
+
+        while True:
+            if state == "doc":
+                found = scanner.find(code_prefix, code_begin)
+                if found is None:
+                    break
+                start, end, line = found
+                self.lineNo = scanner.lineno(start)
+                opts = self.getoptions(line)
+                chunk = {"type": "doc", "content": scanner.text[scanner.pos:start], "number": docN,
+                         "start_line": self.lineNo}
+                docN += 1
+                state = "code"
+            else:
+                found = scanner.find(doc_prefix, lambda line: doc_begin(line.strip()))
+                if found is None:
+                    break
+                start, end, line = found
+                chunk = None
+                # Don't parse empty chunks unless source or child is specified
+                if (_nonblank.search(scanner.text, scanner.pos, start) or
+                        'source' in opts or 'child' in opts):
+                    chunk = {"type": "code", "content": "\n" + scanner.text[scanner.pos:start].rstrip(),
+                             "number": codeN, "options": opts,
+                             "start_line": scanner.lineno(start)}
+                codeN += 1
+                state = "doc"
+            scanner.pos = end + 1
+            if chunk is not None:
+                yield chunk
+
+        # Handle the last chunk
+        scanner.readall()
+        self.lineNo = scanner.lines()
+        self.state = state
+        content = scanner.text[scanner.pos:]
+        if state == "code":
+            yield {"type": "code", "content": "\n" + content.rstrip(),
+                   "number": codeN, "options": opts, "start_line": self.lineNo}
+        if state == "doc":
+            yield {"type": "doc", "content": content, "number": docN}
+
+
+    def parse_lines(self):
+        """Parse the document line by line"""
         lines = self.rawtext.splitlines()
 
         read = ""
@@ -88,7 +612,8 @@ class PwebReader(object):
             (doc_starts, skip) = self.docstart(line)
             if doc_starts and self.state == "code":
                 self.state = "doc"
-                if read.strip() != "" or 'source' in opts:  # Don't parse empty chunks unless source is specified
+                # Don't parse empty chunks unless source or child is specified
+                if read.strip() != "" or 'source' in opts or 'child' in opts:
                     chunks.append({"type": "code", "content": "\n" + read.rstrip(),
                                    "number": codeN, "options": opts, "start_line": self.lineNo})
                 codeN += 1
@@ -113,40 +638,22 @@ class PwebReader(object):
         self.parsed = chunks
 
     def getoptions(self, line):
-        # Aliases for False and True to conform with Sweave syntax
-        FALSE = False
-        TRUE = True
-
         # Parse options from chunk to a dictionary
-        #optstring = opt.replace('<<', '').replace('>>=', '').strip()
         optstring = re.findall(self.code_begin, line)[0]
         if not optstring.strip():
             return {"option_string": ""}
-        # First option can be a name/label
-        if optstring.split(',')[0].find('=') == -1:
-            splitted = optstring.split(',')
-            splitted[0] = 'name = "%s"' % splitted[0]
-            optstring = ','.join(splitted)
-
-        opt_scope = {}
-        exec("chunkoptions =  dict(" + optstring + ")", opt_scope)
-        chunkoptions = opt_scope["chunkoptions"]
-        chunkoptions["option_string"] = optstring
-
-        if 'label' in chunkoptions:
-            chunkoptions['name'] = chunkoptions['label']
-
-        return chunkoptions
+        return self._parse_options(optstring)
 
 class PwebMarkdownReader(PwebReader):
 
-    def __init__(self, file=None, string=None):
-        PwebReader.__init__(self, file, string)
-        self.code_begin = r"^[`~]{3,}(?:\{|\{\.|)python(?:;|,|)\s*(.*?)(?:\}|\s*)$"
-        self.doc_begin = r"^(`|~){3,}\s*$"
+    code_begin = r"^[`~]{3,}(?:\{|\{\.|)python(?:;|,|)\s*(.*?)(?:\}|\s*)$"
+    doc_begin = r"^(`|~){3,}\s*$"
+
+    code_prefix = r"\n[`~]{3}"
+    doc_prefix = r"\n[^\S\n]*[`~]{3}"
 
 
-class PwebScriptReader(object):
+class PwebScriptReader(PwebTextReader):
     """Read scripts to Pweave"""
 
     doc_line = r"(^#'.*)|(^#%%.*)|(^# %%.*)"
@@ -155,27 +662,137 @@ class PwebScriptReader(object):
     opt_line = r"(^#\+.*$)|(^#%%\+.*$)|(^# %%\+.*$)"
     opt_start = r"(^#\+)|(^#%%\+)|(^# %%\+)"
 
-    def __init__(self, file=None, string=None):
-        self.source = file
+    # Pattern that matches at the newline before every doc and option line
+    marker_prefix = r"\n#(?:'|%%|\+| %%)"
 
-        # Get input from string or
-        if file is not None:
-            self.rawtext = read_file_or_url(self.source)
-        else:
-            self.rawtext = string
+    def __init__(self, file=None, string=None, stream=None):
+        PwebTextReader.__init__(self, file, string, stream)
         self.state = "code"  # Initial state of document
 
-    def getparsed(self):
-        return copy.deepcopy(self.parsed)
-
-    def count_emptylines(self, line):
-        """Counts empty lines for parser, the result is stored in self.n_emptylines"""
-        if line.strip() == "":
-            self.n_emptylines += 1
-        else:
-            self.n_emptylines = 0
+    def iterparse(self):
+        """Yield chunks as they are parsed. The document is read in blocks
+        and scanned for doc and option lines, code between them is sliced
+        from the text."""
+        if type(self).count_emptylines is not PwebScriptReader.count_emptylines:
+            self.parse_lines()
+            yield from self.parsed
+            return
+
+        scanner = PwebTextScanner(self.blocks())
+        marker_prefix = re.compile(self.marker_prefix)
+        doc_line = re.compile(self.doc_line).match
+        opt_line = re.compile(self.opt_line).match
+        doc_start = re.compile(self.doc_start)
+
+        chunks = []  # Parsed chunks that haven't been yielded
+        codeN = 1
+        docN = 1
+        opts = {"option_string": ""}
+        state = "code"
+        start_line = 1
+        read = []  # Parts of the current chunk
+        blank = True  # True if the current chunk only has whitespace
+
+        def add(part):
+            nonlocal blank
+            read.append(part)
+            if blank and _nonblank.search(part):
+                blank = False
+
+        def add_lines(pos, end):
+            """Add lines between pos and end that are not doc or option lines"""
+            nonlocal state, start_line, read, blank, docN, opts
+            text = scanner.text
+            while pos < end:
+                if state == "code":
+                    add(text[pos:end])
+                    return
+                m = _nonblank.search(text, pos, end)
+                if m is None:
+                    add(text[pos:end])
+                    return
+                line_start = text.rfind("\n", 0, m.start()) + 1
+                line_end = text.find("\n", m.start()) + 1
+                if blank:
+                    add(text[pos:line_end])
+                    pos = line_end
+                    continue
+                # A non-empty line after documentation starts code
+                add(text[pos:line_start])
+                content = "".join(read)
+                if docN > 1:
+                    content = "\n" + content # Add whitespace to doc chunk. Needed for markdown output
+                chunks.append({"type": "doc", "content": content, "number": docN, "start_line": start_line})
+                state = "code"
+                opts = {"option_string": ""}
+                start_line = scanner.lineno(line_start)
+                read = []
+                blank = True
+                docN += 1
+                pos = line_start
+
+        while True:
+            found = scanner.find(marker_prefix,
+                                 lambda line: opt_line(line) or doc_line(line))
+            if found is None:
+                break
+            start, end, line = found
+            add_lines(scanner.pos, start)
+            scanner.pos = end + 1
+            lineno = scanner.lineno(start)
+
+            if opt_line(line):
+                start_line = lineno
+                if state == "code" and not blank:
+                    chunks.append({"type": "code", "content": "\n" + "".join(read).rstrip(),
+                                   "number": codeN, "options": opts, "start_line": start_line})
+                    read = []
+                    blank = True
+                    codeN += 1
+                if state == "doc" and not blank:
+                    content = "".join(read)
+                    if docN > 1:
+                        content = "\n" + content
+                    chunks.append({"type": "doc", "content": content, "number": docN, "start_line": start_line})
+                    read = []
+                    blank = True
+                    docN += 1
+                self.lineNo = lineno
+                opts = self.getoptions(line)
+                state = "code"
+            else:
+                line = doc_start.sub("", line, 1)
+                if line.startswith(" "):
+                    line = line[1:]
+                if state == "code" and not blank:
+                    chunks.append({"type": "code", "content": "\n" + "".join(read).rstrip(),
+                                   "number": codeN, "options": opts, "start_line": start_line})
+                    codeN += 1
+                    read = []
+                    blank = True
+                    start_line = lineno
+                state = "doc"
+                add(line + "\n")
+
+            yield from chunks
+            chunks.clear()
+
+        add_lines(scanner.pos, len(scanner.text))
+        yield from chunks
 
-    def parse(self):
+        # Handle the last chunk
+        self.lineNo = scanner.lines()
+        self.state = state
+        read = "".join(read)
+        if state == "code":
+            yield {"type": "code", "content": "\n" + read.rstrip(),
+                   "number": codeN, "options": opts, "start_line": start_line}
+        if state == "doc":
+            yield {"type": "doc", "content": read, "number": docN, "start_line": start_line}
+
+
+    def parse_lines(self):
+        """Parse the document line by line"""
         lines = self.rawtext.splitlines()
 
         read = ""
@@ -239,56 +856,137 @@ class PwebScriptReader(object):
         self.parsed = chunks
 
     def getoptions(self, line):
-        # Aliases for False and True to conform with Sweave syntax
-        FALSE = False
-        TRUE = True
         # Parse options from chunk to a dictionary
         optstring = re.sub(self.opt_start, "", line, 1)
-        #optstring = opt.replace('#+', '', 1).strip()
         if optstring == "":
             return {"option_string": ""}
-        # First option can be a name/label
-        if optstring.split(',')[0].find('=') == -1:
-            splitted = optstring.split(',')
-            splitted[0] = 'name = "%s"' % splitted[0]
-            optstring = ','.join(splitted)
-
-        opt_scope = {}
-        exec("chunkoptions =  dict(" + optstring + ")", opt_scope)
-        chunkoptions = opt_scope["chunkoptions"]
-        chunkoptions["option_string"] = optstring
-        # Update the defaults
-
-        if 'label' in chunkoptions:
-            chunkoptions['name'] = chunkoptions['label']
-
-        return chunkoptions
-
-class PwebNBReader(object):
-    """Read IPython notebooks"""
-
-    def __init__(self, file=None, string=None):
-        self.source = file
-        self.parsed = []
-        self.NB = json.loads(io.open(file, encoding='utf-8').read())
-
-    def parse(self):
-        docN = 1
-        codeN = 1
-        doc = self.NB['worksheets'][0]['cells']
-
-        for cell in doc:
-            if cell['cell_type'] == "code":
-                self.parsed.append(
-                    {'type': "code", "content": "\n" + "".join(cell['input']), "options": {}, "number": codeN})
-                codeN += 1
+        return self._parse_options(optstring)
+
+class PwebNBReader(PwebTextReader):
+    """Read Jupyter notebooks in nbformat 4 and IPython notebooks in
+    nbformat 3. The notebook is read incrementally and cell outputs are
+    skipped without decoding them. Chunk options are read from the
+    "options" key of cell metadata, written by the notebook formatter."""
+
+    #: Included in the parse cache key
+    version = 3
+
+    #: Cell keys that are decoded, other keys e.g. outputs are skipped
+    cell_keys = ("cell_type", "source", "input", "metadata")
+
+    #: Add stored outputs of code cells to chunks as "outputs", processors use
+    #: them instead of running the cell. Outputs of a cell are used if the
+    #: notebook was run with :py:attr:`kernel`, the cell was run after the
+    #: cells above it and its source hasn't changed since Pweave wrote it.
+    reuse_outputs = False
+
+    #: Kernel used to run the document
+    kernel = None
+
+    @staticmethod
+    def source_hash(source):
+        """Hash of cell source stored in cell metadata by the notebook formatter"""
+        return hashlib.sha1(source.encode("utf-8")).hexdigest()
+
+    def iterparse(self):
+        if self.reuse_outputs:
+            yield from self._parse_outputs()
+            return
+        numbers = {"code": 1, "doc": 1}
+        for cell in self._cells(self.cell_keys):
+            yield self._chunk(cell, numbers)
+
+    def _parse_outputs(self):
+        # Notebook metadata comes after the cells, so all cells are read first
+        notebook = {}
+        cells = list(self._cells(self.cell_keys + ("outputs", "execution_count"), notebook))
+        metadata = notebook.get("metadata") or {}
+        kernel = (metadata.get("kernelspec") or metadata.get("kernel_info") or {}).get("name")
+        reuse = notebook.get("nbformat") == 4
+        if reuse and self.kernel is not None and kernel != self.kernel:
+            sys.stdout.write("Notebook was run using kernel %s, outputs are not reused\n" % kernel)
+            reuse = False
+
+        numbers = {"code": 1, "doc": 1}
+        latest = 0
+        for cell in cells:
+            chunk = self._chunk(cell, numbers)
+            count = cell.get("execution_count")
+            if reuse and chunk["type"] == "code" and count is not None:
+                # Cells run before a cell above them may be out of date
+                if count > latest and self._unchanged(cell):
+                    chunk["outputs"] = [self._output(out) for out in cell.get("outputs", [])]
+                latest = max(latest, count)
+            yield chunk
+
+    def _unchanged(self, cell):
+        info = (cell.get("metadata") or {}).get("pweave") or {}
+        stored = info.get("source_hash")
+        return stored is None or stored == self.source_hash(self._source(cell))
+
+    @staticmethod
+    def _output(output):
+        """Join multiline strings of a stored output like nbformat.reads"""
+        output = dict(output)
+        if isinstance(output.get("text"), list):
+            output["text"] = "".join(output["text"])
+        if "data" in output:
+            output["data"] = dict((mimetype, "".join(value) if isinstance(value, list) else value)
+                                  for mimetype, value in output["data"].items())
+        return output
+
+    def _cells(self, keys, notebook=None):
+        """Yield cells with only keys decoded, top level metadata and
+        nbformat are stored in notebook"""
+        scanner = PwebJSONScanner(self.blocks())
+        for key in scanner.members():
+            if key == "cells":
+                yield from self._cellarray(scanner, keys)
+            elif key == "worksheets":
+                # nbformat 3, only the first worksheet is used
+                for i in scanner.items():
+                    if i > 0:
+                        scanner.skip()
+                        continue
+                    for key in scanner.members():
+                        if key == "cells":
+                            yield from self._cellarray(scanner, keys)
+                        else:
+                            scanner.skip()
+            elif notebook is not None and key in ("metadata", "nbformat"):
+                notebook[key] = scanner.value()
             else:
-                self.parsed.append(
-                    {'type': "doc", "content": "\n" + "".join(cell['source']), "options": {}, "number": docN})
-                docN += 1
-
-    def getparsed(self):
-        return copy.deepcopy(self.parsed)
+                scanner.skip()
+
+    def _cellarray(self, scanner, keys):
+        for _ in scanner.items():
+            scanner.peek()
+            cell = {"start_line": scanner.lineno()}
+            for key in scanner.members():
+                if key in keys:
+                    cell[key] = scanner.value()
+                else:
+                    scanner.skip()
+            yield cell
+
+    @staticmethod
+    def _source(cell):
+        source = cell.get("input", cell.get("source", ""))
+        if isinstance(source, list):
+            source = "".join(source)
+        return source
+
+    def _chunk(self, cell, numbers):
+        chunk_type = "code" if cell.get("cell_type") == "code" else "doc"
+        metadata = cell.get("metadata") or {}
+        # JSON doesn't have tuples, options like f_size are written as lists
+        options = dict((key, tuple(value) if isinstance(value, list) else value)
+                       for key, value in (metadata.get("options") or {}).items())
+        chunk = {"type": chunk_type, "content": "\n" + self._source(cell),
+                 "options": options, "number": numbers[chunk_type],
+                 "start_line": cell["start_line"]}
+        numbers[chunk_type] += 1
+        return chunk
 
 
 class PwebReaders(object):
@@ -1,6 +1,8 @@
 import sys
+import os
 from optparse import OptionParser
 import pweave
+from pweave import daemon
 
 
 def weave():
@@ -9,7 +11,9 @@ def weave():
         sys.exit()
 
     # Command line options
-    parser = OptionParser(usage="pweave [options] sourcefile", version="Pweave " + pweave.__version__)
+    parser = OptionParser(usage="pweave [options] sourcefile [sourcefile ...]\n\n" +
+                                "Use - as the sourcefile to read the document from standard input",
+                          version="Pweave " + pweave.__version__)
     parser.add_option("-f", "--format", dest="doctype", default=None,
                       help="The output format. Available formats: " + pweave.PwebFormats.shortformats() +
                            " Use Pweave -l to list descriptions or see http://mpastell.com/pweave/formats.html")
@@ -28,16 +32,65 @@ def weave():
                       help="Use documentation mode, chunk code and results will be loaded from cache and inline code will be hidden")
     parser.add_option("-c", "--cache-results", dest="cache",
                       action="store_true", default=False,
-                      help="Cache results to disk for documentation mode")
+                      help="Cache results of each chunk to disk, unchanged chunks are not executed again")
     parser.add_option("-F", "--figure-directory", dest="figdir", default='figures',
                       help="Directory path for matplolib graphics: Default 'figures'")
     parser.add_option("--cache-directory", dest="cachedir", default='cache',
-                      help="Directory path for cached results used in documentation mode: Default 'cache'")
+                      help="Directory path for cached results: Default 'cache'")
     parser.add_option("-g", "--figure-format", dest="figformat", default=None,
                       help="Figure format for matplotlib graphics: Defaults to 'png' for rst and Sphinx html documents and 'pdf' for tex")
     parser.add_option("-t", "--mimetype", dest="mimetype", default=None,
                       help="Source document's text mimetype. This is used to set cell " +
                            "type in Jupyter notebooks")
+    parser.add_option("--stream", dest="stream", action="store_true", default=False,
+                      help="Write each chunk to the output file as soon as it has been " +
+                           "executed instead of keeping all results in memory")
+    parser.add_option("--profile", dest="profile", action="store_true", default=False,
+                      help="Print the time spent in each stage and chunk and write Chrome " +
+                           "trace events to a .trace.json file next to the output")
+    parser.add_option("--parse-cache", dest="parse_cache", action="store_true", default=False,
+                      help="Store the parsed document in the cache directory and don't parse " +
+                           "it again if it hasn't changed")
+    parser.add_option("--reuse-outputs", dest="reuse_outputs", action="store_true", default=False,
+                      help="Use outputs stored in an executed notebook instead of running " +
+                           "cells that haven't changed since it was run")
+    parser.add_option("--checkpoint", dest="checkpoint", action="store_true", default=False,
+                      help="Store a checkpoint of the kernel namespace after each chunk, later " +
+                           "runs restore it instead of running cached chunks again. Implies -c")
+    parser.add_option("--serializer", dest="serializer", default="pickle",
+                      help="Module used to store checkpoints: pickle, cloudpickle or dill. " +
+                           "Default is pickle")
+    parser.add_option("--from-chunk", dest="from_chunk", default=None,
+                      help="Resume from the chunk with this name or number: chunks above it " +
+                           "are not run and the kernel namespace is restored from the latest checkpoint")
+    parser.add_option("--snapshots", dest="snapshots", type="int", default=0,
+                      help="Keep forks of the Python kernel after this many chunks when " +
+                           "watching or using the daemon, Linux only. Default is 0")
+    parser.add_option("--pipeline", dest="pipeline", type="int", default=0,
+                      help="Send the code of this many chunks to the kernel ahead of the " +
+                           "running chunk instead of waiting for each chunk. Default is 0")
+    parser.add_option("--parallel", dest="parallel", type="int", default=0,
+                      help="Run chunks that don't depend on each other at the same time " +
+                           "using this many extra Python kernels. Default is 0")
+    parser.add_option("-j", "--jobs", dest="jobs", type="int", default=None,
+                      help="Number of documents to weave in parallel when weaving several " +
+                           "documents: Default is the number of CPUs")
+    parser.add_option("-w", "--watch", dest="watch", action="store_true", default=False,
+                      help="Weave the document again when it or files it reads with the source " +
+                           "chunk option change")
+    parser.add_option("--start-daemon", dest="start_daemon", action="store_true", default=False,
+                      help="Start a daemon that keeps kernels running between weaves")
+    parser.add_option("--stop-daemon", dest="stop_daemon", action="store_true", default=False,
+                      help="Stop a running daemon")
+    parser.add_option("--daemon", dest="daemon", action="store_true", default=False,
+                      help="Send the document to a running daemon for weaving. The daemon " +
+                           "only runs chunks starting from the first changed chunk")
+    parser.add_option("--socket", dest="socket", default=None,
+                      help="Socket used to communicate with the daemon: Default " +
+                           "from environment variable PWEAVE_SOCKET or pweave-<uid>.sock in the temp directory")
+    parser.add_option("--run-chunk", dest="run_chunk", default=None,
+                      help="Run a single chunk given by name or number using a running daemon " +
+                           "and print the output")
 
     (options, args) = parser.parse_args()
 
@@ -50,7 +103,82 @@ def weave():
     if options.figformat is not None:
         opts_dict["figformat"] = ('.%s' % options.figformat)
 
-    pweave.weave(infile, **opts_dict)
+    jobs = opts_dict.pop("jobs")
+    if len(args) > 1 or jobs is not None:
+        opts_dict.pop("snapshots")
+        weave_batch(args, jobs, opts_dict)
+        return
+
+    socket_path = opts_dict.pop("socket")
+    if opts_dict.pop("start_daemon"):
+        daemon.PwebDaemon(socket_path).serve()
+        return
+    if opts_dict.pop("stop_daemon"):
+        daemon.request({"command": "shutdown"}, socket_path)
+        return
+
+    if opts_dict.pop("watch"):
+        for key in ["listformats", "docmode", "figformat", "run_chunk", "daemon", "stream",
+                    "profile", "reuse_outputs", "checkpoint", "serializer", "from_chunk",
+                    "parallel"]:
+            opts_dict.pop(key)
+        pweave.watch(infile, **opts_dict)
+        return
+
+    run_chunk = opts_dict.pop("run_chunk")
+    use_daemon = opts_dict.pop("daemon") and not options.listformats
+    if use_daemon and infile == pweave.STDIN:
+        sys.stderr.write("The daemon can't read standard input\n")
+        sys.exit(1)
+    if run_chunk is not None or use_daemon:
+        weave_with_daemon(infile, socket_path, run_chunk, opts_dict)
+    else:
+        # The kernel isn't kept running so snapshots wouldn't be used
+        opts_dict.pop("snapshots")
+        pweave.weave(infile, **opts_dict)
+
+
+def weave_batch(files, jobs, opts_dict):
+    """Weave several files in parallel"""
+    if opts_dict["output"] is not None and len(files) > 1:
+        sys.stderr.write("The output option can't be used with several input files\n")
+        sys.exit(1)
+    for key in ["listformats", "figformat", "socket", "start_daemon", "stop_daemon",
+                "daemon", "run_chunk", "watch"]:
+        opts_dict.pop(key)
+
+    results = pweave.weave_batch(files, jobs, **opts_dict)
+    if not all(r.ok for r in results):
+        sys.exit(1)
+
+
+def weave_with_daemon(infile, socket_path, run_chunk, opts_dict):
+    """Send the document to a running daemon"""
+    opts_dict.pop("listformats")
+    if opts_dict.pop("figformat") is not None:
+        sys.stdout.write("figformat option is not implemented for Pweave >= 0.3")
+    opts_dict["file"] = os.path.abspath(infile)
+    if opts_dict["output"] is not None:
+        opts_dict["output"] = os.path.abspath(opts_dict["output"])
+
+    if run_chunk is None:
+        opts_dict["command"] = "weave"
+    else:
+        opts_dict["command"] = "run_chunk"
+        opts_dict["chunk"] = run_chunk
+
+    try:
+        response = daemon.request(opts_dict, socket_path)
+    except OSError as e:
+        sys.stderr.write("Can't connect to Pweave daemon: %s\n" % e)
+        sys.exit(1)
+
+    sys.stdout.write(response["log"])
+    if response["status"] != "ok":
+        sys.stderr.write(response["error"])
+        sys.exit(1)
+    if run_chunk is not None:
+        sys.stdout.write(daemon.outputs_to_text(response["outputs"]))
 
 
 def publish():
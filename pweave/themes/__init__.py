@@ -1,14 +1,17 @@
 # -*- coding: utf-8 -*-
 
-from . import bootstrap
-from . import cerulean
-from . import skeleton
-from . import journal
-
-bootstrap = bootstrap.css
-cerulean = cerulean.css
-skeleton = skeleton.css
-journal = journal.css
+import importlib
+
+# The themes are large, css of a theme is imported when it is used
+_themes = ("bootstrap", "cerulean", "skeleton", "journal")
+
+
+def __getattr__(name):
+    if name in _themes:
+        css = importlib.import_module("." + name, __name__).css
+        globals()[name] = css
+        return css
+    raise AttributeError("module %r has no attribute %r" % (__name__, name))
 
 pweave = u"""
       body
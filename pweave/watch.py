@@ -0,0 +1,86 @@
+"""
+Weave documents again when the source changes
+"""
+
+import os
+import sys
+import time
+import traceback
+
+from .chunks import source_files
+
+
+class PwebWatcher(object):
+    """Watch a document and the files it reads using the ``source`` chunk option
+    and weave it again when they change. The kernel is kept running between
+    weaves and only the chunks starting from the first changed one are executed.
+    The kernel is rolled back to the state after the last unchanged chunk first,
+    so the results are the same as from weaving the document from scratch.
+
+    :param doc: :py:class:`pweave.Pweb` document to watch
+    :param interval: ``float`` seconds between checking for changes
+    :param debounce: ``float`` wait until files have not changed for this
+                     many seconds before weaving
+    """
+
+    def __init__(self, doc, interval=0.5, debounce=0.5):
+        self.doc = doc
+        self.interval = interval
+        self.debounce = debounce
+        self.weaves = 0
+
+    def files(self):
+        """List the watched files"""
+        return [self.doc.source] + source_files(self.doc.parsed, os.path.dirname(self.doc.source))
+
+    def snapshot(self):
+        """Get modification times of the watched files"""
+        mtimes = {}
+        for name in self.files():
+            try:
+                mtimes[name] = os.stat(name).st_mtime_ns
+            except OSError:
+                mtimes[name] = None
+        return mtimes
+
+    def weave(self):
+        """Weave the document, errors are printed and watching continues"""
+        try:
+            if self.weaves > 0:
+                self.doc.read(reader=self.doc.informat)
+            self.doc.weave(incremental=True)
+        except Exception:
+            traceback.print_exc()
+        self.weaves += 1
+
+    def wait(self, mtimes):
+        """Wait until the watched files change and stop changing"""
+        while self.snapshot() == mtimes:
+            time.sleep(self.interval)
+        # Wait for a burst of changes e.g. from an editor to finish
+        mtimes = self.snapshot()
+        while True:
+            time.sleep(self.debounce)
+            current = self.snapshot()
+            if current == mtimes:
+                return
+            mtimes = current
+
+    def watch(self, max_weaves=None):
+        """Weave the document and keep weaving it after changes until
+        interrupted with Ctrl-C
+
+        :param max_weaves: ``int`` stop after this many weaves, used for testing
+        """
+        try:
+            while True:
+                mtimes = self.snapshot()
+                self.weave()
+                if max_weaves is not None and self.weaves >= max_weaves:
+                    break
+                sys.stdout.write("Watching %s for changes\n" % ", ".join(mtimes))
+                self.wait(mtimes)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.doc.close()
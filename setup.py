@@ -40,6 +40,7 @@ setup(name='Pweave',
       extras_require = {'test': ['scipy', 'matplotlib', 'coverage',
                                    'ipython', 'nose', 'notebook'],
                         'doc' : ['sphinx', 'sphinx_rtd_theme']},
+      python_requires='>=3.8',
       license='LICENSE.txt',
       long_description = read('README.rst'),
       classifiers=[
@@ -51,8 +52,10 @@ setup(name='Pweave',
         'Topic :: Documentation :: Sphinx',
         'License :: OSI Approved :: BSD License',
         'Programming Language :: Python :: 3 :: Only',
-        'Programming Language :: Python :: 3.5',
-        'Programming Language :: Python :: 3.6',
+        'Programming Language :: Python :: 3.8',
+        'Programming Language :: Python :: 3.9',
+        'Programming Language :: Python :: 3.10',
+        'Programming Language :: Python :: 3.11',
         ]
 
 )
@@ -0,0 +1,55 @@
+import asyncio
+import time
+
+import pytest
+
+import pweave
+from pweave.processors import AsyncJupyterProcessor
+
+
+def test_async_processor(tmpdir):
+    """Test that outputs are passed to the callback as they arrive"""
+    name = str(tmpdir.join("async.pmd"))
+    with open(name, "w") as f:
+        f.write("```python\nimport time\nfor i in range(3):\n"
+                "    print(i, flush=True)\n    time.sleep(0.2)\n```\n\nTwo is <%= 1 + 1 %>\n")
+    arrived = []
+    doc = pweave.Pweb(name, doctype="pandoc")
+    doc.setkernel("python3", {"output_callback": lambda chunk, out: arrived.append(time.time())})
+    doc.run(Processor=AsyncJupyterProcessor)
+    doc.format()
+    doc.write()
+    out = tmpdir.join("async.md").read()
+    assert "0\n1\n2" in out
+    assert "Two is 2" in out
+    assert len(arrived) == 4
+    assert arrived[2] - arrived[0] > 0.3
+
+
+def test_async_concurrent(tmpdir):
+    """Test running code in two kernels concurrently and interrupting on timeout"""
+    loop = asyncio.new_event_loop()
+    source = str(tmpdir.join("async.pmd"))
+    procs = [AsyncJupyterProcessor([], "python3", source, False, "figures", str(tmpdir), loop=loop)
+             for i in range(2)]
+
+    async def run():
+        return await asyncio.gather(*[proc.execute("import time\ntime.sleep(1)\nprint(%i)" % i)
+                                      for i, proc in enumerate(procs)])
+
+    try:
+        start = time.time()
+        results = loop.run_until_complete(run())
+        assert time.time() - start < 1.8
+        assert [outputs[0]["text"] for outputs in results] == ["0\n", "1\n"]
+
+        procs[0].timeout = 0.2
+        with pytest.raises(TimeoutError):
+            procs[0].run_cell("time.sleep(0.5)")
+        procs[1].timeout = 0.2
+        procs[1].interrupt_on_timeout = True
+        assert procs[1].run_cell("time.sleep(10)")[0]["ename"] == "KeyboardInterrupt"
+    finally:
+        for proc in procs:
+            proc.close()
+        loop.close()
@@ -0,0 +1,22 @@
+import pweave
+
+
+def test_weave_batch(tmpdir, capsys):
+    """Test parallel weaving with a failing document"""
+    files = []
+    for i in range(3):
+        name = str(tmpdir.join("batch%i.pmd" % i))
+        with open(name, "w") as f:
+            f.write("```python\nprint(%i * 7)\n```\n" % i)
+        files.append(name)
+    files.append(str(tmpdir.join("missing.pmd")))
+
+    results = pweave.weave_batch(files, jobs = 2, doctype = "pandoc")
+    out = capsys.readouterr().out
+
+    assert [r.file for r in results] == files
+    assert [r.ok for r in results] == [True, True, True, False]
+    assert "Weaved 3 of 4 documents" in out
+    assert "Error weaving %s" % files[3] in out
+    for i in range(3):
+        assert str(i * 7) in tmpdir.join("batch%i.md" % i).read()
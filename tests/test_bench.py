@@ -0,0 +1,45 @@
+import json
+
+from pweave import bench
+from pweave.readers import PwebReaders
+
+
+def test_parse(tmpdir):
+    """Test that generated documents parse to the same code with each reader"""
+    results = bench.bench_parse(str(tmpdir), 5, 2, 10, repeat=1)
+    assert set(r["name"] for r in results) == set(PwebReaders.formats)
+    for r in results:
+        assert r["chunks_per_second"] > 0 and r["peak_memory"] > 0
+
+    code = set()
+    for informat in PwebReaders.formats:
+        name = bench.write_document(str(tmpdir), informat, chunks=5, outputs=2, figure_size=10)
+        reader = PwebReaders.get_reader(informat)(file=name)
+        reader.parse()
+        chunks = [c["content"].strip() for c in reader.getparsed() if c["type"] == "code"]
+        assert len(chunks) == 6
+        code.add(tuple(chunks))
+    assert len(code) == 1
+
+
+def test_compare():
+    old = {"results": [{"benchmark": "parse", "name": "noweb",
+                        "chunks_per_second": 100.0, "peak_memory": 1000}]}
+    new = {"results": [{"benchmark": "parse", "name": "noweb",
+                        "chunks_per_second": 50.0, "peak_memory": 1050}]}
+    rows = bench.compare(old, new, threshold=0.1)
+    assert [row[2] for row in rows] == ["chunks_per_second", "peak_memory"]
+    assert [row[-1] for row in rows] == [True, False]
+
+
+def test_main(tmpdir, capsys):
+    """Test the command line with all benchmarks on a small document"""
+    output = str(tmpdir.join("bench.json"))
+    bench.main(["-n", "3", "-r", "1", "-m", "-s", "100", "-o", output])
+    results = json.load(open(output))
+    assert results["params"]["chunks"] == 3
+    stages = set(r["benchmark"] for r in results["results"])
+    assert stages == {"parse", "run", "format"}
+    run = [r for r in results["results"] if r["benchmark"] == "run"][0]
+    assert run["seconds_per_chunk"] is not None
+    assert "Chunks/s" in capsys.readouterr().out
@@ -1,5 +1,7 @@
 import pweave
+from pweave.processors.cache import PwebChunkCache
 import shutil
+import os
 
 def test_cache():
     """Test caching shell"""
@@ -8,6 +10,91 @@ def test_cache():
     pweave.weave("tests/processors/processor_test.pmd", docmode = True)
     assertSameContent("tests/processors/processor_test.md", "tests/processors/processor_cache_ref.md")
 
+def test_chunk_cache(tmpdir, capsys):
+    """Test that unchanged chunks are served from cache"""
+    doc = '```python\nx = 1\nprint(x)\n```\n\n```python, echo = %s\nprint(x + %i)\n```\n'
+    source = str(tmpdir.join("chunk_cache.pmd"))
+    output = str(tmpdir.join("chunk_cache.md"))
+
+    def weave(echo, n):
+        with open(source, "w") as f:
+            f.write(doc % (echo, n))
+        pweave.weave(source, doctype = "pandoc", cache = True)
+        with open(output) as f:
+            return f.read(), capsys.readouterr().out
+
+    out, log = weave(True, 1)
+    assert "Using cached" not in log
+    # Formatting options don't invalidate results
+    out, log = weave(False, 1)
+    assert log.count("Using cached") == 2
+    assert "print(x + 1)" not in out and "2" in out
+    # Changed chunk is executed after replaying the first one
+    out, log = weave(True, 2)
+    assert log.count("Using cached") == 1
+    assert "Replaying 1 cached chunks" in log
+    assert "3" in out
+    # Stale entries are removed
+    assert len(os.listdir(str(tmpdir.join("cache", "chunk_cache")))) == 3
+
+def test_fig_key():
+    """Test that the fig option is part of the key, it decides if figures are saved"""
+    cache = PwebChunkCache()
+    chunk = {"content": "plot(x)", "options": {"fig": False, "echo": True}}
+    key = cache.key("", chunk)
+    assert cache.key("", dict(chunk, options = {"fig": False, "echo": False})) == key
+    assert cache.key("", dict(chunk, options = {"fig": True, "echo": True})) != key
+
+def test_incremental(tmpdir, capsys):
+    """Test that incremental weave resumes from the first changed chunk"""
+    text = '```python\nx = 1\n```\n\nx is <%%= x %%>\n\n```python\nprint(x + %i)\n```\n'
+    source = str(tmpdir.join("incremental.pmd"))
+    output = str(tmpdir.join("incremental.md"))
+
+    with open(source, "w") as f:
+        f.write(text % 1)
+    doc = pweave.Pweb(source, doctype = "pandoc")
+    doc.weave(incremental = True)
+    capsys.readouterr()
+
+    with open(source, "w") as f:
+        f.write(text % 2)
+    doc.read()
+    doc.weave(incremental = True)
+    log = capsys.readouterr().out
+    doc.close()
+
+    assert log.count("Using cached") == 1
+    assert "Replaying" not in log
+    with open(output) as f:
+        out = f.read()
+    assert "x is 1" in out and "3" in out
+
+def test_incremental_rollback(tmpdir, capsys):
+    """Test that chunks below a changed chunk in the previous run don't affect the next run"""
+    text = '```python\nx = [1]\n```\n\n```python\n%s\nprint(x)\n```\n\n```python\nx.append(2)\n```\n'
+    source = str(tmpdir.join("rollback.pmd"))
+    output = str(tmpdir.join("rollback.md"))
+
+    with open(source, "w") as f:
+        f.write(text % "")
+    doc = pweave.Pweb(source, doctype = "pandoc")
+    doc.weave(incremental = True)
+
+    with open(source, "w") as f:
+        f.write(text % "x.append(3)")
+    doc.read()
+    capsys.readouterr()
+    doc.weave(incremental = True)
+    log = capsys.readouterr().out
+    doc.close()
+
+    assert "Restarting kernel" in log
+    assert "Replaying 1 cached chunks" in log
+    with open(output) as f:
+        out = f.read()
+    assert "[1, 3]" in out and "[1, 2, 3]" not in out
+
 def assertSameContent(REF, outfile):
     out = open(outfile)
     ref = open(REF)
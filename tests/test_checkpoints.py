@@ -0,0 +1,79 @@
+import pytest
+
+import pweave
+from pweave.config import rcParams
+
+
+DOC = """
+```python
+import math
+x = [1, 2]
+```
+
+```python
+x.append(3)
+```
+
+```python
+print({0})
+```
+"""
+
+
+def weave(tmpdir, code, capsys, **kwargs):
+    name = str(tmpdir.join("checkpoints.pmd"))
+    with open(name, "w") as f:
+        f.write(DOC.format(code))
+    capsys.readouterr()
+    pweave.weave(name, doctype="pandoc", checkpoint=True, **kwargs)
+    return tmpdir.join("checkpoints.md").read(), capsys.readouterr().out
+
+
+def test_restore_checkpoint(tmpdir, capsys):
+    """Test that the namespace is restored from a checkpoint instead of replaying chunks"""
+    out, log = weave(tmpdir, "x", capsys)
+    assert "Stored checkpoint after chunk 3" in log
+    assert len(tmpdir.join("cache", "checkpoints", "checkpoints").listdir()) == 3
+
+    out, log = weave(tmpdir, "x, math.pi", capsys)
+    assert "[1, 2, 3] 3.14" in out
+    assert "Restored kernel state from checkpoint after chunk 2" in log
+    assert "Replaying" not in log
+    # The options of weave are not left in rcParams for the next documents
+    assert rcParams["checkpoints"] is False
+    assert rcParams["storeresults"] is False
+    assert len(tmpdir.join("cache", "checkpoints", "checkpoints").listdir()) == 3
+
+
+def test_from_chunk(tmpdir, capsys):
+    """Test resuming from a chunk after earlier chunks have changed"""
+    weave(tmpdir, "x", capsys)
+    with open(str(tmpdir.join("checkpoints.pmd"))) as f:
+        changed = f.read().replace("x = [1, 2]", "x = [1]")
+    tmpdir.join("checkpoints.pmd").write(changed)
+    capsys.readouterr()
+    pweave.weave(str(tmpdir.join("checkpoints.pmd")), doctype="pandoc", from_chunk="3")
+    log = capsys.readouterr().out
+    assert "Skipping chunk 1" in log
+    assert "Resuming from checkpoint after chunk 2" in log
+    assert "[1, 2, 3]" in tmpdir.join("checkpoints.md").read()
+
+
+def test_serializer(tmpdir, capsys):
+    """Test that functions defined in the document need a serializer that stores them by value"""
+    doc = DOC.replace("import math", "def f(): return 42")
+    tmpdir.join("checkpoints.pmd").write(doc.format("f()"))
+    capsys.readouterr()
+    pweave.weave(str(tmpdir.join("checkpoints.pmd")), doctype="pandoc", checkpoint=True)
+    assert "can't be serialized: f" in capsys.readouterr().out
+
+    pytest.importorskip("cloudpickle")
+    tmpdir.join("checkpoints.pmd").write(doc.format("f() + 1"))
+    pweave.weave(str(tmpdir.join("checkpoints.pmd")), doctype="pandoc", checkpoint=True,
+                 serializer="cloudpickle")
+    tmpdir.join("checkpoints.pmd").write(doc.format("f() + 2"))
+    capsys.readouterr()
+    pweave.weave(str(tmpdir.join("checkpoints.pmd")), doctype="pandoc", checkpoint=True,
+                 serializer="cloudpickle")
+    assert "Restored kernel state" in capsys.readouterr().out
+    assert "44" in tmpdir.join("checkpoints.md").read()
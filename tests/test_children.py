@@ -0,0 +1,75 @@
+import pweave
+
+
+PARENT = """# Parent
+
+```python
+x = "parent"
+print(x)
+```
+
+```python, child="chapters/one.pmd"
+```
+
+```python, child="chapters/two.pmd"
+```
+
+```python
+print(x)
+```
+"""
+
+CHILD = """## Chapter {0}
+
+```python
+print("chapter {0}")
+```
+"""
+
+
+def write(tmpdir):
+    tmpdir.join("parent.pmd").write(PARENT)
+    chapters = tmpdir.mkdir("chapters")
+    chapters.join("one.pmd").write(CHILD.format("one"))
+    chapters.join("two.pmd").write(CHILD.format("two"))
+    return str(tmpdir.join("parent.pmd"))
+
+
+def test_children(tmpdir, capsys):
+    """Test that children are included in order and only changed children are run again"""
+    name = write(tmpdir)
+    pweave.weave(name, doctype="pandoc", cache=True)
+    out = tmpdir.join("parent.md").read()
+    assert out.index("chapter one") < out.index("chapter two") < out.rindex("parent")
+    assert "## Chapter one" in out
+    assert "x = " not in out[out.index("Chapter one"):out.index("chapter two")]
+
+    tmpdir.join("chapters", "two.pmd").write(CHILD.format("2"))
+    capsys.readouterr()
+    pweave.weave(name, doctype="pandoc", cache=True)
+    log = capsys.readouterr().out
+    assert "Using cached results for child chapters/one.pmd" in log
+    assert "Waiting for child chapters/two.pmd" in log
+    assert "chapter 2" in tmpdir.join("parent.md").read()
+
+    # Files read with the source option are part of the key
+    tmpdir.join("chapters", "code.py").write('print("sourced 1")\n')
+    tmpdir.join("chapters", "one.pmd").write(
+        CHILD.format("one") + '\n```{python, source="%s"}\n```\n' % tmpdir.join("chapters", "code.py"))
+    pweave.weave(name, doctype="pandoc", cache=True)
+    tmpdir.join("chapters", "code.py").write('print("sourced 2")\n')
+    capsys.readouterr()
+    pweave.weave(name, doctype="pandoc", cache=True)
+    log = capsys.readouterr().out
+    assert "Waiting for child chapters/one.pmd" in log
+    assert "sourced 2" in tmpdir.join("parent.md").read()
+
+
+def test_children_nocache(tmpdir, capsys):
+    """Test that children are not cached unless results are cached"""
+    name = write(tmpdir)
+    pweave.weave(name, doctype="pandoc")
+    capsys.readouterr()
+    pweave.weave(name, doctype="pandoc")
+    assert "Using cached results for child" not in capsys.readouterr().out
+    assert not tmpdir.join("chapters", "cache").check()
@@ -0,0 +1,46 @@
+import pickle
+
+from pweave.chunks import PwebChunk, PwebChunkOptions, PwebChunkIndex
+
+
+def test_chunk_layers():
+    """Test that chunk keys are looked up from options and format defaults"""
+    defaults = {"echo": True, "wrap": "output", "name": None}
+    chunk = PwebChunk({"type": "code", "content": "1+1", "number": 1,
+                       "options": {"echo": False}})
+    chunk.setdefaults(defaults)
+    chunk.setformat({"codestart": "```", "wrap": "code"})
+
+    assert chunk["echo"] is False
+    assert chunk["wrap"] == "output"
+    assert chunk["codestart"] == "```"
+    assert "source" not in chunk
+    assert "%(codestart)s%(content)s" % chunk == "```1+1"
+    # Defaults are shared, not copied
+    assert chunk["options"].defaults is defaults
+    assert dict(chunk["options"]) == {"echo": False, "wrap": "output", "name": None}
+
+    copy = chunk.copy()
+    copy["content"] = "2+2"
+    copy["codestart"] = "~~~"
+    assert chunk["content"] == "1+1" and chunk["codestart"] == "```"
+
+    data = chunk.todict()
+    assert type(data["options"]) is dict
+    assert data["echo"] is False and data["codestart"] == "```"
+    assert PwebChunk.from_dict(data) == chunk
+
+    restored = pickle.loads(pickle.dumps(chunk, pickle.HIGHEST_PROTOCOL))
+    assert restored == chunk
+    assert isinstance(restored["options"], PwebChunkOptions)
+
+
+def test_chunk_index():
+    chunks = [{"type": "doc", "content": "", "number": 1},
+              {"type": "code", "content": "a", "number": 1, "options": {}},
+              {"type": "code", "content": "b", "number": 2, "options": {"name": "plot"}}]
+    index = PwebChunkIndex(chunks)
+    assert index.get(1)["content"] == "a"
+    assert index.get("2")["content"] == "b"
+    assert index.get("plot")["content"] == "b"
+    assert index.get("missing") is None
@@ -0,0 +1,31 @@
+import copy
+import inspect
+
+import pweave
+
+
+def test_no_deep_copies(tmpdir, monkeypatch):
+    """Test that documents are not deep copied between read, run and format"""
+    calls = []
+    deepcopy = copy.deepcopy
+
+    def counting_deepcopy(x, *args, **kwargs):
+        module = inspect.currentframe().f_back.f_globals.get("__name__", "")
+        if module.startswith("pweave"):
+            calls.append(module)
+        return deepcopy(x, *args, **kwargs)
+
+    monkeypatch.setattr(copy, "deepcopy", counting_deepcopy)
+
+    name = str(tmpdir.join("copies.pmd"))
+    with open(name, "w") as f:
+        f.write("Text <%= 1 + 1 %>\n\n```python\nprint('x' * 1000)\n1/0\n```\n")
+    doc = pweave.Pweb(name, doctype="pandoc")
+    doc.weave()
+
+    assert calls == []
+    # Parsed chunks are not modified by running and formatting
+    assert doc.parsed[0]["content"] == "Text <%= 1 + 1 %>\n\n"
+    assert "result" not in doc.parsed[1]
+    out = tmpdir.join("copies.md").read()
+    assert "x" * 1000 in out and "ZeroDivisionError" in out
@@ -0,0 +1,42 @@
+import pweave
+from pweave import daemon
+import threading
+import os
+
+
+def test_daemon(tmpdir):
+    """Test weaving and running chunks using the daemon"""
+    socket_path = str(tmpdir.join("pweave.sock"))
+    source = str(tmpdir.join("daemon.pmd"))
+    with open(source, "w") as f:
+        f.write('```python, name = "first"\nx = 41\n```\n\n```python\nprint(x + 1)\n```\n')
+
+    server = daemon.PwebDaemon(socket_path)
+    thread = threading.Thread(target=server.serve)
+    thread.start()
+    try:
+        for i in range(50):
+            if daemon.is_running(socket_path):
+                break
+            thread.join(0.1)
+
+        response = daemon.request({"command": "weave", "file": source,
+                                   "doctype": "pandoc"}, socket_path)
+        assert response["status"] == "ok"
+        assert "42" in open(response["sink"]).read()
+
+        response = daemon.request({"command": "weave", "file": source,
+                                   "doctype": "pandoc"}, socket_path)
+        assert response["log"].count("Using cached") == 2
+
+        response = daemon.request({"command": "run_chunk", "file": source,
+                                   "chunk": 2}, socket_path)
+        assert daemon.outputs_to_text(response["outputs"]) == "42\n"
+
+        response = daemon.request({"command": "run_chunk", "file": source,
+                                   "chunk": "missing"}, socket_path)
+        assert response["status"] == "error"
+    finally:
+        daemon.request({"command": "shutdown"}, socket_path)
+        thread.join()
+    assert not os.path.exists(socket_path)
@@ -0,0 +1,64 @@
+from pweave.chunks import PwebChunk
+from pweave.config import rcParams
+from pweave.dependencies import names, PwebDependencies
+
+
+def test_names():
+    """Test finding the global names code defines and uses"""
+    assert names("import numpy as np\nx = np.sum(n)") == ({"np", "x", "n"}, {"n"})
+    assert names("print(len(x), ', '.join(y))") == (set(), {"print", "len", "x", "y"})
+    assert names("def f(a):\n    b = a + c\n    return b\ny = f(1)") == ({"f", "y"}, {"c"})
+    assert names("x += 1\nd['k'] = [i for i in v]") == ({"x", "d"}, {"x", "d", "v"})
+    assert names("%timeit x") is None
+    assert names("from os import *") is None
+
+
+def chunks(*code, **options):
+    result = []
+    for i, content in enumerate(code):
+        chunk = PwebChunk({"type": "code", "content": content, "number": i + 1,
+                           "options": dict(options.get(str(i + 1), {}))})
+        chunk.setdefaults(rcParams["chunk"]["defaultoptions"])
+        result.append(chunk)
+    return result
+
+
+def test_dependencies():
+    """Test the dependency graph of chunks"""
+    graph = PwebDependencies(chunks("data = [1, 2]",
+                                    "a = sum(data)",
+                                    "b = max(data)",
+                                    "print(a, b)",
+                                    "exec('c = 1')",
+                                    "print(data)",
+                                    "print(1)",
+                                    **{"7": {"depends": "3"}}))
+    assert graph.parents[("code", 2)] == {("code", 1)}
+    assert graph.parents[("code", 3)] == {("code", 1)}
+    assert graph.ancestors(("code", 4)) == [("code", 1), ("code", 2), ("code", 3)]
+    assert graph.parents[("code", 5)] == {("code", i) for i in range(1, 5)}
+    assert graph.parents[("code", 6)] == {("code", 1), ("code", 5)}
+    assert ("code", 3) in graph.parents[("code", 7)]
+    assert ("code", 7) not in graph.needed
+
+
+def test_mutation():
+    """Test that calling methods or functions that change an object defines its name"""
+    assert names("data.append(2)") == ({"data"}, {"data"})
+    assert names("rng.shuffle(x)") == ({"rng", "x"}, {"rng", "x"})
+    graph = PwebDependencies(chunks("data = [1]",
+                                    "data.append(2)",
+                                    "def add():\n    data.append(3)",
+                                    "add()",
+                                    "print(data)"))
+    assert graph.parents[("code", 2)] == {("code", 1)}
+    assert graph.defined[("code", 4)] == {"data"}
+    assert graph.parents[("code", 5)] == {("code", 4)}
+
+
+def test_function_reads():
+    """Test that calling a function uses the global names the function reads"""
+    graph = PwebDependencies(chunks("def f():\n    return scale * 2",
+                                    "scale = 10",
+                                    "print(f())"))
+    assert graph.parents[("code", 3)] == {("code", 1), ("code", 2)}
@@ -0,0 +1,107 @@
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib import error
+
+import pytest
+
+import pweave
+from pweave.fetch import PwebHTTPCache
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        server = self.server
+        server.requests.append((self.path, self.headers.get("If-None-Match")))
+        if self.path == "/slow":
+            time.sleep(1)
+        if self.path == "/moved":
+            self.send_response(302)
+            self.send_header("Location", "/doc.pmd")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        if self.path not in server.documents:
+            self.send_error(404)
+            return
+        body = server.documents[self.path].encode("utf-8")
+        etag = '"%i"' % hash(body)
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("ETag", etag)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.daemon_threads = True
+    server.requests = []
+    server.documents = {"/doc.pmd": "```python\nprint(1 + 1)\n```\n",
+                        "/slow": "slow"}
+    server.url = "http://127.0.0.1:%i" % server.server_address[1]
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_conditional_requests(server, tmpdir):
+    """Test that unchanged documents are validated with ETag and not downloaded again"""
+    cache = PwebHTTPCache(str(tmpdir))
+    url = server.url + "/doc.pmd"
+    assert cache.fetch(url) == server.documents["/doc.pmd"].encode()
+    assert server.requests[-1][1] is None
+    assert cache.fetch(url) == server.documents["/doc.pmd"].encode()
+    assert server.requests[-1][1] is not None
+
+    server.documents["/doc.pmd"] = "changed"
+    assert cache.fetch(url) == b"changed"
+    # Server can't be reached, the cached copy is used
+    server.shutdown()
+    server.server_close()
+    cache.close()
+    assert cache.fetch(url) == b"changed"
+
+
+def test_errors(server, tmpdir):
+    cache = PwebHTTPCache(str(tmpdir), timeout=0.2)
+    with pytest.raises(error.HTTPError):
+        cache.fetch(server.url + "/missing")
+    with pytest.raises(OSError):
+        cache.fetch(server.url + "/slow")
+    assert cache.fetch(server.url + "/moved") == server.documents["/doc.pmd"].encode()
+
+
+def test_prefetch(server, tmpdir):
+    """Test that each document is fetched once and later reads validate the cached copy"""
+    urls = [server.url + "/doc.pmd", server.url + "/missing", server.url + "/doc.pmd"]
+    cache = PwebHTTPCache(str(tmpdir))
+    errors = cache.prefetch(urls, jobs=2)
+    assert errors[urls[0]] is None
+    assert isinstance(errors[urls[1]], error.HTTPError)
+    assert len(server.requests) == 2
+
+    PwebHTTPCache(str(tmpdir)).fetch(urls[0])
+    assert server.requests[-1][1] is not None
+
+
+def test_weave_url(server, tmpdir, monkeypatch):
+    monkeypatch.chdir(tmpdir)
+    monkeypatch.setitem(pweave.rcParams, "urlcache", str(tmpdir.join("urls")))
+    doc = pweave.Pweb(server.url + "/doc.pmd", doctype="pandoc", output=str(tmpdir.join("doc.md")))
+    doc.weave()
+    assert "2" in tmpdir.join("doc.md").read()
@@ -0,0 +1,54 @@
+import os
+import sys
+import subprocess
+
+
+HEAVY = ["jupyter_client", "nbconvert", "IPython", "ipykernel", "nbformat",
+         "pygments", "pweave.themes.skeleton", "pweave.processors.jupyter"]
+
+
+def loaded_modules(code):
+    """Run code in a new interpreter and get the heavy modules it imported"""
+    code += "\nimport sys\nprint('loaded:', *[m for m in %r if m in sys.modules])" % HEAVY
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    out = subprocess.check_output([sys.executable, "-c", code], cwd=root)
+    return out.decode().splitlines()[-1].split()[1:]
+
+
+def test_import_is_lazy():
+    """Test that importing pweave doesn't import kernels, nbconvert or themes"""
+    assert loaded_modules("import pweave; pweave.PwebFormats.getformats()") == []
+
+
+def test_tangle_is_lazy(tmpdir):
+    """Test that tangling doesn't import the dependencies needed for weaving"""
+    name = str(tmpdir.join("lazy.pmd"))
+    with open(name, "w") as f:
+        f.write("```python\nx = 1\n```\n")
+    loaded = loaded_modules("import pweave; pweave.tangle(%r)" % name)
+    assert loaded == []
+    assert tmpdir.join("lazy.py").read().strip() == "x = 1"
+
+
+def test_lazy_attributes():
+    import pweave
+    from pweave.formatters.markdown import PwebPandocFormatter
+    assert pweave.PwebPandocFormatter is PwebPandocFormatter
+    assert pweave.formatters.PwebFormats.getFormatter("pandoc") is PwebPandocFormatter
+    assert pweave.PwebProcessors.getprocessor("python3") is pweave.IPythonProcessor
+    from pweave import themes
+    assert "body" in themes.skeleton
+
+
+def test_formats():
+    """Test that format classes and star imports resolve the lazy classes"""
+    from pweave.formatters import PwebFormats, PwebPandocFormatter
+    from pweave.processors import PwebProcessors, JupyterProcessor
+    assert PwebFormats.formats["pandoc"]["class"] is PwebPandocFormatter
+    assert PwebFormats.formats["markdown"].get("class") is PwebPandocFormatter
+    assert PwebProcessors.formats["jupyter"]["class"] is JupyterProcessor
+    namespace = {}
+    exec("from pweave import *", namespace)
+    assert namespace["PwebTexFormatter"] is PwebFormats.formats["tex"]["class"]
+    assert namespace["IPythonProcessor"] is PwebProcessors.formats["python"]["class"]
+    assert "weave" in namespace and "Pweb" in namespace
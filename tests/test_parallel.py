@@ -0,0 +1,76 @@
+import pweave
+from pweave.config import rcParams
+
+
+DOC = """
+```python
+data = [1, 2, 3]
+```
+
+```python
+total = sum(data) * 2
+```
+
+```python
+biggest = max(data)
+```
+
+The largest value is <%= biggest %>.
+
+```python
+print(total, biggest)
+```
+"""
+
+
+def weave(tmpdir, capsys, doc=DOC):
+    name = str(tmpdir.join("parallel.pmd"))
+    with open(name, "w") as f:
+        f.write(doc)
+    capsys.readouterr()
+    pweave.Pweb(name, doctype="pandoc").weave()
+    return tmpdir.join("parallel.md").read(), capsys.readouterr().out
+
+
+def test_parallel(tmpdir, capsys, monkeypatch):
+    """Test running independent chunks in worker kernels"""
+    expected, log = weave(tmpdir, capsys)
+    assert "12 3" in expected
+    monkeypatch.setitem(rcParams, "parallel", 2)
+    out, log = weave(tmpdir, capsys)
+    assert out == expected
+    assert "Running chunk 3 in a worker kernel" in log
+    # Chunk 2 uses data from chunk 1 that the processor runs right before it
+    assert "Running chunk 2 in a worker kernel" not in log
+
+
+def test_mutation(tmpdir, capsys, monkeypatch):
+    """Test that a chunk that changes an object by calling its methods is run
+    before the chunks that use the object"""
+    doc = '```python\ndata = [1]\n```\n\n```python\ndata.append(2)\n```\n\n' \
+          '```python\nprint("DATA", data)\n```\n'
+    monkeypatch.setitem(rcParams, "parallel", 2)
+    out, log = weave(tmpdir, capsys, doc)
+    assert "DATA [1, 2]" in out
+
+
+def test_order(tmpdir, capsys, monkeypatch):
+    """Test weaving more independent chunks than worker kernels, later chunks
+    can be queued on a worker before the earlier ones"""
+    doc = "".join("```python\n%s\n```\n\n" % code for code in
+                  ["a = 1", "b = 2", "e = 5", "c = a + 1", "d = 4", "f = 6",
+                   "print(a, b, c, d, e, f)"])
+    expected, log = weave(tmpdir, capsys, doc)
+    assert "1 2 2 4 5 6" in expected
+    monkeypatch.setitem(rcParams, "parallel", 2)
+    out, log = weave(tmpdir, capsys, doc)
+    assert out == expected
+
+
+def test_function_reads(tmpdir, capsys, monkeypatch):
+    """Test that a chunk calling a function gets the globals the function reads"""
+    doc = '```python\ndef f():\n    return scale * 2\n```\n\n```python\nscale = 10\n```\n\n' \
+          '```python\nprint("F", f())\n```\n'
+    monkeypatch.setitem(rcParams, "parallel", 2)
+    out, log = weave(tmpdir, capsys, doc)
+    assert "F 20" in out
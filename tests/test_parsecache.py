@@ -0,0 +1,53 @@
+import os
+import json
+
+import pweave
+from pweave.parsecache import PwebParseCache
+
+
+DOC = """Text
+
+```python, name="first"
+x = 1
+```
+"""
+
+
+def test_parse_cache(tmpdir, monkeypatch):
+    """Test that unchanged documents are loaded from the parse cache"""
+    name = str(tmpdir.join("cached.pmd"))
+    with open(name, "w") as f:
+        f.write(DOC)
+    cache = PwebParseCache()
+    parsed = pweave.Pweb(name, parse_cache=cache).parsed
+    assert os.path.isfile(cache.path(name))
+    assert cache.path(name).startswith(str(tmpdir.join("cache")))
+
+    def fail(self):
+        raise AssertionError("Document was parsed again")
+    with monkeypatch.context() as m:
+        m.setattr(pweave.PwebMarkdownReader, "parse", fail)
+        doc = pweave.Pweb(name, parse_cache=cache)
+        assert doc.parsed == parsed
+        assert doc.getchunk("first")["content"] == "\nx = 1"
+        # The key depends on the reader
+        assert pweave.Pweb(name, informat="script", parse_cache=cache).parsed != parsed
+
+    with open(name, "a") as f:
+        f.write("More text\n")
+    assert pweave.Pweb(name, parse_cache=cache).parsed[-1]["content"].endswith("More text\n")
+
+
+def test_parse_cache_notebook(tmpdir, monkeypatch):
+    """Test that a cached notebook is not loaded"""
+    nb = {"metadata": {"name": "test"}, "nbformat": 3, "nbformat_minor": 0,
+          "worksheets": [{"cells": [{"cell_type": "code", "input": "1 + 1",
+                                     "language": "python", "outputs": []}]}]}
+    name = str(tmpdir.join("cached.ipynb"))
+    with open(name, "w") as f:
+        json.dump(nb, f)
+    cache = PwebParseCache(str(tmpdir.join("parsed")))
+    parsed = pweave.Pweb(name, informat="notebook", parse_cache=cache).parsed
+    monkeypatch.setattr(pweave.PwebNBReader, "iterparse", None)
+    doc = pweave.Pweb(name, informat="notebook", parse_cache=cache)
+    assert doc.parsed == parsed
@@ -0,0 +1,55 @@
+import pweave
+from pweave.config import rcParams
+from pweave.processors import JupyterProcessor
+
+
+DOC = """
+```python
+x = 1
+```
+
+```python
+1/0
+```
+
+```python
+print("after error", x)
+x += 1
+```
+
+Inline <%= x %>
+
+```python
+print("last", x)
+```
+"""
+
+
+def weave(tmpdir):
+    name = str(tmpdir.join("pipeline.pmd"))
+    with open(name, "w") as f:
+        f.write(DOC)
+    doc = pweave.Pweb(name, doctype="pandoc")
+    doc.setkernel("python3", {"embed_kernel": False})
+    doc.weave()
+    return tmpdir.join("pipeline.md").read()
+
+
+def test_pipeline(tmpdir, monkeypatch):
+    """Test that chunks sent to the kernel ahead give the same results as running them one at a time"""
+    submitted = []
+    submit = JupyterProcessor.submit
+
+    def counting_submit(self, code, chunk=None):
+        submitted.append(code)
+        return submit(self, code, chunk)
+
+    expected = weave(tmpdir)
+    assert "after error 1" in expected
+    assert "Inline 2" in expected
+
+    monkeypatch.setattr(JupyterProcessor, "submit", counting_submit)
+    monkeypatch.setitem(rcParams, "pipeline", 8)
+    assert weave(tmpdir) == expected
+    # Inline code is run by Pweave between the chunks
+    assert len(submitted) == 4
@@ -0,0 +1,40 @@
+import pytest
+
+import pweave
+from pweave.processors.pool import PwebKernelPool
+
+
+def test_kernel_pool(tmpdir):
+    """Test that kernels are reused and reset between documents"""
+    first = str(tmpdir.join("first.pmd"))
+    second = str(tmpdir.join("second.pmd"))
+    with open(first, "w") as f:
+        f.write("```python\nsecret = 42\nimport os\nprint(os.getpid())\n```\n")
+    with open(second, "w") as f:
+        f.write("```python\nprint('secret' in globals())\nimport os\nprint(os.getpid())\n```\n")
+
+    with PwebKernelPool(size = 1, max_uses = 2) as pool:
+        pweave.weave(first, doctype = "pandoc", kernel_pool = pool)
+        kernel = pool.idle["python3"][0]
+        assert kernel.uses == 1
+        pweave.weave(second, doctype = "pandoc", kernel_pool = pool)
+        # Recycled after two documents
+        assert pool.idle["python3"] == []
+        assert not kernel.km.is_alive()
+
+    out = tmpdir.join("second.md").read()
+    assert "False" in out
+    pid = str(kernel.pid)
+    assert pid in tmpdir.join("first.md").read() and pid in out
+
+
+def test_hung_kernel(tmpdir):
+    """Test that a kernel that doesn't reply is dropped from the pool"""
+    with PwebKernelPool(size = 1) as pool:
+        pool.timeout = 1
+        kernel = pool.acquire("python3", str(tmpdir))
+        with pytest.raises(TimeoutError):
+            kernel.execute("import time\ntime.sleep(30)", timeout = 1)
+        pool.release(kernel)
+        assert pool.idle["python3"] == []
+        assert not kernel.km.is_alive()
@@ -0,0 +1,42 @@
+import json
+
+import pweave
+from pweave.profiling import PwebProfiler
+
+
+def test_profiler():
+    profiler = PwebProfiler()
+    with profiler.span("run"):
+        with profiler.span("run", "code 1"):
+            with profiler.span("execute"):
+                pass
+    totals = profiler.totals()
+    assert set(totals) == {(None, "run"), ("code 1", "run"), ("code 1", "execute")}
+    table = profiler.table()
+    assert "code 1" in table and "execute" in table
+    events = profiler.trace()["traceEvents"]
+    assert [e["name"] for e in events] == ["execute", "run", "run"]
+    assert events[0]["args"]["chunk"] == "code 1" and events[0]["ph"] == "X"
+
+
+def test_weave_profile(tmpdir, capsys):
+    """Test that weaving with profile writes a table and a trace"""
+    name = str(tmpdir.join("profile.pmd"))
+    with open(name, "w") as f:
+        f.write("Text\n\n```python\nimport time\ntime.sleep(0.1)\n```\n")
+    pweave.weave(name, doctype="pandoc", profile=True)
+
+    out = capsys.readouterr().out
+    assert "code 1" in out and "Stage" in out
+    trace = json.loads(tmpdir.join("profile.trace.json").read())
+    names = set((e["name"], e["args"].get("chunk")) for e in trace["traceEvents"])
+    for stage in ["read", "run", "format", "write"]:
+        assert (stage, None) in names
+    for part in ["run", "execute", "collect", "pre_run_hook", "format"]:
+        assert (part, "code 1") in names
+    # The document is read before it is run, parse time isn't counted twice
+    stages = dict((e["name"], e) for e in trace["traceEvents"] if "chunk" not in e["args"])
+    assert stages["read"]["ts"] + stages["read"]["dur"] <= stages["run"]["ts"]
+    execute = [e for e in trace["traceEvents"]
+               if e["name"] == "execute" and e["args"].get("chunk") == "code 1"]
+    assert sum(e["dur"] for e in execute) >= 1e5
@@ -19,6 +19,101 @@ def test_url():
 
 
 
+def test_parse_same_as_lines():
+    """Test that scanning the text gives the same chunks as parsing line by line"""
+    from pweave.readers import PwebReader, PwebMarkdownReader, PwebScriptReader
+    documents = {
+        PwebReader: ["", "text", "a\n<<>>=\nx = 1\n@\nb\n", "<<name, echo=False>>=\r\n1\r\n  @ \r\n",
+                     "<<>>=\n\n@\n<<source='x.py'>>=\n@\n", "<<>>=\n<<a>>=\n@ x\nend",
+                     "x\x0c<<>>=\x0c1\n@\n\n\n"],
+        PwebMarkdownReader: ["# Title\n```python\nx = 1\n```\ntext\n", "```{python, echo=False}\n1\n~~~",
+                             "```r\nx\n```\n```python\n", " ```\n```python\n```python\n  ``` \n"],
+        PwebScriptReader: ["x = 1", "#' doc\n\nx = 1\n#+ name\ny = 2\n#' more\n",
+                           "#'\nx = 1\ny = 2\n\n#%% cell\n# %%+ echo=False\nz\n",
+                           "#+ a\n\n#+ b\n#' c\r\n# comment\n"]}
+    for Reader, docs in documents.items():
+        for doc in docs:
+            scanned = Reader(string=doc)
+            scanned.parse()
+            lines = Reader(string=doc)
+            lines.parse_lines()
+            assert scanned.parsed == lines.parsed, doc
+            assert scanned.lineNo == lines.lineNo
+
+
+def test_read_blocks(tmpdir):
+    """Test reading a document in blocks from a memory mapped file"""
+    import mmap
+    from pweave.readers import PwebReader
+    doc = "Tëxt\r\n<<name>>=\r\nx = '€'\r\n@\r\nmore"
+    name = str(tmpdir.join("blocks.texw"))
+    with open(name, "wb") as f:
+        f.write(doc.encode("utf-8"))
+    ref = PwebReader(string=doc)
+    ref.parse()
+    with open(name, "rb") as f:
+        reader = PwebReader(stream=mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+        reader.block_size = 3
+        assert list(reader.iterparse()) == ref.parsed
+    reader = PwebReader(file=name)
+    reader.block_size = 5
+    reader.parse()
+    assert reader.parsed == ref.parsed
+    assert reader.parsed[1]["content"] == "\nx = '€'"
+
+
+def test_options():
+    """Test that chunk options are parsed as literals and cached"""
+    from pweave.readers import parse_options, PwebReader, PwebOptionError
+    options = parse_options("plot, fig=TRUE, f_size=(8, 6), caption='a, b'")
+    assert options == {"name": "plot", "fig": True, "f_size": (8, 6), "caption": "a, b",
+                       "option_string": 'name = "plot", fig=TRUE, f_size=(8, 6), caption=\'a, b\''}
+    assert parse_options("label='x', echo=False") is parse_options("label='x', echo=False")
+    assert parse_options("label='x', echo=False")["name"] == "x"
+
+    reader = PwebReader(string="Text\n\n<<>>=\n1\n@\n<<echo=print('run')>>=\n2\n@\n")
+    try:
+        reader.parse()
+    except PwebOptionError as e:
+        assert e.lineno == 6
+        assert str(e).startswith("<string>:6: invalid chunk options")
+    else:
+        assert False, "Expected PwebOptionError"
+
+
+def test_parse_long_chunk():
+    from pweave.readers import PwebMarkdownReader
+    from pweave.bench import make_document
+    reader = PwebMarkdownReader(string=make_document("markdown", chunks=2, data_lines=50000))
+    reader.parse()
+    code = [c for c in reader.getparsed() if c["type"] == "code"]
+    assert len(code) == 4
+    assert code[-1]["content"].count("\n") == 50002
+    assert code[-1]["start_line"] == reader.lineNo
+
+
+def test_notebook():
+    """Test reading a notebook in small blocks, outputs are skipped"""
+    import io
+    import json
+    from pweave.readers import PwebNBReader
+    nb = {"cells": [{"cell_type": "markdown", "metadata": {}, "source": ["# Title\n", "Text"]},
+                    {"cell_type": "code", "execution_count": 1,
+                     "metadata": {"options": {"echo": False, "f_size": [4, 3]}},
+                     "outputs": [{"data": {"image/png": "iVBOR\\\"w0K" * 1000}, "metadata": {},
+                                  "output_type": "display_data"}],
+                     "source": "x = '}'\nprint(x)"}],
+          "metadata": {}, "nbformat": 4, "nbformat_minor": 2}
+    reader = PwebNBReader(stream=io.StringIO(json.dumps(nb, indent=1)))
+    reader.block_size = 7
+    reader.parse()
+    assert reader.parsed == [
+        {"type": "doc", "content": "\n# Title\nText", "options": {}, "number": 1,
+         "start_line": 3},
+        {"type": "code", "content": "\nx = '}'\nprint(x)",
+         "options": {"echo": False, "f_size": (4, 3)}, "number": 1, "start_line": 11}]
+
+
 def assertSameContent(REF, outfile):
     out = open(outfile)
     ref = open(REF)
@@ -0,0 +1,78 @@
+import json
+
+import pweave
+
+
+DOC = """
+```python
+x = 20
+print(x)
+```
+
+```python
+print(x + 1)
+```
+"""
+
+
+def executed_notebook(tmpdir):
+    name = str(tmpdir.join("doc.pmd"))
+    with open(name, "w") as f:
+        f.write(DOC)
+    pweave.weave(name, doctype="notebook")
+    return str(tmpdir.join("doc.ipynb"))
+
+
+def code_cells(nb):
+    return [cell for cell in nb["cells"] if cell["cell_type"] == "code"]
+
+
+def weave_notebook(tmpdir, name, **kwargs):
+    output = str(tmpdir.join("out.md"))
+    doc = pweave.Pweb(name, informat="notebook", doctype="pandoc", output=output,
+                      reuse_outputs=True, **kwargs)
+    doc.weave()
+    return open(output).read()
+
+
+def test_reuse_outputs(tmpdir, capsys):
+    """Test that cells are not run again and changed cells are run after replaying
+    the cells above"""
+    name = executed_notebook(tmpdir)
+    capsys.readouterr()
+    assert "21" in weave_notebook(tmpdir, name)
+    out = capsys.readouterr().out
+    assert "Using notebook outputs for chunk 1" in out
+    assert "Using notebook outputs for chunk 2" in out
+
+    nb = json.load(open(name))
+    code_cells(nb)[-1]["source"] = "print(x + 2)"
+    with open(name, "w") as f:
+        json.dump(nb, f)
+    assert "22" in weave_notebook(tmpdir, name)
+    out = capsys.readouterr().out
+    assert "Using notebook outputs for chunk 1" in out
+    assert "Replaying 1 cached chunks" in out
+
+
+def test_reuse_outputs_invalidated(tmpdir):
+    """Test that outputs are not used for a different kernel or cells run out of order"""
+    from pweave.readers import PwebNBReader
+    name = executed_notebook(tmpdir)
+    reader = PwebNBReader(name)
+    reader.reuse_outputs = True
+    reader.parse()
+    assert [c["outputs"][0]["text"] for c in reader.parsed if c["type"] == "code"] == ["20\n", "21\n"]
+
+    reader.kernel = "julia"
+    reader.parse()
+    assert not any("outputs" in c for c in reader.parsed)
+
+    nb = json.load(open(name))
+    code_cells(nb)[0]["execution_count"] = 5
+    with open(name, "w") as f:
+        json.dump(nb, f)
+    reader = PwebNBReader(name)
+    reader.reuse_outputs = True
+    reader.parse()
+    assert ["outputs" in c for c in reader.parsed if c["type"] == "code"] == [True, False]
@@ -0,0 +1,45 @@
+import sys
+
+import pytest
+
+import pweave
+from pweave.config import rcParams
+
+
+DOC = """
+```python
+counter = iter(range(10))
+```
+
+```python
+print(next(counter) + {0})
+```
+
+```python
+print("last", next(counter))
+```
+"""
+
+
+@pytest.mark.skipif(not sys.platform.startswith("linux"), reason="Snapshots use fork on Linux")
+def test_snapshots(tmpdir, capsys, monkeypatch):
+    """Test that a changed chunk continues from a snapshot of the kernel after the chunk above"""
+    monkeypatch.setitem(rcParams, "snapshots", 4)
+    name = tmpdir.join("snapshots.pmd")
+    name.write(DOC.format(0))
+    doc = pweave.Pweb(str(name), doctype="pandoc")
+    try:
+        doc.weave(incremental=True)
+        assert "last 1" in tmpdir.join("snapshots.md").read()
+
+        # The iterator can't be pickled and would be advanced by running the chunk again
+        name.write(DOC.format(100))
+        doc.read()
+        capsys.readouterr()
+        doc.weave(incremental=True)
+        out = tmpdir.join("snapshots.md").read()
+        assert "Resumed kernel from snapshot" in capsys.readouterr().out
+        assert "100" in out
+        assert "last 1" in out
+    finally:
+        doc.close()
@@ -0,0 +1,97 @@
+import pweave
+
+
+DOC = """% Title
+% Author
+% Date
+
+Some text with inline code <%= 1 + 1 %>
+
+```python
+x = [i**2 for i in range(5)]
+print(x)
+```
+
+```python, echo=False
+x[2]
+```
+"""
+
+
+class HeaderFormatter(pweave.PwebPandocFormatter):
+
+    def initformat(self):
+        super(HeaderFormatter, self).initformat()
+        self.header = "<header>\n"
+        self.footer = "\n<footer>"
+
+
+def weave_both(tmpdir, doctype):
+    name = str(tmpdir.join("stream.pmd"))
+    with open(name, "w") as f:
+        f.write(DOC)
+
+    doc = pweave.Pweb(name, doctype=doctype, output=str(tmpdir.join("full")))
+    if doctype is None:
+        doc.setformat(Formatter=HeaderFormatter)
+    doc.weave()
+    doc = pweave.Pweb(name, doctype=doctype, output=str(tmpdir.join("streamed")))
+    if doctype is None:
+        doc.setformat(Formatter=HeaderFormatter)
+    doc.weave(stream=True)
+    assert doc.executed is None
+    return tmpdir.join("full").read(), tmpdir.join("streamed").read()
+
+
+def test_stream_markdown(tmpdir):
+    """Test that streaming gives the same output as weaving at once"""
+    full, streamed = weave_both(tmpdir, "pandoc")
+    assert "[0, 1, 4, 9, 16]" in streamed
+    assert full == streamed
+
+
+def test_stream_header(tmpdir):
+    """Test header and footer of streamed output"""
+    full, streamed = weave_both(tmpdir, None)
+    assert streamed.startswith("<header>\n% Title")
+    assert streamed.endswith("<footer>")
+    assert full == streamed
+
+
+class Blocks(object):
+    """File object that returns one line at a time and counts reads"""
+
+    def __init__(self, text):
+        self.lines = text.splitlines(True)
+        self.reads = 0
+
+    def read(self, size):
+        self.reads += 1
+        return self.lines.pop(0) if self.lines else ""
+
+
+def test_stream_reads_while_running(tmpdir):
+    """Test that the first chunks are run before the whole document has been read"""
+    name = str(tmpdir.join("stream.pmd"))
+    with open(name, "w") as f:
+        f.write(DOC)
+    doc = pweave.Pweb(name, doctype="pandoc")
+    stream = Blocks(DOC)
+    doc.reader = pweave.PwebMarkdownReader(stream=stream)
+
+    proc = doc._getprocessor(parsed=doc.iterparsed())
+    chunks = proc.iterrun()
+    assert next(chunks)["type"] == "doc"
+    code = next(chunks)
+    assert code["result"][0]["text"] == "[0, 1, 4, 9, 16]\n"
+    assert stream.lines
+    assert len(list(chunks)) == 3
+    assert not stream.lines
+
+
+def test_stream_stdin(tmpdir, monkeypatch):
+    import io
+    monkeypatch.chdir(tmpdir)
+    monkeypatch.setattr("sys.stdin", io.StringIO(DOC))
+    pweave.weave("-", informat="markdown", doctype="pandoc", stream=True)
+    assert "[0, 1, 4, 9, 16]" in tmpdir.join("stdin.md").read()
@@ -0,0 +1,59 @@
+import pweave
+from pweave.watch import PwebWatcher
+import threading
+import time
+import os
+
+
+def test_watch(tmpdir, capsys):
+    """Test weaving again after the included source file changes"""
+    source = str(tmpdir.join("watch.pmd"))
+    included = str(tmpdir.join("included.py"))
+    output = str(tmpdir.join("watch.md"))
+    with open(source, "w") as f:
+        f.write('```python\nx = 1\n```\n\n```{python, source = "%s"}\n```\n' % included)
+    with open(included, "w") as f:
+        f.write("print(x + 1)\n")
+
+    doc = pweave.Pweb(source, doctype = "pandoc")
+    watcher = PwebWatcher(doc, interval = 0.05, debounce = 0.1)
+    assert watcher.files() == [source, included]
+
+    thread = threading.Thread(target = watcher.watch, kwargs = {"max_weaves": 2})
+    thread.start()
+    while watcher.weaves == 0:
+        time.sleep(0.05)
+    assert "2" in open(output).read()
+
+    with open(included, "w") as f:
+        f.write("print(x + 2)\n")
+    # Make sure the modification time changes on coarse filesystems
+    os.utime(included, ns = (0, os.stat(included).st_mtime_ns + 10**9))
+    thread.join(30)
+
+    assert not thread.is_alive()
+    assert "3" in open(output).read()
+    assert capsys.readouterr().out.count("Using cached results for chunk 1") == 1
+
+
+def test_watch_rollback(tmpdir):
+    """Test that a chunk below the changed chunk in the previous weave doesn't change the results"""
+    text = '```python\nx = [1]\n```\n\n```python\n%s\nprint(x)\n```\n\n```python\nx.append(2)\n```\n'
+    source = str(tmpdir.join("rollback.pmd"))
+    output = str(tmpdir.join("rollback.md"))
+    with open(source, "w") as f:
+        f.write(text % "")
+
+    watcher = PwebWatcher(pweave.Pweb(source, doctype = "pandoc"))
+    try:
+        watcher.weave()
+        with open(source, "w") as f:
+            f.write(text % "x.append(3)")
+        watcher.weave()
+        watched = open(output).read()
+    finally:
+        watcher.doc.close()
+
+    pweave.Pweb(source, doctype = "pandoc").weave()
+    assert watched == open(output).read()
+    assert "[1, 3]" in watched